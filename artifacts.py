@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Pre-rendered, precompressed artifacts for a built playlist
+
+Next to playlist1.m3u this writes:
+
+    playlist1.m3u.gz / playlist1.m3u.br   precompressed copies
+    playlist1.groups/<group>.m3u(.gz/.br) one playlist per group-title
+    playlist1.channels.json               channel index (name, ids, logo, group, url)
+    playlist1.manifest.json               every artifact's size, ETag and encodings
+
+Servers can then answer with a static file send (and 304s on If-None-Match)
+instead of reading and rewriting the playlist per request. Files are only
+rewritten when their bytes change, so mtimes and ETags stay stable.
+
+Brotli output needs the optional brotli package (pip install brotli).
+"""
+import os
+import re
+import gzip
+import json
+import argparse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from build_cache import digest_bytes, write_if_changed
+from m3u_parser import iter_entries, parse_extinf
+
+MANIFEST_VERSION = 1
+CONTENT_TYPES = {'.m3u': 'application/x-mpegurl', '.json': 'application/json'}
+ENCODING_SUFFIX = {'gzip': '.gz', 'br': '.br'}
+
+
+def etag_for(data):
+    """Strong ETag derived from the content hash"""
+    return '"' + digest_bytes(data)[:32] + '"'
+
+
+def slugify(text):
+    """'Movies & Premium' -> 'movies-premium'"""
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-') or 'group'
+
+
+def compress(data):
+    """Return {encoding: bytes} for every supported encoding"""
+    # mtime=0 keeps gzip output byte-identical for identical input
+    encoded = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(data, quality=11)
+    return encoded
+
+
+class ArtifactWriter:
+    """Writes artifacts under one directory and collects their manifest entries"""
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.files = {}
+        self.written = []
+
+    def _write(self, rel_path, data):
+        path = os.path.join(self.base_dir, rel_path)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if write_if_changed(path, data):
+            self.written.append(rel_path)
+
+    def add(self, rel_path, data, precompress=True):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._write(rel_path, data)
+        entry = {
+            'size': len(data),
+            'etag': etag_for(data),
+            'content_type': CONTENT_TYPES.get(os.path.splitext(rel_path)[1], 'application/octet-stream'),
+            'encodings': {},
+        }
+        if precompress:
+            for encoding, body in compress(data).items():
+                encoded_path = rel_path + ENCODING_SUFFIX[encoding]
+                self._write(encoded_path, body)
+                entry['encodings'][encoding] = {
+                    'path': encoded_path, 'size': len(body), 'etag': etag_for(body)}
+        self.files[rel_path] = entry
+        return entry
+
+
+def _paths(playlist_path):
+    base_dir = os.path.dirname(os.path.abspath(playlist_path))
+    name = os.path.basename(playlist_path)
+    stem = os.path.splitext(name)[0]
+    return base_dir, name, stem, os.path.join(base_dir, stem + '.manifest.json')
+
+
+def load_manifest(playlist_path):
+    """The manifest written for `playlist_path`, or None"""
+    manifest_path = _paths(playlist_path)[3]
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _up_to_date(manifest, base_dir, digest):
+    if not manifest or manifest.get('version') != MANIFEST_VERSION:
+        return False
+    if manifest.get('source', {}).get('sha256') != digest:
+        return False
+    if bool(brotli) != manifest.get('brotli', False):
+        return False
+    for rel_path, entry in manifest['files'].items():
+        paths = [rel_path] + [e['path'] for e in entry['encodings'].values()]
+        if not all(os.path.exists(os.path.join(base_dir, p)) for p in paths):
+            return False
+    return True
+
+
+def build_artifacts(playlist_path, force=False):
+    """
+    Render every artifact for `playlist_path`. Returns (status, manifest)
+    where status is 'up-to-date' (source unchanged since the manifest was
+    written) or 'built'; manifest['written'] lists files whose bytes changed.
+    """
+    base_dir, name, stem, manifest_path = _paths(playlist_path)
+    with open(playlist_path, 'rb') as f:
+        source = f.read()
+    digest = digest_bytes(source)
+
+    manifest = load_manifest(playlist_path)
+    if not force and _up_to_date(manifest, base_dir, digest):
+        return 'up-to-date', manifest
+
+    text = source.decode('utf-8', 'replace')
+    header = text.split('\n', 1)[0].rstrip('\r') if text.startswith('#EXTM3U') else '#EXTM3U'
+
+    writer = ArtifactWriter(base_dir)
+    playlist_entry = writer.add(name, source)
+
+    # One pass: channel index plus per-group bodies, in playlist order
+    channels = []
+    groups = {}
+    for number, (extinf, url, line_num) in enumerate(iter_entries(text.splitlines(True)), 1):
+        ch = parse_extinf(extinf, url, line_num)
+        group = ch.group or 'Ungrouped'
+        groups.setdefault(group, []).append(f'{ch.extinf}\n{url}\n')
+        channels.append({
+            'num': number,
+            'name': ch.name,
+            'tvg_id': ch.tvg_id,
+            'tvg_name': ch.tvg_name,
+            'logo': ch.logo,
+            'group': group,
+            'url': url,
+        })
+
+    group_files = {}
+    slugs = set()
+    for group, lines in groups.items():
+        slug = slugify(group)
+        while slug in slugs:
+            slug += '-'
+        slugs.add(slug)
+        rel_path = f'{stem}.groups/{slug}.m3u'
+        entry = writer.add(rel_path, header + '\n' + ''.join(lines))
+        group_files[group] = {'path': rel_path, 'channels': len(lines), 'etag': entry['etag']}
+
+    index = {
+        'playlist': name,
+        'etag': playlist_entry['etag'],
+        'groups': group_files,
+        'channels': channels,
+    }
+    writer.add(f'{stem}.channels.json', json.dumps(index, ensure_ascii=False, indent=1))
+
+    # Drop group files left over from groups that no longer exist
+    groups_dir = os.path.join(base_dir, f'{stem}.groups')
+    known = {os.path.basename(p) for rel in writer.files for p in
+             [rel] + [e['path'] for e in writer.files[rel]['encodings'].values()]}
+    for leftover in os.listdir(groups_dir) if os.path.isdir(groups_dir) else ():
+        if leftover not in known:
+            os.unlink(os.path.join(groups_dir, leftover))
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'source': {'path': name, 'sha256': digest, 'size': len(source)},
+        'brotli': bool(brotli),
+        'files': writer.files,
+    }
+    write_if_changed(manifest_path, json.dumps(manifest, indent=1, sort_keys=True))
+    manifest['written'] = writer.written
+    return 'built', manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build precompressed playlist artifacts')
+    parser.add_argument('playlist', nargs='?', default='playlist1.m3u',
+                       help='Built playlist to render artifacts for')
+    parser.add_argument('--force', action='store_true',
+                       help='Rebuild even if the manifest matches the playlist')
+    args = parser.parse_args()
+
+    status, manifest = build_artifacts(args.playlist, force=args.force)
+    if status == 'up-to-date':
+        print(f"✓ Artifacts for {args.playlist} are up to date")
+        return
+    print(f"✓ {len(manifest['files'])} artifacts for {args.playlist}, "
+          f"{len(manifest['written'])} files rewritten")
+    if brotli is None:
+        print("  (brotli not installed, only gzip copies written)")
+
+
+if __name__ == "__main__":
+    main()
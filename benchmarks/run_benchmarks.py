@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Benchmark the parse, merge, EPG and checker paths on synthetic data
+
+Each stage runs in a fresh interpreter so its peak RSS is its own. Results
+are written as JSON; pass an older result file with --compare to see the
+throughput change per stage and fail on regressions.
+
+    python benchmarks/run_benchmarks.py --sizes 10k 100k --output new.json --compare old.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import resource
+import traceback
+import subprocess
+import queue as queue_module
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from synthetic import GROUPS, cached, write_guide, write_playlist
+
+STAGES = ('parse', 'merge', 'epg_ingest', 'epg_ingest_gz', 'epg_ingest_parallel', 'epg_query', 'checker', 'checker_threads')
+
+
+def parse_size(text):
+    """'10k' -> 10000, '1M' -> 1000000"""
+    text = text.strip().lower()
+    scale = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+# --- stages: each returns (items processed, extra info dict) ---------------
+
+def stage_parse(playlist):
+    from m3u_parser import iter_channels
+    count = 0
+    for _ in iter_channels(playlist):
+        count += 1
+    return count, {}
+
+
+def stage_merge(sources):
+    from merge_engine import MergeRules, merge, render
+    rules = MergeRules({
+        'sources': sources,
+        'categories': GROUPS,
+        'keywords': {'News': ['CNN', 'News'], 'Sports': ['ESPN', 'Sports'], 'Kids & Family': ['Nick']},
+        'exclude_domains': ['cdn7.example.com'],
+    })
+    categories, stats, _ = merge(rules)
+    text = render(rules, categories)
+    return sum(seen for _, seen, _, _ in stats), {
+        'kept': sum(len(ch) for ch in categories.values()), 'output_bytes': len(text)}
+
+
+def stage_epg_ingest(guide):
+    from epg_index import ingest
+    index = ingest(guide)
+    return len(index), {'channels': len(index.channels)}
+
+
+stage_epg_ingest_gz = stage_epg_ingest
+
+
+def stage_epg_ingest_parallel(guide):
+    from epg_index import parallel_ingest
+    # At least two, so the sharded path runs even on a single-core machine
+    workers = max(2, os.cpu_count() or 1)
+    index = parallel_ingest(guide, workers=workers)
+    return len(index), {'channels': len(index.channels), 'workers': workers,
+                        'cpus': os.cpu_count()}
+
+
+def stage_epg_query(guide, lookups):
+    from epg_index import ingest
+    index = ingest(guide)
+    ids = list(index.channel_ids())
+    base = index.programmes(ids[0])[0].start
+    start = time.perf_counter()
+    for n in range(lookups):
+        index.now_next(ids[n % len(ids)], base + (n % 96) * 900)
+    elapsed = time.perf_counter() - start
+    return lookups, {'seconds': elapsed, 'programmes': len(index)}
+
+
+def _check_urls(base_urls, count):
+    return [f'{base_urls[n % len(base_urls)]}/live/CH{n}/index.m3u8' for n in range(count)]
+
+
+def stage_checker(count, hosts, latency, concurrency, per_host):
+    from stream_checker import StreamChecker
+    from stub_server import StubCluster
+    with StubCluster(hosts, latency=latency) as stub:
+        results = StreamChecker(concurrency=concurrency, per_host=per_host, timeout=30).run(
+            _check_urls(stub.base_urls, count))
+        stats = stub.stats()
+    latencies = sorted(r.latency for r in results)
+    return len(results), {
+        'ok': sum(r.ok for r in results),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+        'peak_in_flight_per_host': max(s['peak_in_flight'] for s in stats),
+    }
+
+
+def stage_checker_threads(count, hosts, latency, concurrency, per_host):
+    from test_channels import test_channel_stream
+    from stub_server import StubCluster
+    with StubCluster(hosts, latency=latency) as stub:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(test_channel_stream, _check_urls(stub.base_urls, count)))
+        stats = stub.stats()
+    return len(results), {
+        'ok': sum(ok for ok, _ in results),
+        'peak_in_flight_per_host': max(s['peak_in_flight'] for s in stats),
+    }
+
+
+def _run_stage(name, args, queue):
+    sys.path.insert(0, HERE)
+    sys.path.insert(0, os.path.join(HERE, '..'))
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        items, extra = globals()['stage_' + name](*args)
+    except Exception:
+        queue.put({'error': traceback.format_exc()})
+        return
+    seconds = extra.pop('seconds', None) or time.perf_counter() - start
+    queue.put({
+        'items': items,
+        'seconds': round(seconds, 4),
+        'throughput': round(items / seconds, 1) if seconds else None,
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'baseline_rss_mb': round(baseline, 1),
+        'extra': extra,
+    })
+
+
+def run_stage(name, *args):
+    """Run one stage in a fresh spawned interpreter and return its measurements"""
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_run_stage, args=(name, args, queue))
+    process.start()
+    try:
+        # Poll so a child that dies without reporting cannot hang the run
+        while True:
+            try:
+                return queue.get(timeout=1)
+            except queue_module.Empty:
+                if not process.is_alive():
+                    return {'error': f'stage exited with code {process.exitcode}'}
+    finally:
+        process.join()
+
+
+def _label(count):
+    if count >= 1000000 and count % 1000000 == 0:
+        return f'{count // 1000000}M'
+    if count >= 1000 and count % 1000 == 0:
+        return f'{count // 1000}k'
+    return str(count)
+
+
+def plan(args):
+    """Yield (stage, size label, stage args), generating inputs as needed"""
+    os.makedirs(args.workdir, exist_ok=True)
+    work = lambda name: os.path.join(args.workdir, name)
+
+    for size in args.sizes:
+        label = _label(size)
+        if 'parse' in args.stages:
+            yield 'parse', label, (cached(work(f'playlist_{label}.m3u'), write_playlist, size),)
+        if 'merge' in args.stages:
+            # Four sources of size/4 entries, each overlapping the previous by half
+            quarter = max(1, size // 4)
+            sources = [cached(work(f'merge_{label}_{n}.m3u'), write_playlist, quarter,
+                              seed=n, offset=n * quarter // 2) for n in range(4)]
+            yield 'merge', label, (sources,)
+
+    guide_channels = min(args.guide_channels, args.programmes)
+    per_channel = max(1, args.programmes // guide_channels)
+    label = _label(guide_channels * per_channel)
+    if {'epg_ingest', 'epg_ingest_parallel', 'epg_query'} & set(args.stages):
+        guide = cached(work(f'guide_{label}.xml'), write_guide, guide_channels, per_channel)
+        if 'epg_ingest' in args.stages:
+            yield 'epg_ingest', label, (guide,)
+        if 'epg_ingest_parallel' in args.stages:
+            yield 'epg_ingest_parallel', label, (guide,)
+        if 'epg_query' in args.stages:
+            yield 'epg_query', label, (guide, args.lookups)
+    if 'epg_ingest_gz' in args.stages:
+        guide = cached(work(f'guide_{label}.xml.gz'), write_guide, guide_channels, per_channel,
+                       compress=True)
+        yield 'epg_ingest_gz', label, (guide,)
+
+    checker_args = (args.checks, args.hosts, args.latency / 1000, args.concurrency, args.per_host)
+    for name in ('checker', 'checker_threads'):
+        if name in args.stages:
+            yield name, _label(args.checks), checker_args
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """Print throughput change versus a baseline file; return True on regression"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r['stage'], r['size']): r for r in json.load(f)['results']}
+
+    print(f"\nCompared with {baseline_path}:")
+    regressed = False
+    for result in results:
+        old = baseline.get((result['stage'], result['size']))
+        if not old or not old.get('throughput') or not result.get('throughput'):
+            continue
+        change = result['throughput'] / old['throughput'] - 1
+        flag = ''
+        if change < -threshold:
+            flag = '  ✗ regression'
+            regressed = True
+        print(f"  {result['stage']:16} {result['size']:>5}  {change * 100:+6.1f}% throughput, "
+              f"{result['peak_rss_mb'] - old['peak_rss_mb']:+7.1f} MB peak RSS{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parse/merge/EPG/checker paths on synthetic data')
+    parser.add_argument('--sizes', nargs='+', default=['10k', '100k', '1M'],
+                       help='Playlist sizes for parse and merge (e.g. 10k 100k 1M)')
+    parser.add_argument('--programmes', default='1M',
+                       help='Total programmes in the synthetic XMLTV guide')
+    parser.add_argument('--guide-channels', type=int, default=1000,
+                       help='Channels the guide programmes are spread over')
+    parser.add_argument('--lookups', type=int, default=100000,
+                       help='now/next lookups for the epg_query stage')
+    parser.add_argument('--checks', type=int, default=2000,
+                       help='URLs probed by the checker stages')
+    parser.add_argument('--hosts', type=int, default=8,
+                       help='Simulated origins (stub servers) for the checker stages')
+    parser.add_argument('--latency', type=float, default=50,
+                       help='Stub latency per request in milliseconds')
+    parser.add_argument('--concurrency', type=int, default=100,
+                       help='Checker concurrency (thread count for checker_threads)')
+    parser.add_argument('--per-host', type=int, default=10,
+                       help='Per-host connection cap for the async checker')
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=STAGES,
+                       help='Stages to run (default: all)')
+    parser.add_argument('--workdir', default='.bench_data',
+                       help='Where generated inputs are kept between runs')
+    parser.add_argument('--output', default='bench_results.json',
+                       help='JSON results file')
+    parser.add_argument('--compare',
+                       help='Earlier results file to compare throughput against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                       help='Throughput drop (fraction) reported as a regression')
+    args = parser.parse_args()
+    args.sizes = [parse_size(s) for s in args.sizes]
+    args.programmes = parse_size(args.programmes)
+
+    results = []
+    for stage, size, stage_args in plan(args):
+        print(f"{stage:16} {size:>5} ...", end=' ', flush=True)
+        result = dict(stage=stage, size=size, **run_stage(stage, *stage_args))
+        results.append(result)
+        if 'error' in result:
+            print(f"✗ failed\n{result['error']}")
+            continue
+        print(f"{result['seconds']:8.2f}s {result['throughput']:>12,.0f}/s "
+              f"peak {result['peak_rss_mb']:7.1f} MB {json.dumps(result['extra'])}")
+
+    report = {
+        'meta': {
+            'revision': _git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'host': socket.gethostname(),
+            'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Results written to {args.output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Latency-injecting HTTP stub for benchmarking the checkers offline
+
+Every request sleeps `latency` (+/- `jitter`) seconds and then answers like
+a tiny HLS origin: master/media playlists for *.m3u8 and a payload for
+anything else. A fraction of requests can be failed with 503s. Each port
+acts as a separate host for per-host concurrency limits.
+
+    python benchmarks/stub_server.py --ports 9001 9002 --latency 50
+"""
+import socket
+import random
+import asyncio
+import argparse
+import threading
+
+from aiohttp import web
+
+MASTER = ('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000\nlow/index.m3u8\n'
+          '#EXT-X-STREAM-INF:BANDWIDTH=3000000\nhigh/index.m3u8\n')
+MEDIA = '#EXTM3U\n#EXT-X-TARGETDURATION:6\n' + ''.join(
+    f'#EXTINF:6.0,\nseg{n}.ts\n' for n in range(5))
+
+
+class StubStats:
+    """Request counters, including the peak number of requests in flight"""
+
+    def __init__(self):
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def as_dict(self):
+        return {'requests': self.requests, 'peak_in_flight': self.peak_in_flight}
+
+
+def make_app(latency=0.05, jitter=0.0, fail_rate=0.0, payload_bytes=64 * 1024, seed=None):
+    rng = random.Random(seed)
+    stats = StubStats()
+    payload = b'G' * payload_bytes
+
+    async def handle(request):
+        stats.requests += 1
+        stats.in_flight += 1
+        stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+        try:
+            delay = latency + (rng.uniform(-jitter, jitter) if jitter else 0)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if fail_rate and rng.random() < fail_rate:
+                return web.Response(status=503)
+            path = request.path
+            if path == '/stats':
+                return web.json_response(stats.as_dict())
+            if path.endswith('.m3u8'):
+                body = MEDIA if '/low/' in path or '/high/' in path else MASTER
+                return web.Response(text=body, content_type='application/vnd.apple.mpegurl')
+            return web.Response(body=payload, content_type='video/mp2t')
+        finally:
+            stats.in_flight -= 1
+
+    app = web.Application()
+    app.router.add_route('*', '/{tail:.*}', handle)
+    app['stats'] = stats
+    return app
+
+
+async def serve(sockets, **kwargs):
+    """Serve one stub app per socket; returns (runners, apps)"""
+    runners, apps = [], []
+    for sock in sockets:
+        app = make_app(**kwargs)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.SockSite(runner, sock).start()
+        runners.append(runner)
+        apps.append(app)
+    return runners, apps
+
+
+class StubCluster:
+    """
+    Run `hosts` stub servers on free localhost ports in a background thread.
+
+    Use as a context manager; `base_urls` lists one http://127.0.0.1:port
+    per simulated host.
+    """
+
+    def __init__(self, hosts=4, **kwargs):
+        self.sockets = []
+        for _ in range(hosts):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('127.0.0.1', 0))
+            self.sockets.append(sock)
+        self.base_urls = [f'http://127.0.0.1:{s.getsockname()[1]}' for s in self.sockets]
+        self.kwargs = kwargs
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.runners = []
+        self.apps = []
+
+    def __enter__(self):
+        self.thread.start()
+        future = asyncio.run_coroutine_threadsafe(serve(self.sockets, **self.kwargs), self.loop)
+        self.runners, self.apps = future.result()
+        return self
+
+    def __exit__(self, *exc):
+        async def cleanup():
+            for runner in self.runners:
+                await runner.cleanup()
+        asyncio.run_coroutine_threadsafe(cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def stats(self):
+        return [app['stats'].as_dict() for app in self.apps]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency-injecting HLS stub server')
+    parser.add_argument('--ports', type=int, nargs='+', default=[9001],
+                       help='Ports to listen on (one simulated host each)')
+    parser.add_argument('--latency', type=float, default=50,
+                       help='Added latency per request in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0,
+                       help='Random +/- jitter in milliseconds')
+    parser.add_argument('--fail-rate', type=float, default=0,
+                       help='Fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    sockets = []
+    for port in args.ports:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('127.0.0.1', port))
+        sockets.append(sock)
+
+    async def run():
+        await serve(sockets, latency=args.latency / 1000, jitter=args.jitter / 1000,
+                    fail_rate=args.fail_rate)
+        print(f"Stub listening on {', '.join(str(p) for p in args.ports)} "
+              f"({args.latency:g}ms latency)")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Synthetic playlists and XMLTV guides for benchmarking
+
+Output is deterministic for a given size and seed, so runs on different
+versions read exactly the same inputs.
+"""
+import os
+import gzip
+import time
+import random
+
+GUIDE_START = 1704067200    # 2024-01-01 00:00 UTC, fixed so guides are reproducible
+GROUPS = ['News', 'Sports', 'Movies & Premium', 'Entertainment', 'Music', 'Kids & Family',
+          'Educational & Documentary', 'Lifestyle & Women', 'Shopping & Business']
+WORDS = ['HBO', 'CNN', 'ESPN', 'Discovery', 'Nick', 'MTV', 'Fox', 'Sports', 'News',
+         'Movie', 'Kids', 'Music', 'Travel', 'Food', 'Family', 'Classic', 'Plus', 'Max']
+
+
+def channel_name(rng, i):
+    return f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i}"
+
+
+def write_playlist(path, count, hosts=50, seed=1, offset=0, epg_url=None):
+    """
+    Write a playlist of `count` entries spread over `hosts` origins.
+
+    Entries are numbered from `offset`, so two playlists with overlapping
+    ranges share stream URLs (what the merge deduplicates).
+    """
+    rng = random.Random(seed)
+    header = f'#EXTM3U url-tvg="{epg_url}"\n' if epg_url else '#EXTM3U\n'
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(header)
+        lines = []
+        for i in range(offset, offset + count):
+            host = f'cdn{i % hosts}.example.com'
+            group = GROUPS[i % len(GROUPS)]
+            lines.append(
+                f'#EXTINF:-1 tvg-id="CH{i}.us" tvg-name="{channel_name(rng, i)}" '
+                f'tvg-logo="https://logos.example.com/{i}.png" group-title="{group}",'
+                f'{channel_name(rng, i)}\n'
+                f'http://{host}/live/CH{i}/index.m3u8\n')
+            if len(lines) >= 10000:
+                f.write(''.join(lines))
+                lines = []
+        f.write(''.join(lines))
+    return path
+
+
+def _xmltv_time(ts):
+    return time.strftime('%Y%m%d%H%M%S +0000', time.gmtime(ts))
+
+
+def write_guide(path, channels, programmes_per_channel, slot=1800, start=GUIDE_START, compress=False):
+    """
+    Write an XMLTV guide with channels CH0.us.. each carrying back-to-back
+    programmes of `slot` seconds, gzip-compressed if `compress` is set.
+    """
+    times = [_xmltv_time(start + n * slot) for n in range(programmes_per_channel + 1)]
+    opener = gzip.open if compress else open
+    with opener(path, 'wt', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<tv generator-info-name="synthetic">\n')
+        for c in range(channels):
+            f.write(f'<channel id="CH{c}.us"><display-name>Channel {c}</display-name></channel>\n')
+        for c in range(channels):
+            chunk = []
+            for n in range(programmes_per_channel):
+                chunk.append(
+                    f'<programme start="{times[n]}" stop="{times[n + 1]}" channel="CH{c}.us">'
+                    f'<title>Show {c}-{n}</title><desc>Episode {n} of a synthetic series.</desc>'
+                    f'</programme>\n')
+            f.write(''.join(chunk))
+        f.write('</tv>\n')
+    return path
+
+
+def cached(path, build, *args, **kwargs):
+    """Build `path` unless it already exists (inputs are deterministic)"""
+    if not os.path.exists(path):
+        tmp_path = path + '.part'
+        build(tmp_path, *args, **kwargs)
+        os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Content-hash bookkeeping for incremental playlist builds
+"""
+import os
+import json
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+
+def digest_bytes(data):
+    """SHA-256 hex digest of bytes or UTF-8 text"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path):
+    """SHA-256 of a file's contents, or None if it does not exist"""
+    sha = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+    except FileNotFoundError:
+        return None
+    return sha.hexdigest()
+
+
+@contextmanager
+def atomic_open(path):
+    """
+    Open a temp file next to `path` for binary writing; it replaces `path`
+    only if the block completes, so readers never see a partial file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        # mkstemp creates 0600; keep the existing mode, or the umask default
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def atomic_write(path, data):
+    """Write via a temp file + rename so readers never see a partial file"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    with atomic_open(path) as f:
+        f.write(data)
+
+
+def write_if_changed(path, data):
+    """
+    Atomically replace `path` with `data` unless it already holds exactly
+    those bytes. Returns True if the file was written.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if file_digest(path) == digest_bytes(data):
+        return False
+    atomic_write(path, data)
+    return True
+
+
+class BuildState:
+    """JSON file remembering input/output hashes between runs"""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.data = json.load(f)
+            except (OSError, ValueError):
+                self.data = {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def save(self):
+        if self.path:
+            atomic_write(self.path, json.dumps(self.data))
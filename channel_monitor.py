@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Continuous channel monitor with adaptive per-channel intervals
+
+Each channel sits in a priority queue keyed by its next check time. After
+every probe the interval adapts: stable healthy channels back off towards
+`healthy_max`, channels that flap between up and down are rechecked every
+`flapping_interval`, and dead channels back off exponentially. A global
+per-minute budget caps probe traffic, so it follows how unstable the
+playlist is rather than how long it is.
+"""
+import os
+import time
+import heapq
+import random
+from collections import deque
+from urllib.parse import urlparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from host_guard import TokenBucket
+from stream_checker import CheckResult
+
+HISTORY = 8             # recent outcomes kept per channel for flap detection
+FLAP_TRANSITIONS = 2    # up/down changes within HISTORY that count as flapping
+DEAD_AFTER = 3          # consecutive failures before a channel counts as dead
+FLUSH_EVERY = 30        # seconds between HealthStore flushes
+
+
+class ChannelState:
+    """Scheduling state for one channel"""
+    __slots__ = ('channel', 'due', 'interval', 'failures', 'history', 'last_ok', 'last_status', 'checks')
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.due = None
+        self.interval = None
+        self.failures = 0
+        self.history = deque(maxlen=HISTORY)
+        self.last_ok = None
+        self.last_status = None
+        self.checks = 0
+
+    @property
+    def transitions(self):
+        h = self.history
+        return sum(1 for a, b in zip(h, list(h)[1:]) if a != b)
+
+    @property
+    def condition(self):
+        if self.last_ok is None:
+            return 'new'
+        # A long failure streak backs off even if it began with a flap
+        if self.failures >= DEAD_AFTER:
+            return 'dead'
+        if self.transitions >= FLAP_TRANSITIONS:
+            return 'flapping'
+        return 'healthy' if self.last_ok else 'failing'
+
+
+class AdaptivePolicy:
+    """Maps a channel's recent history to its next check interval (seconds)"""
+
+    def __init__(self, min_interval=60, healthy_max=3600, flapping_interval=120,
+                 dead_base=300, dead_max=6 * 3600, jitter=0.1):
+        self.min_interval = min_interval
+        self.healthy_max = healthy_max
+        self.flapping_interval = flapping_interval
+        self.dead_base = dead_base
+        self.dead_max = dead_max
+        self.jitter = jitter
+
+    def next_interval(self, state):
+        condition = state.condition
+        if condition == 'flapping':
+            interval = self.flapping_interval
+        elif condition == 'dead':
+            interval = min(self.dead_max, self.dead_base * 2 ** (state.failures - DEAD_AFTER))
+        elif condition == 'failing':
+            # Confirm a fresh failure quickly before declaring the channel dead
+            interval = self.min_interval
+        else:
+            # Healthy and stable: double the interval each time, up to the cap.
+            # A channel that just recovered starts the ramp over at min_interval
+            recovered = len(state.history) < 2 or not state.history[-2]
+            previous = None if recovered else state.interval
+            interval = min(self.healthy_max, (previous or self.min_interval / 2) * 2)
+        state.interval = interval
+        # Jitter keeps channels added together from staying in lockstep
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class RequestBudget(TokenBucket):
+    """Token bucket allowing `per_minute` probes, with bursts up to `burst`"""
+
+    def __init__(self, per_minute, burst=None):
+        super().__init__(per_minute / 60.0, burst or max(1, per_minute // 6))
+
+
+class ChannelMonitor:
+    """
+    Long-running scheduler around a blocking check function.
+
+    `load_channels()` returns the current channel list (re-read when
+    `playlist_path` changes). `check(url)` returns (ok, status), the shape
+    of test_channels.test_channel_stream. Results are passed to each
+    `on_result(result, state, changed)` listener and recorded in `store`
+    (a HealthStore) if given.
+    """
+
+    def __init__(self, load_channels, check, playlist_path=None, policy=None,
+                 per_minute=120, workers=8, store=None, seed_from_store=True):
+        self.load_channels = load_channels
+        self.check = check
+        self.playlist_path = playlist_path
+        self.policy = policy or AdaptivePolicy()
+        self.budget = RequestBudget(per_minute)
+        self.workers = workers
+        self.store = store
+        self.seed_from_store = seed_from_store
+        self.listeners = []
+        self.states = {}        # url -> ChannelState
+        self._queue = []        # (due, seq, url)
+        self._seq = 0
+        self._mtime = None
+        self.probes = 0
+
+    def _schedule(self, state, url, due):
+        # Entries whose due time no longer matches the state are skipped when popped
+        state.due = due
+        self._seq += 1
+        heapq.heappush(self._queue, (due, self._seq, url))
+
+    def sync_channels(self):
+        """Add new channels (due now), forget removed ones"""
+        if self.playlist_path:
+            try:
+                self._mtime = os.stat(self.playlist_path).st_mtime_ns
+            except FileNotFoundError:
+                return
+        channels = {ch.url: ch for ch in self.load_channels()}
+        now = time.time()
+        for url, channel in channels.items():
+            state = self.states.get(url)
+            if state:
+                state.channel = channel
+                continue
+            state = self.states[url] = ChannelState(channel)
+            due = now
+            if self.store and self.seed_from_store:
+                # After a restart, do not re-probe everything at once
+                last = self.store.last_checked(url)
+                if last:
+                    due = max(now, last[0] + self.policy.min_interval)
+            self._schedule(state, url, due)
+        for url in set(self.states) - set(channels):
+            del self.states[url]
+
+    def _playlist_changed(self):
+        if not self.playlist_path:
+            return False
+        try:
+            return os.stat(self.playlist_path).st_mtime_ns != self._mtime
+        except FileNotFoundError:
+            return False
+
+    def _probe(self, url):
+        start = time.perf_counter()
+        try:
+            ok, status = self.check(url)
+        except Exception as e:
+            ok, status = False, str(e) or type(e).__name__
+        return ok, status, time.perf_counter() - start
+
+    def _complete(self, url, ok, status, latency):
+        self.probes += 1
+        state = self.states.get(url)
+        if state is None:
+            return
+        before = state.condition
+        state.checks += 1
+        state.history.append(bool(ok))
+        state.failures = 0 if ok else state.failures + 1
+        state.last_ok = bool(ok)
+        state.last_status = status
+        self._schedule(state, url, time.time() + self.policy.next_interval(state))
+
+        result = CheckResult(state.channel, url, urlparse(url).netloc, ok, status, latency)
+        if self.store:
+            self.store.record(result)
+        changed = before != state.condition
+        for listener in self.listeners:
+            listener(result, state, changed)
+
+    def run(self, stop_after=None):
+        """Run until interrupted (or for `stop_after` seconds)"""
+        self.sync_channels()
+        deadline = time.monotonic() + stop_after if stop_after else None
+        running = {}    # future -> url
+        flushed = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while deadline is None or time.monotonic() < deadline:
+                if self._playlist_changed():
+                    self.sync_channels()
+                if self.store and time.monotonic() - flushed >= FLUSH_EVERY:
+                    self.store.flush()
+                    flushed = time.monotonic()
+
+                # Launch everything due, as far as the budget and workers allow
+                now = time.time()
+                while self._queue and self._queue[0][0] <= now and len(running) < self.workers:
+                    due, _, url = self._queue[0]
+                    state = self.states.get(url)
+                    if state is None or state.due != due:
+                        heapq.heappop(self._queue)
+                        continue
+                    if not self.budget.take():
+                        break
+                    heapq.heappop(self._queue)
+                    running[pool.submit(self._probe, url)] = url
+
+                # Sleep until a probe finishes, the next channel is due or a token frees up
+                now = time.time()
+                if self._queue and self._queue[0][0] > now:
+                    timeout = min(1.0, self._queue[0][0] - now)
+                elif self._queue and len(running) < self.workers:
+                    timeout = min(1.0, max(0.01, self.budget.wait_time()))
+                else:
+                    timeout = 1.0
+                if running:
+                    done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._complete(running.pop(future), *future.result())
+                else:
+                    time.sleep(timeout)
+            for future in wait(running).done:
+                self._complete(running.pop(future), *future.result())
+        if self.store:
+            self.store.flush()
+
+    def summary(self):
+        """{condition: channel count}"""
+        counts = {}
+        for state in self.states.values():
+            counts[state.condition] = counts.get(state.condition, 0) + 1
+        return counts
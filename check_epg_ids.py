@@ -1,38 +1,37 @@
-import requests
-import xml.etree.ElementTree as ET
+from itertools import islice
+
+from epg_cache import open_guide
+from epg_match import ChannelIndex
 
 # Get EPG and check actual channel IDs
-response = requests.get("https://raw.githubusercontent.com/acidjesuz/EPGTalk/master/guide.xml", timeout=10)
-root = ET.fromstring(response.content)
+with open_guide("https://raw.githubusercontent.com/acidjesuz/EPGTalk/master/guide.xml") as guide:
+    guide_channels = guide.channels
 
 # Get first 30 channel IDs from EPG
 epg_channels = []
-for channel in root.findall('.//channel')[:50]:
-    channel_id = channel.get('id')
-    display_name = channel.find('display-name')
-    if channel_id and display_name is not None:
-        epg_channels.append((channel_id, display_name.text))
+for channel_id, name in islice(guide_channels.items(), 50):
+    if channel_id and name:
+        epg_channels.append((channel_id, name))
 
 print("Sample Channel IDs in EPG:")
 print("-" * 60)
 for ch_id, name in epg_channels:
     print(f"{ch_id:35} → {name}")
 
-# Check for common US channels
+# Check for common US channels (indexed lookup instead of scanning every name)
 print("\n\nSearching for common US channels:")
 print("-" * 60)
 search_terms = ['ABC', 'CBS', 'NBC', 'FOX', 'ESPN', 'HBO', 'CNN', 'TNT', 'TBS']
+channel_index = ChannelIndex(guide_channels)
 found = []
 
-for channel in root.findall('.//channel'):
-    ch_id = channel.get('id')
-    display_name = channel.find('display-name')
-    name = display_name.text if display_name is not None else ''
-    
-    if ch_id and any(term in name.upper() for term in search_terms):
-        found.append((ch_id, name))
+for term in search_terms:
+    for match in channel_index.search(term, limit=3):
+        found.append((match.channel_id, match.name))
         if len(found) >= 20:
             break
+    if len(found) >= 20:
+        break
 
 for ch_id, name in found:
     print(f"{ch_id:35} → {name}")
\ No newline at end of file
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Persistent on-disk EPG cache: the raw guide plus a prebuilt SQLite index
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import tempfile
+from contextlib import contextmanager
+import requests
+import urllib3
+
+from epg_index import Programme, parallel_ingest
+from metrics import timed
+
+DEFAULT_CACHE_DIR = os.environ.get('EPG_CACHE_DIR', '.epg_cache')
+DEFAULT_MAX_AGE = 3600      # seconds before a cached guide is revalidated
+BATCH_SIZE = 5000
+# Connection/HTTP errors, and errors while streaming the body (raw reads raise urllib3's own)
+FETCH_ERRORS = (requests.exceptions.RequestException, urllib3.exceptions.HTTPError)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS guides (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    sha256 TEXT,
+    size INTEGER,
+    fetched_at REAL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    url TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT,
+    PRIMARY KEY (url, id)
+);
+CREATE TABLE IF NOT EXISTS programmes (
+    url TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    stop INTEGER,
+    title TEXT,
+    desc TEXT
+);
+CREATE INDEX IF NOT EXISTS programmes_by_start ON programmes (url, channel, start);
+'''
+
+
+class _IndexWriter:
+    """ingest() sink that batches channels/programmes into SQLite"""
+
+    def __init__(self, db, url):
+        self.db = db
+        self.url = url
+        self.channels = []
+        self.programmes = []
+
+    def add_channel(self, channel_id, display_name=None):
+        self.channels.append((self.url, channel_id, display_name or channel_id))
+
+    def add(self, programme):
+        self.programmes.append((self.url, programme.channel, programme.start,
+                                programme.stop, programme.title, programme.desc))
+        if len(self.programmes) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.channels:
+            self.db.executemany('INSERT OR IGNORE INTO channels VALUES (?, ?, ?)', self.channels)
+            self.channels = []
+        if self.programmes:
+            self.db.executemany('INSERT INTO programmes VALUES (?, ?, ?, ?, ?, ?)', self.programmes)
+            self.programmes = []
+
+    def finalize(self):
+        self.flush()
+        return self
+
+
+class CachedGuide:
+    """
+    Read-only view of one cached guide.
+
+    Mirrors the ProgrammeIndex query API, but every lookup is answered from
+    the (url, channel, start) B-tree index instead of an in-memory structure.
+    """
+
+    def __init__(self, db, url, meta):
+        self.db = db
+        self.url = url
+        self.size = meta['size']
+        self.sha256 = meta['sha256']
+        self.fetched_at = meta['fetched_at']
+        self._channels = None
+
+    @property
+    def channels(self):
+        if self._channels is None:
+            rows = self.db.execute('SELECT id, name FROM channels WHERE url = ? ORDER BY rowid', (self.url,))
+            self._channels = dict(rows)
+        return self._channels
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM programmes WHERE url = ?', (self.url,)).fetchone()[0]
+
+    def __contains__(self, channel_id):
+        return channel_id in self.channels or self.db.execute(
+            'SELECT 1 FROM programmes WHERE url = ? AND channel = ? LIMIT 1',
+            (self.url, channel_id)).fetchone() is not None
+
+    def _query(self, where, params):
+        rows = self.db.execute(
+            'SELECT channel, start, stop, title, desc FROM programmes '
+            'WHERE url = ? AND channel = ? ' + where, (self.url,) + params)
+        return [Programme(*row) for row in rows]
+
+    def programmes(self, channel_id):
+        """All programmes for a channel, ordered by start time"""
+        return self._query('ORDER BY start', (channel_id,))
+
+    def now_next(self, channel_id, at=None):
+        """Return (current, next) programmes for a channel; either may be None"""
+        at = time.time() if at is None else at
+        current = self._query('AND start <= ? ORDER BY start DESC LIMIT 1', (channel_id, at))
+        upcoming = self._query('AND start > ? ORDER BY start LIMIT 1', (channel_id, at))
+        current = current[0] if current and current[0].stop and current[0].stop > at else None
+        return current, upcoming[0] if upcoming else None
+
+    def window(self, channel_id, start, stop):
+        """Programmes for a channel that overlap [start, stop)"""
+        current, _ = self.now_next(channel_id, start)
+        rows = self._query('AND start > ? AND start < ? ORDER BY start', (channel_id, start, stop))
+        return ([current] if current else []) + rows
+
+
+class EPGCache:
+    """
+    Local cache of XMLTV guides keyed by URL.
+
+    A guide younger than `max_age` is served without touching the network.
+    Older guides are revalidated with If-None-Match / If-Modified-Since, and
+    the SQLite index is rebuilt only when the downloaded body's SHA-256
+    differs from the one it was built from.
+    """
+
+    def __init__(self, cache_dir=None, max_age=DEFAULT_MAX_AGE, timeout=10):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_age = max_age
+        self.timeout = timeout
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.cache_dir, 'epg.sqlite'))
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def raw_path(self, url):
+        """Where the raw guide body for `url` is kept (gzip guides stay compressed)"""
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest() + '.guide')
+
+    def _meta(self, url):
+        return self.db.execute('SELECT * FROM guides WHERE url = ?', (url,)).fetchone()
+
+    def refresh(self, url, force=False):
+        """
+        Bring the cached copy of `url` up to date.
+
+        Returns one of 'fresh' (within max_age, no request made),
+        'not-modified' (304), 'unchanged' (200 but same content hash),
+        'rebuilt' (new content indexed) or 'stale' (fetch failed, old copy
+        kept; still counted as an epg_fetch failure).
+        """
+        meta = self._meta(url)
+        have_copy = meta is not None and os.path.exists(self.raw_path(url))
+        if have_copy and not force and time.time() - meta['fetched_at'] < self.max_age:
+            return 'fresh'
+
+        headers = {}
+        if have_copy:
+            if meta['etag']:
+                headers['If-None-Match'] = meta['etag']
+            if meta['last_modified']:
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        # A failed fetch leaves timed() by an exception, so it is counted as
+        # an epg_fetch failure even when the stale copy is served
+        try:
+            with timed('epg_fetch'):
+                with requests.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                    if response.status_code == 304 and have_copy:
+                        self._touch(url, response)
+                        return 'not-modified'
+                    response.raise_for_status()
+                    response.raw.decode_content = True
+                    tmp_path, digest, size = self._download(response)
+        except FETCH_ERRORS:
+            if have_copy:
+                return 'stale'
+            raise
+
+        if have_copy and digest == meta['sha256']:
+            os.unlink(tmp_path)
+            self._touch(url, response)
+            return 'unchanged'
+
+        self._rebuild(url, tmp_path, response, digest, size)
+        return 'rebuilt'
+
+    def _download(self, response):
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: response.raw.read(1 << 16), b''):
+                    sha.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return tmp_path, sha.hexdigest(), size
+
+    def _touch(self, url, response):
+        with self.db:
+            self.db.execute(
+                'UPDATE guides SET fetched_at = ?, '
+                'etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) WHERE url = ?',
+                (time.time(), response.headers.get('ETag'), response.headers.get('Last-Modified'), url))
+
+    def _rebuild(self, url, tmp_path, response, digest, size):
+        try:
+            with self.db, timed('epg_index'):
+                self.db.execute('DELETE FROM channels WHERE url = ?', (url,))
+                self.db.execute('DELETE FROM programmes WHERE url = ?', (url,))
+                parallel_ingest(tmp_path, index=_IndexWriter(self.db, url))
+                self.db.execute(
+                    'INSERT OR REPLACE INTO guides VALUES (?, ?, ?, ?, ?, ?)',
+                    (url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                     digest, size, time.time()))
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        os.replace(tmp_path, self.raw_path(url))
+
+    def open(self, url, force=False):
+        """Refresh `url` if needed and return a CachedGuide for it"""
+        self.refresh(url, force=force)
+        return CachedGuide(self.db, url, self._meta(url))
+
+
+@contextmanager
+def open_guide(url, cache_dir=None, max_age=DEFAULT_MAX_AGE, force=False):
+    """
+    Convenience wrapper: `with open_guide(url) as guide:` opens `url` through
+    the default on-disk cache and closes the cache on exit.
+    """
+    with EPGCache(cache_dir, max_age=max_age) as cache:
+        yield cache.open(url, force=force)
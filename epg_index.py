@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Streaming XMLTV ingestion and a per-channel programme index
+"""
+import gc
+import os
+import re
+import gzip
+import mmap
+import time
+import multiprocessing
+import shutil
+import calendar
+import tempfile
+import requests
+import xml.etree.ElementTree as ET
+from io import BytesIO
+from bisect import bisect_left, bisect_right
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+
+_DAY_EPOCH = {}
+
+
+def parse_xmltv_time(value):
+    """Convert an XMLTV timestamp ("20240101120000 +0000") to epoch seconds"""
+    if not value:
+        return None
+    value = value.strip()
+    day = value[:8]
+    try:
+        ts = _DAY_EPOCH.get(day)
+        if ts is None:
+            ts = _DAY_EPOCH[day] = calendar.timegm(
+                (int(day[0:4]), int(day[4:6]), int(day[6:8]), 0, 0, 0))
+        ts += int(value[8:10] or 0) * 3600 + int(value[10:12] or 0) * 60 + int(value[12:14] or 0)
+        offset = value[14:].strip()
+        if offset[:1] in ('+', '-'):
+            if len(offset) != 5:
+                return None
+            seconds = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+            ts -= seconds if offset[0] == '+' else -seconds
+    except ValueError:
+        return None
+    return ts
+
+
+class Programme:
+    """One <programme> entry, with start/stop as epoch seconds"""
+    __slots__ = ('channel', 'start', 'stop', 'title', 'desc')
+
+    def __init__(self, channel, start, stop, title=None, desc=None):
+        self.channel = channel
+        self.start = start
+        self.stop = stop
+        self.title = title
+        self.desc = desc
+
+    def __repr__(self):
+        return f'Programme({self.channel!r}, {self.start}, {self.title!r})'
+
+
+class ProgrammeIndex:
+    """
+    Programmes grouped per channel and sorted by start time.
+
+    Lookups bisect a parallel list of start times, so "now/next" and window
+    queries are O(log n) in the channel's programme count.
+    """
+
+    def __init__(self):
+        self.channels = {}      # channel id -> display name
+        self._programmes = {}   # channel id -> [Programme] sorted by start
+        self._starts = {}       # channel id -> [start] parallel to _programmes
+        self._dirty = set()
+
+    def __len__(self):
+        return sum(len(progs) for progs in self._programmes.values())
+
+    def __contains__(self, channel_id):
+        return channel_id in self.channels or channel_id in self._programmes
+
+    def add_channel(self, channel_id, display_name=None):
+        self.channels.setdefault(channel_id, display_name or channel_id)
+
+    def add(self, programme):
+        progs = self._programmes.get(programme.channel)
+        if progs is None:
+            progs = self._programmes[programme.channel] = []
+            self._starts[programme.channel] = []
+        starts = self._starts[programme.channel]
+        if starts and programme.start < starts[-1]:
+            self._dirty.add(programme.channel)
+        progs.append(programme)
+        starts.append(programme.start)
+
+    def add_run(self, channel_id, programmes, starts=None):
+        """Append programmes already sorted by start (e.g. one shard's worth)"""
+        starts = list(starts) if starts is not None else [p.start for p in programmes]
+        progs = self._programmes.get(channel_id)
+        if progs is None:
+            self._programmes[channel_id] = list(programmes)
+            self._starts[channel_id] = starts
+            return
+        if starts and self._starts[channel_id] and starts[0] < self._starts[channel_id][-1]:
+            self._dirty.add(channel_id)
+        progs.extend(programmes)
+        self._starts[channel_id].extend(starts)
+
+    def finalize(self):
+        """Sort any channel whose programmes arrived out of order"""
+        for channel_id in self._dirty:
+            progs = self._programmes[channel_id]
+            progs.sort(key=lambda p: p.start)
+            self._starts[channel_id] = [p.start for p in progs]
+        self._dirty.clear()
+        return self
+
+    def channel_ids(self):
+        return self._programmes.keys()
+
+    def programmes(self, channel_id):
+        """All programmes for a channel, ordered by start time"""
+        return self._programmes.get(channel_id, [])
+
+    def now_next(self, channel_id, at=None):
+        """Return (current, next) programmes for a channel; either may be None"""
+        starts = self._starts.get(channel_id)
+        if not starts:
+            return None, None
+        at = time.time() if at is None else at
+        progs = self._programmes[channel_id]
+        i = bisect_right(starts, at)
+        current = progs[i - 1] if i and progs[i - 1].stop and progs[i - 1].stop > at else None
+        upcoming = progs[i] if i < len(progs) else None
+        return current, upcoming
+
+    def locate(self, channel_id, at=None):
+        """
+        Return (programmes, i) where programmes[i] is the programme airing
+        at `at`, or the next one to air (i == len(programmes) if none).
+        """
+        starts = self._starts.get(channel_id)
+        if not starts:
+            return [], 0
+        at = time.time() if at is None else at
+        progs = self._programmes[channel_id]
+        i = bisect_right(starts, at)
+        if i and progs[i - 1].stop and progs[i - 1].stop > at:
+            i -= 1
+        return progs, i
+
+    def window(self, channel_id, start, stop):
+        """Programmes for a channel that overlap [start, stop)"""
+        starts = self._starts.get(channel_id)
+        if not starts:
+            return []
+        progs = self._programmes[channel_id]
+        lo = bisect_right(starts, start)
+        if lo and progs[lo - 1].stop and progs[lo - 1].stop > start:
+            lo -= 1
+        hi = bisect_left(starts, stop, lo)
+        return progs[lo:hi]
+
+
+def _text(elem, tag):
+    child = elem.find(tag)
+    return child.text if child is not None else None
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class _Rewound:
+    """Replay bytes already read from a non-seekable stream before the rest"""
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.stream.read(), b''
+            return data
+        data, self.head = self.head[:size], self.head[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+
+
+def open_xmltv(stream):
+    """
+    Wrap a binary stream so gzip-compressed guides (.xml.gz) are inflated on
+    the fly. Only the two magic bytes are sniffed; nothing is buffered, so the
+    decompressed document is never held in memory.
+    """
+    head = stream.read(2)
+    stream = _Rewound(head, stream)
+    if head == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    return stream
+
+
+def ingest(source, index=None, channel_filter=None):
+    """
+    Stream an XMLTV document into a ProgrammeIndex.
+
+    `source` is a filename or a binary file object (e.g. response.raw), plain
+    or gzip-compressed. Each <channel>/<programme> element is cleared once
+    read, so memory use tracks the index rather than the document.
+    `channel_filter`, if given, is a set of channel ids to keep.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return ingest(f, index, channel_filter)
+
+    index = index if index is not None else ProgrammeIndex()
+    # Adjacent programmes share boundaries, and every channel in a guide
+    # usually shares the same slot grid, so most timestamps repeat.
+    times = {}
+
+    def to_epoch(value):
+        try:
+            return times[value]
+        except KeyError:
+            ts = times[value] = parse_xmltv_time(value)
+            return ts
+
+    context = ET.iterparse(open_xmltv(source), events=('start', 'end'))
+    root = None
+    for event, elem in context:
+        if root is None and event == 'start':
+            root = elem
+            continue
+        if event != 'end':
+            continue
+        tag = elem.tag
+        if tag == 'programme':
+            channel_id = elem.get('channel')
+            start = to_epoch(elem.get('start'))
+            if channel_id and start is not None and (
+                    channel_filter is None or channel_id in channel_filter):
+                index.add(Programme(
+                    channel_id,
+                    start,
+                    to_epoch(elem.get('stop')),
+                    _text(elem, 'title'),
+                    _text(elem, 'desc'),
+                ))
+        elif tag == 'channel':
+            channel_id = elem.get('id')
+            if channel_id and (channel_filter is None or channel_id in channel_filter):
+                index.add_channel(channel_id, _text(elem, 'display-name'))
+        else:
+            continue
+        elem.clear()
+        root.clear()
+    return index.finalize()
+
+
+def fetch_index(url, timeout=10, channel_filter=None):
+    """Download an XMLTV guide (plain or .gz) and ingest it as it streams in"""
+    with requests.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        return ingest(response.raw, channel_filter=channel_filter)
+
+
+PARALLEL_MIN_BYTES = 16 << 20   # smaller guides parse faster than a pool starts
+SHARDS_PER_WORKER = 4           # more shards than workers evens out uneven ranges
+PROGRAMME_TAG = b'<programme'
+ROOT_TAG_RE = re.compile(rb'<([A-Za-z_][\w.-]*)[^<>]*>\s*$')
+
+
+def shard_ranges(data, shards):
+    """
+    Split an XMLTV document (bytes or mmap) into `shards` contiguous
+    [(start, end)] byte ranges; every range after the first begins at a
+    <programme tag, so each one holds whole elements.
+    """
+    size = len(data)
+    first = data.find(PROGRAMME_TAG)
+    if first < 0 or shards < 2:
+        return [(0, size)]
+    step = max(1, (size - first) // shards)
+    bounds = [0]
+    for k in range(1, shards):
+        pos = data.find(PROGRAMME_TAG, first + k * step)
+        if pos < 0:
+            break
+        if pos > bounds[-1]:
+            bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _prolog(data):
+    """(end of everything before the first child element, closing root tag)"""
+    first = data.find(PROGRAMME_TAG)
+    channel = data.find(b'<channel', 0, first if first >= 0 else len(data))
+    end = channel if channel >= 0 else first
+    match = ROOT_TAG_RE.search(data[:end])
+    if match is None:
+        raise ET.ParseError('no XMLTV root element before the first <channel>/<programme>')
+    return end, b'</' + match.group(1) + b'>'
+
+
+def _ingest_shard(path, start, end, prolog_end, closing, channel_filter):
+    """
+    Process-pool worker: parse one byte range as a document of its own
+    (the guide's prolog + the range + the closing root tag). Returns
+    ({channel id: name}, [(channel id, starts, stops, titles, descs)]) with
+    each channel's columns sorted by start.
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        size = len(data)
+        doc = data[start:end] if start == 0 else data[:prolog_end] + data[start:end]
+    if end < size:
+        doc += closing
+    # Everything built here lives until it is returned, so cyclic GC
+    # passes over the growing heap are pure overhead. This runs in a pool
+    # worker process, so pausing GC affects nothing else
+    gc.disable()
+    try:
+        index = ingest(BytesIO(doc), channel_filter=channel_filter)
+        runs = []
+        for channel_id in index.channel_ids():
+            progs = index.programmes(channel_id)
+            runs.append((channel_id, [p.start for p in progs], [p.stop for p in progs],
+                         [p.title for p in progs], [p.desc for p in progs]))
+    finally:
+        gc.enable()
+    return index.channels, runs
+
+
+def parallel_ingest(path, index=None, channel_filter=None, workers=None):
+    """
+    ingest() for a guide file, spread over a process pool.
+
+    The file is memory-mapped and cut at <programme boundaries into byte
+    ranges; each is parsed in a worker and the per-channel sorted runs are
+    merged in document order, so the result matches ingest(path). Gzipped
+    guides are inflated to a temp file first. Small guides, or workers=1,
+    fall back to ingest(). `index` may be a ProgrammeIndex or any sink with
+    add()/add_channel()/finalize().
+    """
+    workers = workers or os.cpu_count() or 1
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    if compressed:
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, plain = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.xml')
+        try:
+            with os.fdopen(fd, 'wb') as out, gzip.open(path, 'rb') as src:
+                shutil.copyfileobj(src, out, 1 << 20)
+            return parallel_ingest(plain, index, channel_filter, workers)
+        finally:
+            os.unlink(plain)
+
+    if workers < 2 or os.path.getsize(path) < PARALLEL_MIN_BYTES:
+        return ingest(path, index, channel_filter)
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        ranges = shard_ranges(data, workers * SHARDS_PER_WORKER)
+        if len(ranges) < 2:
+            return ingest(path, index, channel_filter)
+        prolog_end, closing = _prolog(data)
+
+    index = index if index is not None else ProgrammeIndex()
+    add_run = getattr(index, 'add_run', None)
+    channel_filter = frozenset(channel_filter) if channel_filter is not None else None
+    # Callers include threads of the playlist server, and forking a
+    # multithreaded process is unsafe: workers always start fresh
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(min(workers, len(ranges)), mp_context=context) as pool:
+        futures = [pool.submit(_ingest_shard, path, start, end, prolog_end, closing, channel_filter)
+                   for start, end in ranges]
+        # Shards are consumed in document order, so channel order and the
+        # order of equal start times come out exactly as a serial parse
+        for future in futures:
+            channels, runs = future.result()
+            for channel_id, name in channels.items():
+                index.add_channel(channel_id, name)
+            for channel_id, starts, stops, titles, descs in runs:
+                progs = list(map(Programme, repeat(channel_id), starts, stops, titles, descs))
+                if add_run is not None:
+                    add_run(channel_id, progs, starts)
+                else:
+                    for programme in progs:
+                        index.add(programme)
+    return index.finalize()
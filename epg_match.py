@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Match playlist tvg-ids to EPG channel ids
+
+An inverted index over normalized tokens and character trigrams of every
+guide channel's id and display-name turns each lookup into a few posting
+list walks instead of a scan over the whole guide. Candidates are ranked by
+IDF-weighted token overlap plus trigram similarity, so "FOX News HD" finds
+"FoxNewsChannel.us" and "ABC 25 Columbia" finds "WOLO.us (ABC 25)".
+
+    python epg_match.py                      # report proposals
+    python epg_match.py --apply              # rewrite confident matches
+"""
+import re
+import math
+import time
+import argparse
+import unicodedata
+from heapq import heappush, heapreplace
+from itertools import repeat
+from operator import add, sub, truediv
+
+from build_cache import write_if_changed
+from epg_cache import open_guide
+from m3u_parser import iter_channels, read_header
+
+# Splits "FoxNews.us" / "ABCEast" / "CNN2" into fox|news|us / abc|east / cnn|2
+WORD_RE = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+TVG_ID_ATTR_RE = re.compile(r'tvg-id=(?:"[^"]*"|[^\s,"]*)')
+EXTINF_DURATION_RE = re.compile(r'#EXTINF:\s*[-\d.]*')
+# Quality/variant markers and filler words that say nothing about which channel it is
+NOISE = frozenset(('hd', 'fhd', 'uhd', 'sd', '4k', 'hevc', 'h264', 'h265', 'backup', 'alt', 'vip', 'raw',
+                   'tv', 'channel', 'network', 'the'))
+
+CANDIDATES = 50         # most preliminary candidates re-scored exactly per query
+COMMON_FRACTION = 0.01  # postings longer than this share of the guide are not walked...
+RAREST_FRACTION = 0.05  # ...except for a query's rarest token, up to this share
+TOKEN_WEIGHT = 0.6      # final score = TOKEN_WEIGHT * tokens + (1 - TOKEN_WEIGHT) * trigrams
+
+
+def tokens(text):
+    """Lowercase word tokens of an id or name, accents stripped, noise dropped"""
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return [t for t in (w.lower() for w in WORD_RE.findall(text)) if t not in NOISE]
+
+
+def trigrams(compact):
+    padded = f'  {compact} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Match:
+    __slots__ = ('channel_id', 'name', 'score')
+
+    def __init__(self, channel_id, name, score):
+        self.channel_id = channel_id
+        self.name = name
+        self.score = score
+
+    def __repr__(self):
+        return f'Match({self.channel_id!r}, {self.name!r}, {self.score:.2f})'
+
+
+class ChannelIndex:
+    """Token and trigram index over {channel id: display name}"""
+
+    def __init__(self, channels):
+        self.ids = []
+        self.names = []
+        self.token_sets = []
+        self.compacts = []
+        self.positions = {}     # exact id -> position
+        self.by_lower_id = {}
+        self.token_postings = {}
+        self.trigram_postings = {}
+        self._posting_sets = {}     # token -> frozenset of its postings, built on first use
+        for n, (channel_id, name) in enumerate(channels.items()):
+            self.ids.append(channel_id)
+            self.names.append(name or channel_id)
+            name_tokens = tokens(name) or tokens(channel_id)
+            token_set = frozenset(tokens(channel_id) + name_tokens)
+            compact = ''.join(name_tokens)
+            self.token_sets.append(token_set)
+            self.compacts.append(compact)
+            self.positions.setdefault(channel_id, n)
+            self.by_lower_id.setdefault(channel_id.lower(), n)
+            for t in token_set:
+                self.token_postings.setdefault(t, []).append(n)
+            for g in trigrams(compact):
+                self.trigram_postings.setdefault(g, []).append(n)
+
+        total = len(self.ids) or 1
+        self.idf = {t: math.log(1 + total / len(p)) for t, p in self.token_postings.items()}
+        self._default_idf = math.log(1 + total)
+        self._walk_limit = max(50, int(total * COMMON_FRACTION))
+        self._rarest_limit = max(50, int(total * RAREST_FRACTION))
+        # Total token weight per channel, to favour candidates with little left unmatched
+        self.weights = [sum(self.idf[t] for t in token_set) or 1.0 for token_set in self.token_sets]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, channel_id):
+        return channel_id in self.positions
+
+    def _weight(self, token):
+        return self.idf.get(token, self._default_idf)
+
+    def _posting_set(self, token):
+        postings = self._posting_sets.get(token)
+        if postings is None:
+            postings = self._posting_sets[token] = frozenset(self.token_postings[token])
+        return postings
+
+    def search(self, text, tvg_id=None, limit=5):
+        """Ranked Matches for a channel name (and/or its current tvg-id)"""
+        name_tokens = tokens(text) or tokens(tvg_id)
+        query = set(tokens(tvg_id) + name_tokens)
+        if not query:
+            return []
+        compact = ''.join(name_tokens)
+        grams = trigrams(compact)
+
+        # Candidates come from the rarer postings only. The rarest known token
+        # gets a higher limit so common-word names still get candidates;
+        # trigrams (the typo/spacing fallback) only when tokens found few.
+        prelim = {}
+        known = sorted((t for t in query if t in self.token_postings),
+                       key=lambda t: len(self.token_postings[t]))
+        for i, t in enumerate(known):
+            postings = self.token_postings[t]
+            if len(postings) > (self._walk_limit if i else self._rarest_limit):
+                break
+            w = self.idf[t]
+            if not prelim:
+                prelim = dict.fromkeys(postings, w)
+                continue
+            for n in postings:
+                prelim[n] = prelim.get(n, 0.0) + w
+        else:
+            i = len(known)
+        # The common tokens not walked still tell candidates apart ("ABC 28
+        # Boston" vs "Syfy 28 Boston"): credit them to the candidates that
+        # have them, so every candidate is ranked against the whole query
+        if prelim:
+            for t in known[i:]:
+                w = self.idf[t]
+                for n in self._posting_set(t).intersection(prelim):
+                    prelim[n] += w
+        # Without trigram credit, prelim is exactly the weight a candidate
+        # shares with the query, so its token score is known before re-scoring
+        exact = True
+        if len(prelim) < CANDIDATES:
+            for g in grams:
+                postings = self.trigram_postings.get(g)
+                if postings and len(postings) <= self._walk_limit:
+                    exact = False
+                    for n in postings:
+                        prelim[n] = prelim.get(n, 0.0) + 0.1
+        if not prelim:
+            return []
+
+        query_weight = sum(self._weight(t) for t in query)
+        idf = self.idf
+        weights = self.weights
+        positions = list(prelim)
+        shares = list(prelim.values())
+        totals = list(map(weights.__getitem__, positions))
+        if exact:
+            # shared / (query + candidate - shared), computed in C over the whole pool
+            ranks = list(map(truediv, shares, map(sub, map(add, repeat(query_weight), totals), shares)))
+        else:
+            ranks = list(map(truediv, shares, totals))
+        order = sorted(range(len(ranks)), key=ranks.__getitem__, reverse=True)
+
+        results = []
+        floor = []      # min-heap of the best `limit` scores so far
+        for i in order[:CANDIDATES]:
+            # Best case the trigrams match perfectly: stop once that cannot
+            # reach the current top `limit`
+            if exact and len(floor) == limit and TOKEN_WEIGHT * ranks[i] + (1 - TOKEN_WEIGHT) < floor[0]:
+                break
+            n = positions[i]
+            # Candidate tokens are all indexed, so what it has beyond the
+            # query weighs its total minus the shared part
+            shared = sum(map(idf.__getitem__, query & self.token_sets[n]))
+            union = query_weight + weights[n] - shared
+            token_score = shared / union if union else 0.0
+            other = trigrams(self.compacts[n])
+            gram_score = 2 * len(grams & other) / (len(grams) + len(other)) if grams and other else 0.0
+            score = TOKEN_WEIGHT * token_score + (1 - TOKEN_WEIGHT) * gram_score
+            results.append(Match(self.ids[n], self.names[n], score))
+            if len(floor) < limit:
+                heappush(floor, score)
+            elif score > floor[0]:
+                heapreplace(floor, score)
+        results.sort(key=lambda m: m.score, reverse=True)
+        return results[:limit]
+
+    def match(self, channel, limit=5):
+        """
+        Matches for a playlist Channel. A tvg-id that exists in the guide
+        (ignoring case) is returned as the only, perfect match.
+        """
+        if channel.tvg_id:
+            n = self.by_lower_id.get(channel.tvg_id.lower())
+            if n is not None:
+                return [Match(self.ids[n], self.names[n], 1.0)]
+        return self.search(channel.tvg_name or channel.name, channel.tvg_id, limit)
+
+
+def propose(channels, index, limit=3, min_score=0.5):
+    """
+    [(channel, [Match])] for every channel whose tvg-id is missing from the
+    guide (exact id hits are skipped).
+    """
+    proposals = []
+    for ch in channels:
+        if ch.tvg_id and ch.tvg_id in index:
+            continue
+        matches = [m for m in index.match(ch, limit) if m.score >= min_score]
+        proposals.append((ch, matches))
+    return proposals
+
+
+def set_tvg_id(extinf, tvg_id):
+    """Return an #EXTINF line with its tvg-id replaced (or added after the duration)"""
+    if TVG_ID_ATTR_RE.search(extinf):
+        return TVG_ID_ATTR_RE.sub(lambda m: f'tvg-id="{tvg_id}"', extinf, count=1)
+    end = EXTINF_DURATION_RE.match(extinf).end()
+    return f'{extinf[:end]} tvg-id="{tvg_id}"{extinf[end:]}'
+
+
+def rewrite_playlist(path, output, replacements):
+    """Apply {line_num: tvg_id} to the #EXTINF lines of `path`; returns True if written"""
+    lines = []
+    with open(path, 'r', encoding='utf-8') as src:
+        for line_num, line in enumerate(src):
+            tvg_id = replacements.get(line_num)
+            if tvg_id:
+                ending = line[len(line.rstrip('\r\n')):]
+                line = set_tvg_id(line.rstrip('\r\n'), tvg_id) + ending
+            lines.append(line)
+    return write_if_changed(output, ''.join(lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Propose (and apply) EPG ids for unmatched playlist channels')
+    parser.add_argument('--playlist', default='playlist1.m3u',
+                       help='Playlist to match (default: playlist1.m3u)')
+    parser.add_argument('--epg',
+                       help='Guide URL (default: the playlist url-tvg)')
+    parser.add_argument('--top', type=int, default=3,
+                       help='Proposals shown per channel')
+    parser.add_argument('--min-score', type=float, default=0.5,
+                       help='Ignore matches scoring below this (0-1)')
+    parser.add_argument('--apply', action='store_true',
+                       help='Rewrite tvg-ids whose best match clears --apply-score')
+    parser.add_argument('--apply-score', type=float, default=0.75,
+                       help='Minimum score for --apply to change a tvg-id')
+    parser.add_argument('--output',
+                       help='Where --apply writes the playlist (default: in place)')
+    args = parser.parse_args()
+
+    epg_url = args.epg or read_header(args.playlist).get('url-tvg')
+    if not epg_url:
+        parser.error('no --epg given and the playlist has no url-tvg')
+
+    print(f"Loading EPG: {epg_url}")
+    with open_guide(epg_url) as guide:
+        epg_channels = guide.channels
+    start = time.perf_counter()
+    index = ChannelIndex(epg_channels)
+    built = time.perf_counter() - start
+
+    channels = list(iter_channels(args.playlist))
+    start = time.perf_counter()
+    proposals = propose(channels, index, args.top, args.min_score)
+    matched = time.perf_counter() - start
+    print(f"Indexed {len(index)} EPG channels in {built:.2f}s, "
+          f"matched {len(proposals)} unmatched channels in {matched:.2f}s\n")
+
+    replacements = {}
+    for ch, matches in proposals:
+        current = ch.tvg_id or '(none)'
+        if not matches:
+            print(f"✗ {ch.name[:40]:40} [{current}] no match")
+            continue
+        best = matches[0]
+        confident = best.score >= args.apply_score
+        print(f"{'✓' if confident else '?'} {ch.name[:40]:40} [{current}]")
+        for m in matches:
+            print(f"    {m.score:.2f}  {m.channel_id:35} {m.name}")
+        if confident and best.channel_id != ch.tvg_id:
+            replacements[ch.line_num] = best.channel_id
+
+    print(f"\n{len(replacements)} confident matches (score >= {args.apply_score:g})")
+    if args.apply and replacements:
+        output = args.output or args.playlist
+        if rewrite_playlist(args.playlist, output, replacements):
+            print(f"✓ Updated {len(replacements)} tvg-ids in {output}")
+        else:
+            print(f"✓ {output} already up to date")
+
+if __name__ == "__main__":
+    main()
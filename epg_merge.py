@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Build one compact XMLTV guide for the playlist from several sources
+
+Every source is fetched in its own thread and parsed as it downloads, so the
+slowest guide sets the pace instead of the sum of all of them. Only the
+channels the playlist references (by tvg-id) and programmes overlapping the
+time window are kept; everything else is discarded element by element.
+Where sources overlap on a channel, programmes from the source listed first
+win and later sources only fill the gaps. The result is stream-written
+(gzipped if the output ends in .gz) and swapped in atomically.
+
+    python epg_merge.py --output guide.xml.gz URL [URL ...]
+"""
+import os
+import gzip
+import time
+import zlib
+import argparse
+import xml.etree.ElementTree as ET
+from bisect import bisect_right, insort
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from build_cache import atomic_open
+from epg_cache import FETCH_ERRORS
+from epg_index import open_xmltv, parse_xmltv_time
+from m3u_parser import iter_channels, read_header
+from metrics import timed
+
+PAST_HOURS = 6
+FUTURE_HOURS = 72
+
+
+class SourceGuide:
+    """What one source contributed: kept <channel>/<programme> elements, serialized"""
+
+    def __init__(self, url, priority):
+        self.url = url
+        self.priority = priority
+        self.channels = {}      # channel id -> <channel> bytes
+        self.programmes = {}    # channel id -> [(start, stop, <programme> bytes)]
+        self.seen_channels = 0
+        self.seen_programmes = 0
+        self.bytes = 0
+        self.error = None
+
+
+class _CountingStream:
+    """Count bytes read from the (compressed) source"""
+
+    def __init__(self, stream, guide):
+        self.stream = stream
+        self.guide = guide
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.guide.bytes += len(data)
+        return data
+
+
+def _open_source(url, timeout):
+    if os.path.exists(url):
+        return open(url, 'rb')
+    response = requests.get(url, timeout=timeout, stream=True)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    return response.raw
+
+
+def load_source(url, priority, wanted, start, stop, timeout=30):
+    """Stream one XMLTV source, keeping only `wanted` channels within [start, stop)"""
+    guide = SourceGuide(url, priority)
+    times = {}
+
+    def to_epoch(value):
+        try:
+            return times[value]
+        except KeyError:
+            ts = times[value] = parse_xmltv_time(value)
+            return ts
+
+    try:
+        with timed('epg_merge_source'):
+            stream = _open_source(url, timeout)
+            try:
+                context = ET.iterparse(open_xmltv(_CountingStream(stream, guide)), events=('start', 'end'))
+                root = None
+                for event, elem in context:
+                    if root is None and event == 'start':
+                        root = elem
+                        continue
+                    if event != 'end':
+                        continue
+                    tag = elem.tag
+                    if tag == 'programme':
+                        guide.seen_programmes += 1
+                        channel_id = elem.get('channel')
+                        if channel_id in wanted:
+                            begin = to_epoch(elem.get('start'))
+                            end = to_epoch(elem.get('stop')) or begin
+                            if begin is not None and end > start and begin < stop:
+                                elem.tail = None
+                                guide.programmes.setdefault(channel_id, []).append(
+                                    (begin, end, ET.tostring(elem, encoding='utf-8')))
+                    elif tag == 'channel':
+                        guide.seen_channels += 1
+                        channel_id = elem.get('id')
+                        if channel_id in wanted and channel_id not in guide.channels:
+                            elem.tail = None
+                            guide.channels[channel_id] = ET.tostring(elem, encoding='utf-8')
+                    else:
+                        continue
+                    elem.clear()
+                    root.clear()
+            finally:
+                stream.close()
+    except FETCH_ERRORS + (ET.ParseError, OSError, EOFError, zlib.error) as e:
+        guide.error = str(e) or type(e).__name__
+    return guide
+
+
+def merge_programmes(guides, channel_id):
+    """
+    Programmes for one channel, highest-priority source first: a programme
+    from a later source is kept only if it overlaps nothing already kept.
+    """
+    starts = []     # sorted starts of kept programmes
+    kept = {}       # start -> (stop, bytes)
+    for guide in guides:
+        for begin, end, data in guide.programmes.get(channel_id, ()):
+            i = bisect_right(starts, begin)
+            if i and kept[starts[i - 1]][0] > begin:
+                continue    # overlaps the previous kept programme
+            if i < len(starts) and starts[i] < end:
+                continue    # overlaps the next one
+            if begin in kept:
+                continue
+            insort(starts, begin)
+            kept[begin] = (end, data)
+    return [kept[s][1] for s in starts]
+
+
+def _channel_stub(channel_id, name):
+    elem = ET.Element('channel', id=channel_id)
+    ET.SubElement(elem, 'display-name').text = name or channel_id
+    return ET.tostring(elem, encoding='utf-8')
+
+
+def write_guide(path, order, guides, names, compress=None):
+    """
+    Stream the merged guide to `path`. `order` is the channel ids in playlist
+    order; `names` supplies a display-name for channels no source described.
+    Returns (channels written, programmes written).
+    """
+    compress = path.endswith('.gz') if compress is None else compress
+    guides = sorted(guides, key=lambda g: g.priority)
+    channels = programmes = 0
+    with atomic_open(path) as raw:
+        out = gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) if compress else raw
+        out.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                  b'<tv generator-info-name="ip-live epg_merge">\n')
+        present = []
+        for channel_id in order:
+            element = next((g.channels[channel_id] for g in guides if channel_id in g.channels), None)
+            if element is None:
+                if not any(channel_id in g.programmes for g in guides):
+                    continue
+                element = _channel_stub(channel_id, names.get(channel_id))
+            out.write(element + b'\n')
+            present.append(channel_id)
+            channels += 1
+        for channel_id in present:
+            for data in merge_programmes(guides, channel_id):
+                out.write(data + b'\n')
+                programmes += 1
+        out.write(b'</tv>\n')
+        if compress:
+            out.close()
+    return channels, programmes
+
+
+def build(sources, channels, output, past=PAST_HOURS, future=FUTURE_HOURS, compress=None,
+          now=None, timeout=30):
+    """
+    Fetch `sources` (URLs or paths, highest priority first) concurrently and
+    write the guide for `channels` (playlist Channels) to `output`.
+    Returns (guides, channels written, programmes written).
+    """
+    now = time.time() if now is None else now
+    start, stop = now - past * 3600, now + future * 3600
+    order = list(dict.fromkeys(ch.tvg_id for ch in channels if ch.tvg_id))
+    names = {}
+    for ch in channels:
+        if ch.tvg_id:
+            names.setdefault(ch.tvg_id, ch.tvg_name or ch.name)
+    wanted = frozenset(order)
+
+    with ThreadPoolExecutor(max_workers=max(1, len(sources))) as pool:
+        guides = list(pool.map(lambda item: load_source(item[1], item[0], wanted, start, stop, timeout),
+                               enumerate(sources)))
+    loaded = [g for g in guides if g.error is None]
+    if not loaded:
+        raise RuntimeError('no EPG source could be loaded: ' +
+                           '; '.join(f'{g.url}: {g.error}' for g in guides))
+    with timed('epg_merge_write'):
+        written = write_guide(output, order, loaded, names, compress)
+    return (guides,) + written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge XMLTV guides into one trimmed to the playlist')
+    parser.add_argument('sources', nargs='*',
+                       help='Guide URLs or files, highest priority first '
+                            '(default: the playlist url-tvg, comma-separated allowed)')
+    parser.add_argument('--playlist', default='playlist1.m3u',
+                       help='Playlist whose tvg-ids are kept (default: playlist1.m3u)')
+    parser.add_argument('--output', default='guide.xml.gz',
+                       help='Merged guide; gzipped when it ends in .gz (default: guide.xml.gz)')
+    parser.add_argument('--past', type=float, default=PAST_HOURS,
+                       help='Hours of already-aired programmes to keep')
+    parser.add_argument('--future', type=float, default=FUTURE_HOURS,
+                       help='Hours of upcoming programmes to keep')
+    parser.add_argument('--timeout', type=float, default=30,
+                       help='Per-source connect/read timeout in seconds')
+    args = parser.parse_args()
+
+    sources = args.sources
+    if not sources:
+        header_url = read_header(args.playlist).get('url-tvg') or ''
+        sources = [url.strip() for url in header_url.split(',') if url.strip()]
+    if not sources:
+        parser.error('no sources given and the playlist has no url-tvg')
+
+    channels = list(iter_channels(args.playlist))
+    wanted = len({ch.tvg_id for ch in channels if ch.tvg_id})
+    print(f"Merging {len(sources)} sources for {wanted} playlist tvg-ids "
+          f"({args.past:g}h back, {args.future:g}h ahead)")
+
+    start = time.perf_counter()
+    try:
+        guides, kept_channels, kept_programmes = build(
+            sources, channels, args.output, args.past, args.future, timeout=args.timeout)
+    except RuntimeError as e:
+        print(f"✗ {e}")
+        raise SystemExit(1)
+    elapsed = time.perf_counter() - start
+
+    downloaded = 0
+    for guide in guides:
+        if guide.error:
+            print(f"✗ {guide.url}: {guide.error}")
+            continue
+        downloaded += guide.bytes
+        print(f"✓ {guide.url}: {len(guide.channels)}/{guide.seen_channels} channels, "
+              f"{sum(len(p) for p in guide.programmes.values())}/{guide.seen_programmes} programmes kept")
+
+    size = os.path.getsize(args.output)
+    print(f"\nWrote {args.output}: {kept_channels} channels, {kept_programmes} programmes, "
+          f"{size / 1024:.0f}KB (sources {downloaded / 1024:.0f}KB) in {elapsed:.1f}s")
+    missing = wanted - kept_channels
+    if missing:
+        print(f"{missing} tvg-ids not found in any source (python epg_match.py suggests fixes)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Xtream-compatible EPG answers (get_short_epg, get_simple_data_table)
+
+Backed by an in-memory ProgrammeIndex: per-channel programme lists sorted by
+start time, located with bisect. Each programme's JSON listing (base64 title
+and description, formatted times) is rendered once per channel. Responses
+are cached until the next programme boundary, so repeated now/next polls in
+the same slot cost a dict lookup.
+"""
+import time
+import json
+import base64
+
+from epg_cache import EPGCache
+from epg_index import parallel_ingest
+from metrics import timed
+
+DEFAULT_LIMIT = 4
+MAX_LIMIT = 50
+DAY = 86400
+
+
+def _b64(text):
+    return base64.b64encode((text or '').encode('utf-8')).decode('ascii')
+
+
+def _local(ts):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+
+
+def _day_start(at):
+    return time.mktime(time.localtime(at)[:3] + (0, 0, 0, 0, 0, -1))
+
+
+class XtreamEPG:
+    """Query layer over a finalized ProgrammeIndex"""
+
+    def __init__(self, index):
+        self.index = index
+        self._listings = {}     # channel id -> [listing dict] parallel to programmes
+        self._responses = {}    # (action, channel id, arg) -> (valid_from, valid_until, body)
+
+    def listings(self, channel_id):
+        """Xtream listing dicts for every programme of a channel (built once)"""
+        listings = self._listings.get(channel_id)
+        if listings is None:
+            listings = []
+            for p in self.index.programmes(channel_id):
+                stop = p.stop or p.start
+                listings.append({
+                    'id': str(p.start),
+                    'epg_id': channel_id,
+                    'title': _b64(p.title),
+                    'lang': '',
+                    'start': _local(p.start),
+                    'end': _local(stop),
+                    'description': _b64(p.desc),
+                    'channel_id': channel_id,
+                    'start_timestamp': str(int(p.start)),
+                    'stop_timestamp': str(int(stop)),
+                })
+            self._listings[channel_id] = listings
+        return listings
+
+    def _bounds(self, progs, i, at):
+        """The [from, until) interval in which locate() keeps returning i"""
+        if i < len(progs) and progs[i].start <= at:
+            # Airing now: valid until it ends
+            return progs[i].start, progs[i].stop or progs[i].start
+        # Between programmes: valid until the next one starts
+        valid_from = (progs[i - 1].stop or progs[i - 1].start) if i else float('-inf')
+        valid_until = progs[i].start if i < len(progs) else float('inf')
+        return valid_from, valid_until
+
+    def _cached(self, key, at, build):
+        hit = self._responses.get(key)
+        if hit and hit[0] <= at < hit[1]:
+            return hit[2]
+        valid_from, valid_until, body = build()
+        self._responses[key] = (valid_from, valid_until, body)
+        return body
+
+    def short_epg(self, channel_id, limit=DEFAULT_LIMIT, at=None):
+        """JSON bytes for get_short_epg: the current programme and the next ones"""
+        at = time.time() if at is None else at
+        limit = max(1, min(limit, MAX_LIMIT))
+
+        def build():
+            progs, i = self.index.locate(channel_id, at)
+            if not progs:
+                return float('-inf'), float('inf'), b'{"epg_listings":[]}'
+            valid_from, valid_until = self._bounds(progs, i, at)
+            body = json.dumps({'epg_listings': self.listings(channel_id)[i:i + limit]}).encode()
+            return valid_from, valid_until, body
+
+        return self._cached(('short', channel_id, limit), at, build)
+
+    def simple_data_table(self, channel_id, at=None):
+        """JSON bytes for get_simple_data_table: today's programmes onwards"""
+        at = time.time() if at is None else at
+
+        def build():
+            progs, i = self.index.locate(channel_id, at)
+            if not progs:
+                return float('-inf'), float('inf'), b'{"epg_listings":[]}'
+            valid_from, valid_until = self._bounds(progs, i, at)
+            day = _day_start(at)
+            valid_until = min(valid_until, day + DAY)
+            first = self.index.locate(channel_id, day)[1]
+            listings = self.listings(channel_id)
+            table = []
+            for n in range(first, len(listings)):
+                row = dict(listings[n])
+                row['now_playing'] = 1 if n == i and progs[n].start <= at else 0
+                row['has_archive'] = 0
+                table.append(row)
+            return max(valid_from, day), valid_until, json.dumps({'epg_listings': table}).encode()
+
+        return self._cached(('table', channel_id, None), at, build)
+
+
+class EPGStore:
+    """
+    Keeps an XtreamEPG for one guide URL current.
+
+    load() runs in a worker thread: the guide is revalidated through the
+    on-disk EPGCache (conditional GET, raw copy kept) and re-ingested into
+    memory only when its content changed or the channel set did.
+    """
+
+    def __init__(self, url, cache_dir=None, max_age=3600):
+        self.url = url
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.epg = None
+        self._loaded = None     # (sha256, channel filter) of the current epg
+
+    def load(self, channel_filter=None):
+        cache = EPGCache(self.cache_dir, max_age=self.max_age)
+        try:
+            guide = cache.open(self.url)
+            key = (guide.sha256, frozenset(channel_filter) if channel_filter else None)
+            if key == self._loaded:
+                return False
+            with timed('epg_parse'):
+                index = parallel_ingest(cache.raw_path(self.url), channel_filter=channel_filter)
+        finally:
+            cache.close()
+        self.epg, self._loaded = XtreamEPG(index), key
+        return True
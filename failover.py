@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Failover sets: one playlist entry per channel, mirrors ranked by health
+
+The same channel is often carried by several origins (fl1/fl3/fl5.moveonjoy.com,
+23.237.104.106, ...). The merge groups such entries into a failover set by
+tvg-id, or by normalized name when there is none. Only the best-ranked URL
+goes into the playlist; the whole ranked set is written to a sidecar
+(playlist1.failover.json) for players and for re-ranking.
+
+URLs are ranked by their recent probe history in the health store: URLs
+whose last probe succeeded come first, ordered by median latency inflated
+by their failure rate; then never-probed URLs; then URLs whose last probe
+failed. Ties keep source precedence.
+
+Re-ranking needs neither the sources nor the merge, so it can run every
+few minutes:
+
+    python failover.py --probe          # probe every mirror, then re-rank
+"""
+import re
+import json
+import time
+import argparse
+
+from artifacts import build_artifacts
+from build_cache import write_if_changed
+from health_store import DEFAULT_DB, HealthStore
+from m3u_parser import parse_extinf
+from stream_checker import check_streams
+
+SIDECAR_VERSION = 1
+WINDOW_HOURS = 24
+SWITCH_MARGIN = 0.2     # a mirror must be 20% faster to replace a live best URL
+NAME_WORD_RE = re.compile(r'[a-z0-9]+')
+RESOLUTION_RE = re.compile(r'\b\d{3,4}[pi]\b|\[[^\]]*\]', re.I)
+# Dropped from names before comparing: quality markers and the default feed
+NAME_NOISE = frozenset(('hd', 'fhd', 'uhd', 'sd', '4k', 'hevc', 'usa', 'us', 'east', 'est'))
+# Time-shifted feeds are different channels, not mirrors
+WEST_FEED = frozenset(('west', 'pacific', 'pst'))
+
+LIVE = 'live'
+UNKNOWN = 'unknown'
+DOWN = 'down'
+
+
+def sidecar_path(playlist):
+    """playlist1.m3u -> playlist1.failover.json"""
+    base = playlist[:-4] if playlist.endswith('.m3u') else playlist
+    return base + '.failover.json'
+
+
+def set_key(tvg_id, name):
+    """Failover set key for an entry, or None if it cannot be grouped"""
+    words = NAME_WORD_RE.findall(RESOLUTION_RE.sub(' ', name or '').lower())
+    feed = '|west' if WEST_FEED.intersection(words) else ''
+    if tvg_id:
+        return tvg_id.lower() + feed
+    words = [w for w in words if w not in NAME_NOISE and w not in WEST_FEED]
+    return ' '.join(words) + feed if words else None
+
+
+def url_state(entry):
+    """LIVE / UNKNOWN / DOWN for a health_store.HealthStats (or None)"""
+    if entry is None or not entry.probes:
+        return UNKNOWN
+    if entry.last_verified is not None and entry.last_verified >= entry.last_checked:
+        return LIVE
+    return DOWN
+
+
+def _rank_key(entry, n):
+    state = url_state(entry)
+    if state == LIVE:
+        success = max(entry.ok / entry.probes, 0.05)
+        return (0, (entry.p50 or 1.0) / success, n)
+    if state == UNKNOWN:
+        return (1, 0.0, n)
+    return (2, -entry.ok / entry.probes, n)
+
+
+def rank_urls(urls, stats, current=None):
+    """
+    Sort `urls` (given in precedence order) best first using {url: HealthStats}.
+    A live `current` best URL stays first unless another is SWITCH_MARGIN
+    faster, so near-equal mirrors do not flip on every re-rank.
+    """
+    keys = {url: _rank_key(stats.get(url), n) for n, url in enumerate(urls)}
+    ranked = sorted(urls, key=keys.get)
+    if current in keys and ranked[0] != current:
+        best, kept = keys[ranked[0]], keys[current]
+        if kept[0] == best[0] == 0 and best[1] > kept[1] * (1 - SWITCH_MARGIN):
+            ranked.remove(current)
+            ranked.insert(0, current)
+    return ranked
+
+
+def describe(url, stats):
+    entry = stats.get(url)
+    return {
+        'url': url,
+        'state': url_state(entry),
+        'uptime': round(entry.uptime, 1) if entry and entry.probes else None,
+        'p50': round(entry.p50, 3) if entry and entry.p50 is not None else None,
+    }
+
+
+def load_stats(db_path, window_hours=WINDOW_HOURS):
+    """{url: HealthStats} of stream probes within the window ({} without a database)"""
+    if not db_path:
+        return {}
+    with HealthStore(db_path) as store:
+        return store.channel_stats('stream', time.time() - window_hours * 3600)
+
+
+def group_failover(categories, stats, current=None):
+    """
+    Collapse merged {category: [(url, info)]} to one entry per failover set.
+
+    The first member met (category order, then precedence) keeps its place,
+    category and #EXTINF; its URL becomes the best-ranked one. `current`
+    ({set key: url}, see current_urls) gives the hysteresis in rank_urls the
+    URL each set is on now, so a rebuild agrees with a rerank. Returns
+    (categories, sets) where sets lists every set with more than one URL.
+    """
+    current = current or {}
+    members = {}        # key -> [(category, index, url, Channel)]
+    for category, entries in categories.items():
+        for i, (url, info) in enumerate(entries):
+            ch = parse_extinf(info, url)
+            key = set_key(ch.tvg_id, ch.name)
+            if key is not None:
+                members.setdefault(key, []).append((category, i, url, ch))
+
+    replace = {}        # (category, index) -> best url
+    drop = set()        # (category, index) of alternates
+    sets = []
+    for key, group in members.items():
+        if len(group) < 2:
+            continue
+        ranked = rank_urls([url for _, _, url, _ in group], stats, current=current.get(key))
+        category, i, _, ch = group[0]
+        replace[(category, i)] = ranked[0]
+        drop.update((c, j) for c, j, _, _ in group[1:])
+        sets.append({
+            'key': key,
+            'name': ch.name,
+            'tvg_id': ch.tvg_id,
+            'group': category,
+            'urls': [describe(url, stats) for url in ranked],
+        })
+
+    result = {}
+    for category, entries in categories.items():
+        result[category] = [(replace.get((category, i), url), info)
+                            for i, (url, info) in enumerate(entries) if (category, i) not in drop]
+    return result, sets
+
+
+def write_sidecar(path, playlist, sets, window_hours=WINDOW_HOURS):
+    """Write the ranked sets next to the playlist; returns True if the file changed"""
+    data = {
+        'version': SIDECAR_VERSION,
+        'playlist': playlist,
+        'window_hours': window_hours,
+        'sets': sets,
+    }
+    return write_if_changed(path, json.dumps(data, indent=1) + '\n')
+
+
+def load_sidecar(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != SIDECAR_VERSION:
+        raise ValueError(f'{path}: unsupported failover sidecar version {data.get("version")!r}')
+    return data
+
+
+def current_urls(path):
+    """{set key: url the playlist uses now} from an existing sidecar ({} if none)"""
+    try:
+        data = load_sidecar(path)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return {entry['key']: entry['urls'][0]['url'] for entry in data['sets'] if entry['urls']}
+
+
+def rerank(playlist, stats, sidecar=None, window_hours=WINDOW_HOURS):
+    """
+    Re-rank every set in the sidecar and point the playlist at each set's
+    new best URL. Only the URL lines change. Returns the [(set, old url,
+    new url)] switches made.
+    """
+    sidecar = sidecar or sidecar_path(playlist)
+    data = load_sidecar(sidecar)
+    switches = {}
+    changes = []
+    for entry in data['sets']:
+        urls = [u['url'] for u in entry['urls']]
+        ranked = rank_urls(urls, stats, current=urls[0])
+        if ranked[0] != urls[0]:
+            switches[urls[0]] = ranked[0]
+            changes.append((entry, urls[0], ranked[0]))
+        entry['urls'] = [describe(url, stats) for url in ranked]
+
+    if switches:
+        lines = []
+        with open(playlist, 'r', encoding='utf-8') as f:
+            for line in f:
+                new = switches.get(line.rstrip('\r\n'))
+                if new and not line.startswith('#'):
+                    line = new + line[len(line.rstrip('\r\n')):]
+                lines.append(line)
+        write_if_changed(playlist, ''.join(lines))
+    write_sidecar(sidecar, data['playlist'], data['sets'], window_hours)
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-rank failover sets and switch the playlist to the best mirrors')
+    parser.add_argument('--playlist', default='playlist1.m3u',
+                       help='Merged playlist (default: playlist1.m3u)')
+    parser.add_argument('--history', default=DEFAULT_DB,
+                       help='Health history database the ranking reads (default: .health.sqlite)')
+    parser.add_argument('--window', type=float, default=WINDOW_HOURS,
+                       help='Hours of probe history to rank on')
+    parser.add_argument('--probe', action='store_true',
+                       help='Probe every URL in the sets first (alternates are not in the playlist, '
+                            'so test_channels.py never checks them)')
+    parser.add_argument('--no-artifacts', action='store_true',
+                       help='Do not refresh the precompressed/per-group artifacts afterwards')
+    args = parser.parse_args()
+
+    sidecar = sidecar_path(args.playlist)
+    try:
+        data = load_sidecar(sidecar)
+    except FileNotFoundError:
+        parser.error(f'{sidecar} not found; enable "failover" in the merge rules and run merge_playlists.py')
+
+    if args.probe:
+        urls = [u['url'] for entry in data['sets'] for u in entry['urls']]
+        print(f"Probing {len(urls)} mirror URLs in {len(data['sets'])} sets...")
+        with HealthStore(args.history) as store:
+            check_streams(urls, store.recorder('stream'), concurrency=50, per_host=6)
+
+    changes = rerank(args.playlist, load_stats(args.history, args.window), sidecar, args.window)
+    for entry, old, new in changes:
+        print(f"~ {entry['name'][:40]:40} {old} -> {new}")
+    print(f"✓ {len(data['sets'])} failover sets re-ranked, {len(changes)} switched")
+
+    if changes and not args.no_artifacts:
+        status, manifest = build_artifacts(args.playlist)
+        if status != 'up-to-date':
+            print(f"Artifacts: {len(manifest['files'])} files, {len(manifest['written'])} rewritten")
+
+if __name__ == "__main__":
+    main()
@@ -30,4 +30,6 @@ print("1. https://raw.githubusercontent.com/usa-local-epg/usa-locals/main/epg.xm
 print("2. http://epg.streamstv.me/epg/guide-usa.xml.gz")
 print("3. https://i.mjh.nz/PlutoTV/all.xml.gz")
 print("4. https://iptv-org.github.io/epg/guides/us/tvguide.com.epg.xml")
-print("\nNote: You may need to adjust tvg-id values to match the EPG source.")
\ No newline at end of file
+print("\nNote: You may need to adjust tvg-id values to match the EPG source.")
+print("Or combine several into one guide trimmed to this playlist:")
+print("  python epg_merge.py --output guide.xml.gz <url> <url> ...")
\ No newline at end of file
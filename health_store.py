@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Persistent channel-health history: every probe result in a local SQLite file
+
+Checkers record CheckResults here instead of forgetting them at exit, which
+gives uptime and latency percentiles per channel and per host over time, and
+lets a sweep skip anything verified within a freshness window.
+"""
+import os
+import time
+import sqlite3
+import argparse
+
+from host_guard import HOST_DOWN
+
+DEFAULT_DB = os.environ.get('HEALTH_DB', '.health.sqlite')
+BATCH_SIZE = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS probes (
+    url TEXT NOT NULL,
+    tvg_id TEXT,
+    host TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    status TEXT,
+    latency REAL,
+    checked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS probes_by_url ON probes (url, checked_at);
+CREATE INDEX IF NOT EXISTS probes_by_host ON probes (host, checked_at);
+CREATE TABLE IF NOT EXISTS latest (
+    kind TEXT NOT NULL,
+    url TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    status TEXT,
+    checked_at REAL NOT NULL,
+    verified_at REAL,
+    PRIMARY KEY (kind, url)
+);
+'''
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list, or None if empty"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class HealthStats:
+    """Aggregates for one channel URL or host"""
+    __slots__ = ('key', 'tvg_id', 'probes', 'ok', 'p50', 'p95', 'last_checked', 'last_verified')
+
+    def __init__(self, key, tvg_id=None):
+        self.key = key
+        self.tvg_id = tvg_id
+        self.probes = 0
+        self.ok = 0
+        self.p50 = None
+        self.p95 = None
+        self.last_checked = None
+        self.last_verified = None
+
+    @property
+    def uptime(self):
+        """Percentage of probes that succeeded"""
+        return self.ok * 100.0 / self.probes if self.probes else None
+
+    def __repr__(self):
+        return f'HealthStats({self.key!r}, probes={self.probes}, uptime={self.uptime})'
+
+
+class HealthStore:
+    """
+    Append-only probe log plus a per-URL "latest" row.
+
+    `kind` separates independent checks of the same URL ('stream', 'deep',
+    'logo'). Writes are batched; call flush() (or use the store as a context
+    manager) to commit the tail.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_DB
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SCHEMA)
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def record(self, result, kind='stream', at=None):
+        """
+        Queue one CheckResult (tvg-id is taken from result.item if present).
+        HOST_DOWN results are skipped: no request was made, so they say
+        nothing about the URL.
+        """
+        if result.status == HOST_DOWN:
+            return
+        at = time.time() if at is None else at
+        tvg_id = getattr(result.item, 'tvg_id', None)
+        self._pending.append((result.url, tvg_id, result.host, kind, int(bool(result.ok)),
+                              str(result.status), result.latency, at))
+        if len(self._pending) >= BATCH_SIZE:
+            self.flush()
+
+    def recorder(self, kind='stream', on_result=None):
+        """Return an on_result callback that records, then forwards to `on_result`"""
+        def callback(result):
+            self.record(result, kind)
+            if on_result:
+                on_result(result)
+        return callback
+
+    def flush(self):
+        if not self._pending:
+            return
+        # Collapse the batch to one "latest" row per URL before upserting
+        latest = {}
+        for url, _, _, kind, ok, status, _, at in self._pending:
+            row = latest.get((kind, url))
+            verified = at if ok else None
+            if row is None:
+                latest[(kind, url)] = [kind, url, ok, status, at, verified]
+                continue
+            if at >= row[4]:
+                row[2:5] = ok, status, at
+            if verified and (row[5] is None or verified > row[5]):
+                row[5] = verified
+        with self.db:
+            self.db.executemany('INSERT INTO probes VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self._pending)
+            self.db.executemany(
+                'INSERT INTO latest VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (kind, url) DO UPDATE SET '
+                'ok = CASE WHEN excluded.checked_at >= latest.checked_at THEN excluded.ok ELSE latest.ok END, '
+                'status = CASE WHEN excluded.checked_at >= latest.checked_at '
+                'THEN excluded.status ELSE latest.status END, '
+                'checked_at = MAX(excluded.checked_at, latest.checked_at), '
+                'verified_at = CASE WHEN latest.verified_at IS NULL OR excluded.verified_at > latest.verified_at '
+                'THEN COALESCE(excluded.verified_at, latest.verified_at) ELSE latest.verified_at END',
+                latest.values())
+        self._pending = []
+
+    def last_checked(self, url, kind='stream'):
+        """(checked_at, ok, status) of the most recent probe of `url`, or None"""
+        self.flush()
+        row = self.db.execute('SELECT checked_at, ok, status FROM latest WHERE kind = ? AND url = ?',
+                              (kind, url)).fetchone()
+        return (row[0], bool(row[1]), row[2]) if row else None
+
+    def last_verified(self, url, kind='stream'):
+        """Timestamp of the last successful probe of `url`, or None"""
+        self.flush()
+        row = self.db.execute('SELECT verified_at FROM latest WHERE kind = ? AND url = ?',
+                              (kind, url)).fetchone()
+        return row[0] if row else None
+
+    def stale(self, items, max_age, kind='stream', url_of=None, ok_only=True):
+        """
+        Return the items whose URL has not been checked within `max_age`
+        seconds. With ok_only (the default) only successful probes count as
+        fresh, so recent failures are retried.
+        """
+        self.flush()
+        url_of = url_of or (lambda item: item if isinstance(item, str) else item.url)
+        column = 'verified_at' if ok_only else 'checked_at'
+        cutoff = time.time() - max_age
+        fresh = {url for url, in self.db.execute(
+            f'SELECT url FROM latest WHERE kind = ? AND {column} >= ?', (kind, cutoff))}
+        return [item for item in items if url_of(item) not in fresh]
+
+    def _stats(self, column, kind, since, where='', params=()):
+        self.flush()
+        since = 0 if since is None else since
+        stats = {}
+        rows = self.db.execute(
+            f'SELECT {column}, MAX(tvg_id), COUNT(*), SUM(ok), MAX(checked_at), '
+            f'MAX(CASE WHEN ok THEN checked_at END) FROM probes '
+            f'WHERE kind = ? AND checked_at >= ? {where} GROUP BY {column}',
+            (kind, since) + params)
+        for key, tvg_id, probes, ok, last_checked, last_verified in rows:
+            entry = stats[key] = HealthStats(key, tvg_id if column == 'url' else None)
+            entry.probes, entry.ok = probes, ok
+            entry.last_checked, entry.last_verified = last_checked, last_verified
+
+        # SQLite has no percentile aggregate: walk successful latencies in order
+        latencies = []
+        current = None
+        rows = self.db.execute(
+            f'SELECT {column}, latency FROM probes WHERE kind = ? AND checked_at >= ? AND ok '
+            f'AND latency IS NOT NULL {where} ORDER BY {column}, latency',
+            (kind, since) + params)
+        for key, latency in rows:
+            if key != current:
+                self._set_percentiles(stats, current, latencies)
+                current, latencies = key, []
+            latencies.append(latency)
+        self._set_percentiles(stats, current, latencies)
+        return stats
+
+    @staticmethod
+    def _set_percentiles(stats, key, latencies):
+        if key in stats:
+            stats[key].p50 = percentile(latencies, 50)
+            stats[key].p95 = percentile(latencies, 95)
+
+    def channel_stats(self, kind='stream', since=None):
+        """{url: HealthStats} over probes since `since` (epoch seconds)"""
+        return self._stats('url', kind, since)
+
+    def host_stats(self, kind='stream', since=None):
+        """{host: HealthStats} over probes since `since` (epoch seconds)"""
+        return self._stats('host', kind, since)
+
+    def channel(self, url, kind='stream', since=None):
+        """HealthStats for one URL, or None if it was never probed"""
+        return self._stats('url', kind, since, 'AND url = ?', (url,)).get(url)
+
+    def host(self, host, kind='stream', since=None):
+        """HealthStats for one host, or None if it was never probed"""
+        return self._stats('host', kind, since, 'AND host = ?', (host,)).get(host)
+
+    def prune(self, older_than):
+        """Delete probe rows older than `older_than` seconds; returns rows removed"""
+        self.flush()
+        with self.db:
+            cursor = self.db.execute('DELETE FROM probes WHERE checked_at < ?', (time.time() - older_than,))
+        return cursor.rowcount
+
+
+def _ms(value):
+    return f"{value * 1000:.0f}ms" if value is not None else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report channel health history')
+    parser.add_argument('--db', default=DEFAULT_DB,
+                       help='Health history database (default: .health.sqlite)')
+    parser.add_argument('--kind', default='stream',
+                       help='Probe kind to report: stream, deep or logo')
+    parser.add_argument('--hours', type=float, default=24 * 7,
+                       help='Only consider probes from the last N hours')
+    parser.add_argument('--hosts', action='store_true',
+                       help='Aggregate per host instead of per channel')
+    parser.add_argument('--prune-days', type=float,
+                       help='Delete probes older than N days before reporting')
+    args = parser.parse_args()
+
+    with HealthStore(args.db) as store:
+        if args.prune_days:
+            print(f"Pruned {store.prune(args.prune_days * 86400)} old probes")
+        since = time.time() - args.hours * 3600
+        stats = store.host_stats(args.kind, since) if args.hosts else store.channel_stats(args.kind, since)
+
+    print(f"{'uptime':>7} {'p50':>7} {'p95':>7} {'probes':>6}  {'last ok':19}  {'host' if args.hosts else 'channel'}")
+    for entry in sorted(stats.values(), key=lambda s: (s.uptime, s.key)):
+        last_ok = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.last_verified)) \
+            if entry.last_verified else 'never'
+        label = entry.key if args.hosts else f"{entry.tvg_id or '-'} {entry.key}"
+        print(f"{entry.uptime:6.1f}% {_ms(entry.p50):>7} {_ms(entry.p95):>7} {entry.probes:6}  {last_ok:19}  {label}")
+
+
+if __name__ == "__main__":
+    main()
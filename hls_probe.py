@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Deep HLS probe: master playlist -> variant -> first media segment
+
+A HEAD on index.m3u8 only proves the origin answers. This probe walks the
+playlist the way a player does and records what a viewer actually feels:
+manifest latency, time-to-first-byte of the first segment, and effective
+download throughput versus the variant's advertised BANDWIDTH.
+"""
+import time
+from urllib.parse import urljoin
+
+from m3u_parser import parse_attrs
+from stream_checker import StreamChecker
+
+MAX_SEGMENT_BYTES = 4 * 1024 * 1024
+
+
+class HLSMetrics:
+    """Measurements from one deep probe; times in seconds, rates in bits/s"""
+    __slots__ = ('manifest_latency', 'playlist_latency', 'segment_ttfb',
+                 'segment_time', 'segment_bytes', 'throughput', 'bandwidth',
+                 'target_duration', 'segment_count', 'variant_url', 'segment_url')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+    @property
+    def bandwidth_ratio(self):
+        """Measured throughput / advertised BANDWIDTH (>1 means headroom)"""
+        if self.throughput and self.bandwidth:
+            return self.throughput / self.bandwidth
+        return None
+
+    def summary(self):
+        parts = []
+        if self.manifest_latency is not None:
+            parts.append(f"manifest {self.manifest_latency * 1000:.0f}ms")
+        if self.segment_ttfb is not None:
+            parts.append(f"ttfb {self.segment_ttfb * 1000:.0f}ms")
+        if self.throughput:
+            rate = f"{self.throughput / 1e6:.1f} Mbps"
+            if self.bandwidth:
+                rate += f" / {self.bandwidth / 1e6:.1f} adv"
+            parts.append(rate)
+        return ', '.join(parts)
+
+
+def parse_master(text, base_url):
+    """Return [(bandwidth, absolute variant url)] from a master playlist"""
+    variants = []
+    attrs = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            attrs = parse_attrs(line[18:])
+        elif attrs is not None and line and not line.startswith('#'):
+            try:
+                bandwidth = int(attrs.get('BANDWIDTH') or attrs.get('AVERAGE-BANDWIDTH') or 0)
+            except ValueError:
+                bandwidth = 0
+            variants.append((bandwidth, urljoin(base_url, line)))
+            attrs = None
+    return variants
+
+
+def parse_media(text, base_url):
+    """Return (target_duration, [absolute segment urls]) from a media playlist"""
+    target = None
+    segments = []
+    expect_uri = False
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-TARGETDURATION:'):
+            try:
+                target = float(line[22:])
+            except ValueError:
+                pass
+        elif line.startswith('#EXTINF:'):
+            expect_uri = True
+        elif expect_uri and line and not line.startswith('#'):
+            segments.append(urljoin(base_url, line))
+            expect_uri = False
+    return target, segments
+
+
+class HLSProbe(StreamChecker):
+    """
+    StreamChecker whose probe pulls the playlist chain and first segment.
+
+    `variant` picks which rendition to measure: 'lowest' (cheapest, the
+    default) or 'highest' BANDWIDTH. Each CheckResult carries an HLSMetrics
+    in `details`.
+    """
+
+    def __init__(self, variant='lowest', max_segment_bytes=MAX_SEGMENT_BYTES, timeout=15, **kwargs):
+        super().__init__(timeout=timeout, **kwargs)
+        self.variant = variant
+        self.max_segment_bytes = max_segment_bytes
+
+    async def _get_text(self, session, url):
+        start = time.perf_counter()
+        async with session.get(url, allow_redirects=True) as response:
+            body = await response.text(errors='replace')
+            return response.status, str(response.url), body, time.perf_counter() - start
+
+    async def probe(self, session, url):
+        metrics = HLSMetrics()
+
+        status, final_url, body, metrics.manifest_latency = await self._get_text(session, url)
+        if status != 200:
+            return False, status, metrics
+        if not body.lstrip().startswith('#EXTM3U'):
+            return False, 'Not a playlist', metrics
+
+        variants = parse_master(body, final_url)
+        if variants:
+            variants.sort()
+            metrics.bandwidth, metrics.variant_url = variants[-1] if self.variant == 'highest' else variants[0]
+            status, final_url, body, metrics.playlist_latency = await self._get_text(session, metrics.variant_url)
+            if status != 200:
+                return False, f'Variant {status}', metrics
+        else:
+            metrics.variant_url = final_url
+            metrics.playlist_latency = 0.0
+
+        metrics.target_duration, segments = parse_media(body, final_url)
+        metrics.segment_count = len(segments)
+        if not segments:
+            return False, 'Empty playlist', metrics
+
+        metrics.segment_url = segments[0]
+        start = time.perf_counter()
+        async with session.get(metrics.segment_url, allow_redirects=True) as response:
+            if response.status != 200:
+                return False, f'Segment {response.status}', metrics
+            first = await response.content.readany()
+            metrics.segment_ttfb = time.perf_counter() - start
+            received = len(first)
+            while received < self.max_segment_bytes:
+                chunk = await response.content.readany()
+                if not chunk:
+                    break
+                received += len(chunk)
+        metrics.segment_time = time.perf_counter() - start
+        metrics.segment_bytes = received
+        if not received:
+            return False, 'Empty segment', metrics
+        if metrics.segment_time > 0:
+            metrics.throughput = received * 8 / metrics.segment_time
+        return True, 200, metrics
+
+
+def probe_streams(items, on_result=None, **kwargs):
+    """Convenience wrapper: HLSProbe(**kwargs).run(items, on_result)"""
+    return HLSProbe(**kwargs).run(items, on_result)
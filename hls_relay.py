@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Fan-out HLS relay: many viewers, one upstream pull
+
+Manifests and segments are fetched through one shared aiohttp session.
+Concurrent requests for the same URL are coalesced onto a single upstream
+fetch, segments are kept in a byte-bounded LRU, and media playlists are
+cached for half their EXT-X-TARGETDURATION so live edges stay fresh.
+
+Playlist URIs are rewritten to bare relative references ("<b64url>.ts"), so
+a player that fetched /stream/<token>/<b64url>.m3u8 resolves every variant,
+segment and key back through the relay under its own token, and the
+rewritten manifest is identical (and cacheable) for every session.
+
+Requires aiohttp (pip install aiohttp).
+"""
+import re
+import time
+import base64
+import asyncio
+from collections import OrderedDict
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
+
+from stream_checker import USER_AGENT
+
+CACHE_BYTES = 256 * 1024 * 1024
+MAX_OBJECT_BYTES = 32 * 1024 * 1024
+READ_CHUNK = 256 * 1024
+MASTER_TTL = 30         # seconds a master playlist is reused
+VOD_TTL = 300           # playlists with EXT-X-ENDLIST no longer change
+ERROR_TTL = 1           # absorb stampedes on a failing URL without pinning the error
+MANIFEST_TYPES = ('application/vnd.apple.mpegurl', 'application/x-mpegurl', 'audio/mpegurl')
+
+URI_ATTR_RE = re.compile(r'URI="([^"]+)"')
+EXTENSION_RE = re.compile(r'\.[A-Za-z0-9]{1,5}$')
+
+
+def encode_url(url):
+    """URL-safe base64 of a stream URL (no '/' so it stays one path segment)"""
+    if isinstance(url, str):
+        url = url.encode('utf-8')
+    return base64.urlsafe_b64encode(url).rstrip(b'=')
+
+
+def decode_url(encoded):
+    """
+    Inverse of encode_url. A trailing file extension ("....ts") is ignored,
+    and standard base64 (as server.js produced) is accepted too.
+    """
+    encoded = encoded.split('.', 1)[0].replace('+', '-').replace('/', '_')
+    encoded += '=' * (-len(encoded) % 4)
+    return base64.urlsafe_b64decode(encoded).decode('utf-8')
+
+
+def relay_ref(url):
+    """Relative reference that resolves to the relay path for `url`"""
+    match = EXTENSION_RE.search(urlparse(url).path)
+    return encode_url(url).decode('ascii') + (match.group() if match else '')
+
+
+def is_manifest(url, content_type, body):
+    return (content_type in MANIFEST_TYPES or urlparse(url).path.endswith('.m3u8')
+            or body[:7] == b'#EXTM3U')
+
+
+def playlist_ttl(text):
+    """How long a playlist may be served from cache"""
+    if '#EXT-X-ENDLIST' in text:
+        return VOD_TTL
+    for line in text.splitlines():
+        if line.startswith('#EXT-X-TARGETDURATION:'):
+            try:
+                return max(1.0, float(line[22:]) / 2)
+            except ValueError:
+                break
+    return MASTER_TTL if '#EXT-X-STREAM-INF' in text else 1.0
+
+
+def rewrite_playlist(text, base_url):
+    """
+    Point every URI in a playlist back at the relay.
+
+    Returns (rewritten text, set of upstream hosts referenced).
+    """
+    hosts = set()
+
+    def ref(uri):
+        absolute = urljoin(base_url, uri.strip())
+        hosts.add(urlparse(absolute).hostname)
+        return relay_ref(absolute)
+
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            lines.append(line)
+        elif stripped.startswith('#'):
+            if 'URI="' in stripped:
+                line = URI_ATTR_RE.sub(lambda m: f'URI="{ref(m.group(1))}"', line)
+            lines.append(line)
+        else:
+            lines.append(ref(stripped))
+    return '\n'.join(lines) + '\n', hosts
+
+
+class CachedObject:
+    __slots__ = ('status', 'content_type', 'body', 'expires')
+
+    def __init__(self, status, content_type, body, expires=None):
+        self.status = status
+        self.content_type = content_type
+        self.body = body
+        self.expires = expires      # None = until evicted
+
+    def fresh(self, now):
+        return self.expires is None or now < self.expires
+
+
+class ByteLRU:
+    """LRU cache bounded by the total size of the cached bodies"""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, now=None):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if not item.fresh(time.monotonic() if now is None else now):
+            self.pop(key)
+            return None
+        self._items.move_to_end(key)
+        return item
+
+    def put(self, key, item):
+        if len(item.body) > self.max_bytes:
+            return
+        self.pop(key)
+        self._items[key] = item
+        self.size += len(item.body)
+        while self.size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= len(evicted.body)
+
+    def pop(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.size -= len(item.body)
+        return item
+
+
+class RelayStats:
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0
+        self.coalesced = 0
+        self.upstream = 0
+        self.upstream_bytes = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class HLSRelay:
+    """
+    Shared upstream fetcher for every viewer.
+
+    get(url) returns a CachedObject. Manifests come back already rewritten.
+    Only hosts from the served playlist (allow_hosts) or referenced by a
+    manifest the relay rewrote can be fetched, so a session token is not an
+    open proxy.
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES, max_object_bytes=MAX_OBJECT_BYTES,
+                 timeout=15, per_host=16):
+        self.cache = ByteLRU(max_bytes)
+        self.max_object_bytes = max_object_bytes
+        self.timeout = timeout
+        self.per_host = per_host
+        self.stats = RelayStats()
+        self.allowed_hosts = set()
+        self._inflight = {}
+        self._session = None
+
+    def allow_hosts(self, hosts):
+        self.allowed_hosts.update(h for h in hosts if h)
+
+    def allowed(self, url):
+        parsed = urlparse(url)
+        return parsed.scheme in ('http', 'https') and parsed.hostname in self.allowed_hosts
+
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self.per_host, ttl_dns_cache=300),
+                headers={'User-Agent': USER_AGENT},
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def get(self, url):
+        self.stats.requests += 1
+        item = self.cache.get(url)
+        if item is not None:
+            self.stats.hits += 1
+            return item
+
+        task = self._inflight.get(url)
+        if task is None:
+            # The fetch runs as its own task so a viewer disconnecting does
+            # not cancel it for everyone else waiting on the same URL
+            task = self._inflight[url] = asyncio.ensure_future(self._fetch(url))
+            task.add_done_callback(lambda t: self._done(url, t))
+        else:
+            self.stats.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, url, task):
+        self._inflight.pop(url, None)
+        if not task.cancelled():
+            task.exception()    # mark retrieved; waiters get it via await
+
+    async def _fetch(self, url):
+        self.stats.upstream += 1
+        now = time.monotonic()
+        async with self.session().get(url, allow_redirects=True) as response:
+            content_type = response.content_type
+            if response.status != 200:
+                item = CachedObject(response.status, content_type, b'', now + ERROR_TTL)
+                self.cache.put(url, item)
+                return item
+            too_large = CachedObject(502, 'text/plain', b'Object too large to relay', now + ERROR_TTL)
+            if (response.content_length or 0) > self.max_object_bytes:
+                return too_large
+            # Chunked or unsized bodies (a raw TS live stream never ends)
+            # are read only until they pass the limit
+            chunks = []
+            size = 0
+            async for chunk in response.content.iter_chunked(READ_CHUNK):
+                size += len(chunk)
+                if size > self.max_object_bytes:
+                    return too_large
+                chunks.append(chunk)
+            body = b''.join(chunks)
+            final_url = str(response.url)
+        self.stats.upstream_bytes += len(body)
+
+        if is_manifest(url, content_type, body):
+            text = body.decode('utf-8', 'replace')
+            rewritten, hosts = rewrite_playlist(text, final_url)
+            self.allow_hosts(hosts)
+            item = CachedObject(200, 'application/vnd.apple.mpegurl', rewritten.encode('utf-8'),
+                                now + playlist_ttl(text))
+        else:
+            # Segments, keys and init sections never change: keep until evicted
+            item = CachedObject(200, content_type, body)
+        if len(item.body) <= self.max_object_bytes:
+            self.cache.put(url, item)
+        return item
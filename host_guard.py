@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Per-host circuit breakers and rate limits for probes
+
+When an origin goes down, every channel on it would otherwise wait out its
+own timeout. A CircuitBreaker per host opens after `failure_threshold`
+consecutive connection failures; while open, probes for that host are
+answered with HOST_DOWN at once. After `reset_timeout` seconds one trial
+probe is let through (half-open): success closes the circuit, failure opens
+it again for twice as long, up to `max_reset_timeout`.
+
+Only timeouts and connection errors count against a host. Any HTTP
+response, even a 404, shows the host is reachable.
+
+A TokenBucket per host spaces requests out so a sweep does not get the
+checker throttled.
+"""
+import time
+import asyncio
+import threading
+from urllib.parse import urlparse
+
+HOST_DOWN = 'host down'
+HOST_FAILURES = ('Timeout', 'Connection Error')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now=None):
+        """Consume one token if available; returns True on success"""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def reserve(self, now=None):
+        """
+        Consume one token, going into debt if none is available. Returns the
+        seconds the caller should wait before using it.
+        """
+        self._refill(time.monotonic() if now is None else now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait_time(self):
+        """Seconds until the next token is available"""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open trial -> closed"""
+
+    def __init__(self, failure_threshold=3, reset_timeout=30, max_reset_timeout=600):
+        self.failure_threshold = failure_threshold
+        self.base_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False      # a half-open trial probe is in flight
+
+    def allow(self, now=None):
+        """True if a probe may go out now"""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic() if now is None else now
+        if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def record(self, reachable, now=None):
+        """
+        Feed back a probe outcome: True (host answered), False (timeout or
+        connection error) or None (inconclusive; only frees a trial slot).
+        """
+        self.trial = False
+        if reachable is None:
+            return
+        if reachable:
+            self.state = CLOSED
+            self.failures = 0
+            self.reset_timeout = self.base_timeout
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN:
+            # The trial failed: stay away for longer
+            self.reset_timeout = min(self.max_reset_timeout, self.reset_timeout * 2)
+            self._open(now)
+        elif self.state == CLOSED and self.failures >= self.failure_threshold:
+            self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = time.monotonic() if now is None else now
+
+
+def reachable(status):
+    """Map a probe status to what it says about the host (see CircuitBreaker.record)"""
+    if isinstance(status, int):
+        return True
+    if status in HOST_FAILURES:
+        return False
+    return None
+
+
+class HostGuard:
+    """
+    One CircuitBreaker and (if `rate` is set) one TokenBucket per host.
+
+    Safe to share between threads; the async helpers are for a single event
+    loop (StreamChecker).
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30, rate=None, burst=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.rate = rate
+        self.burst = burst
+        self.breakers = {}
+        self.buckets = {}
+        self.short_circuited = 0
+        self._lock = threading.Lock()
+
+    def breaker(self, host):
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def allow(self, host):
+        with self._lock:
+            if self.breaker(host).allow():
+                return True
+            self.short_circuited += 1
+            return False
+
+    def delay(self, host):
+        """Reserve a request slot for `host`; returns seconds to wait first"""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return bucket.reserve()
+
+    def throttle(self, host):
+        wait = self.delay(host)
+        if wait:
+            time.sleep(wait)
+
+    async def throttle_async(self, host):
+        wait = self.delay(host)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def record(self, host, status):
+        with self._lock:
+            self.breaker(host).record(reachable(status))
+
+    def down_hosts(self):
+        """Hosts whose circuit is currently open"""
+        return sorted(host for host, b in self.breakers.items() if b.state != CLOSED)
+
+    def guarded(self, check):
+        """
+        Wrap a blocking check(url) -> (ok, status) such as
+        test_channels.test_channel_stream.
+        """
+        def guarded_check(url, *args, **kwargs):
+            host = urlparse(url).netloc
+            if not self.allow(host):
+                return False, HOST_DOWN
+            self.throttle(host)
+            try:
+                ok, status = check(url, *args, **kwargs)
+            except BaseException:
+                self.record(host, None)
+                raise
+            self.record(host, status)
+            return ok, status
+        return guarded_check
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Streaming M3U playlist parser shared by the checker, merge and EPG scripts
+"""
+import re
+
+# One precompiled pass over an #EXTINF line picks up every key=value attribute
+# (quoted like group-title="News" or bare like group-title=News) and, via the
+# last alternative, the channel title after the separating comma. Commas inside
+# quoted values are consumed by the first alternative, so they never split.
+# A bare value runs on to the next key= or the title comma, so
+# group-title=Kids & Family is kept whole (as normalize_playlist.py does).
+EXTINF_RE = re.compile(r'([\w-]+)=(?:"([^"]*)"|((?:(?![ \t]+[\w-]+=)[^,"])*))|,(.*)')
+
+
+class Channel:
+    """A single playlist entry: the #EXTINF metadata plus its stream URL"""
+    __slots__ = ('name', 'url', 'tvg_id', 'tvg_name', 'logo', 'group',
+                 'duration', 'extinf', 'line_num')
+
+    def __init__(self, name, url, tvg_id=None, tvg_name=None, logo=None,
+                 group=None, duration=-1, extinf=None, line_num=None):
+        self.name = name
+        self.url = url
+        self.tvg_id = tvg_id
+        self.tvg_name = tvg_name
+        self.logo = logo
+        self.group = group
+        self.duration = duration
+        self.extinf = extinf
+        self.line_num = line_num
+
+    def __repr__(self):
+        return f'Channel({self.name!r}, {self.url!r}, tvg_id={self.tvg_id!r})'
+
+
+def parse_attrs(text):
+    """Return the key=value attributes found in an #EXTM3U/#EXTINF line"""
+    return {key: quoted or bare.strip()
+            for key, quoted, bare, _ in EXTINF_RE.findall(text) if key}
+
+
+def _duration(line):
+    text = line[8:].partition(',')[0].partition(' ')[0]
+    if text == '-1':
+        return -1
+    try:
+        return float(text) if '.' in text else int(text)
+    except ValueError:
+        return -1
+
+
+def parse_extinf(line, url=None, line_num=None):
+    """Build a Channel from an #EXTINF line (and the URL that follows it)"""
+    line = line.rstrip('\r\n')
+    attrs = {}
+    name = ''
+    for key, quoted, bare, title in EXTINF_RE.findall(line, 8):
+        if key:
+            attrs[key] = quoted or bare.strip()
+        else:
+            name = title
+            break
+
+    get = attrs.get
+    return Channel(
+        name.strip() or 'Unknown',
+        url,
+        get('tvg-id') or None,
+        get('tvg-name') or None,
+        get('tvg-logo') or None,
+        get('group-title') or None,
+        _duration(line),
+        line,
+        line_num,
+    )
+
+
+def _open_lines(source):
+    """Return (iterable of lines, needs_close) for a path, file or line iterable"""
+    if isinstance(source, str) or hasattr(source, '__fspath__'):
+        return open(source, 'r', encoding='utf-8', errors='replace'), True
+    return source, False
+
+
+def iter_entries(source):
+    """
+    Lazily yield raw (extinf_line, url, line_num) tuples from a playlist.
+
+    `source` may be a filename, a text or binary file object, or any iterable
+    of lines. Only entries whose #EXTINF is followed by an http(s) URL are
+    yielded; directive lines (#EXTVLCOPT, #EXTGRP, ...) in between are skipped.
+    Callers that can reject an entry by URL alone should use this and call
+    parse_extinf() only on the entries they keep.
+    """
+    lines, needs_close = _open_lines(source)
+    try:
+        pending = None
+        pending_num = None
+        for line_num, line in enumerate(lines):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', 'replace')
+            if line.startswith('#EXTINF'):
+                pending, pending_num = line, line_num
+            elif pending is None or line.startswith('#'):
+                continue
+            elif line.startswith('http'):
+                yield pending, line.strip(), pending_num
+                pending = None
+            elif line.strip():
+                pending = None
+    finally:
+        if needs_close:
+            lines.close()
+
+
+def iter_channels(source):
+    """Lazily yield Channel records from a playlist (see iter_entries)"""
+    for extinf, url, line_num in iter_entries(source):
+        yield parse_extinf(extinf, url, line_num)
+
+
+def read_header(source):
+    """Return the attributes of the #EXTM3U header line (e.g. url-tvg)"""
+    lines, needs_close = _open_lines(source)
+    try:
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', 'replace')
+            if line.startswith('#EXTM3U'):
+                return parse_attrs(line)
+            if line.strip():
+                break
+        return {}
+    finally:
+        if needs_close:
+            lines.close()
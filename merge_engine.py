@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Config-driven N-way playlist merge
+
+The rules file (JSON) declares the sources in precedence order, domain
+include/exclude lists, per-channel mappings, category keywords and the
+conflict policy. Everything is compiled into hash indexes up front, so each
+entry costs a handful of dict/set lookups no matter how many rules there are.
+"""
+import re
+import json
+from urllib.parse import urlparse
+
+from build_cache import digest_bytes, file_digest, write_if_changed
+from m3u_parser import iter_entries, parse_extinf
+from metrics import timed
+
+WORD_RE = re.compile(r'[A-Za-z0-9]+')
+
+
+def host_of(url):
+    """Hostname of a URL without port, lowercased"""
+    return (urlparse(url).hostname or '').lower()
+
+
+def stream_key(url):
+    """The path segment that names a stream, e.g. USA_HBO in .../USA_HBO/index.m3u8"""
+    parts = url.rstrip('/').split('/')
+    if url.endswith('.m3u8') and len(parts) > 1:
+        return parts[-2]
+    return parts[-1]
+
+
+class DomainSet:
+    """Set of domains matched against a host and each of its parent domains"""
+
+    def __init__(self, domains=()):
+        self.domains = {d.lower().strip('.') for d in domains}
+
+    def __bool__(self):
+        return bool(self.domains)
+
+    def matches(self, host):
+        if not self.domains:
+            return False
+        if host in self.domains:
+            return True
+        dot = host.find('.')
+        while dot != -1:
+            if host[dot + 1:] in self.domains:
+                return True
+            dot = host.find('.', dot + 1)
+        return False
+
+
+class Source:
+    """One input playlist and its per-source filters"""
+
+    def __init__(self, path, include_domains=(), exclude_domains=(),
+                 mapped_only_domains=(), apply_mappings=False):
+        self.path = path
+        self.include = DomainSet(include_domains)
+        self.exclude = DomainSet(exclude_domains)
+        self.mapped_only = DomainSet(mapped_only_domains)
+        self.apply_mappings = apply_mappings
+
+    @classmethod
+    def from_config(cls, config):
+        if isinstance(config, str):
+            return cls(config)
+        return cls(
+            config['path'],
+            config.get('include_domains', ()),
+            config.get('exclude_domains', ()),
+            config.get('mapped_only_domains', ()),
+            config.get('apply_mappings', False),
+        )
+
+
+class MergeRules:
+    """Compiled form of a rules file"""
+
+    def __init__(self, config):
+        self.digest = digest_bytes(json.dumps(config, sort_keys=True))
+        self.header = config.get('header', '#EXTM3U')
+        self.categories = list(config.get('categories', []))
+        self.default_category = config.get('default_category', 'Specialty & Others')
+        if self.default_category not in self.categories:
+            self.categories.append(self.default_category)
+        self.known_categories = set(self.categories)
+        self.on_conflict = config.get('on_conflict', 'first')
+        if self.on_conflict not in ('first', 'last'):
+            raise ValueError(f"on_conflict must be 'first' or 'last', not {self.on_conflict!r}")
+        self.exclude = DomainSet(config.get('exclude_domains', ()))
+        self.sources = [Source.from_config(s) for s in config.get('sources', [])]
+        self.mappings = dict(config.get('mappings', {}))
+        # {"window_hours": N} groups mirrors into failover sets (see failover.py)
+        self.failover = config.get('failover')
+
+        # keyword -> (category rank, category); first listed category wins ties.
+        # Multi-word keywords ("WE TV") are indexed as joined word n-grams.
+        self.keywords = {}
+        self.max_keyword_words = 1
+        for rank, (category, words) in enumerate(config.get('keywords', {}).items()):
+            for word in words:
+                tokens = WORD_RE.findall(word.upper())
+                self.max_keyword_words = max(self.max_keyword_words, len(tokens))
+                self.keywords.setdefault(' '.join(tokens), (rank, category))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def mapping_for(self, channel):
+        return self.mappings.get(stream_key(channel.url)) or (
+            channel.tvg_id and self.mappings.get(channel.tvg_id))
+
+    def keyword_category(self, *texts):
+        """Category of the best keyword found in any of `texts`, or None"""
+        best = None
+        for text in texts:
+            if not text:
+                continue
+            tokens = WORD_RE.findall(text.upper())
+            for n in range(1, self.max_keyword_words + 1):
+                for i in range(len(tokens) - n + 1):
+                    hit = self.keywords.get(' '.join(tokens[i:i + n]))
+                    if hit and (best is None or hit[0] < best[0]):
+                        best = hit
+        return best[1] if best else None
+
+    def categorize(self, channel, mapping=None):
+        if mapping and mapping.get('group') in self.known_categories:
+            return mapping['group']
+        if channel.group in self.known_categories:
+            return channel.group
+        return self.keyword_category(stream_key(channel.url), channel.name) or self.default_category
+
+
+def format_extinf(tvg_id, logo, group, name):
+    return f'#EXTINF:-1 tvg-id="{tvg_id}" tvg-logo="{logo}" group-title="{group}",{name}'
+
+
+def collect(rules, source):
+    """
+    Filter, map and categorize one source on its own.
+
+    Returns (entries, seen) where entries is a list of [url, category, info]
+    deduplicated within the source. The result depends only on the rules and
+    the source file, so it can be cached against their hashes.
+    """
+    keep_last = rules.on_conflict == 'last'
+    entries = {}
+    seen = 0
+    for extinf, url, line_num in iter_entries(source.path):
+        seen += 1
+        # Reject on URL alone before paying for attribute parsing
+        if url in entries and not keep_last:
+            continue
+        host = host_of(url)
+        if rules.exclude.matches(host) or source.exclude.matches(host):
+            continue
+        if source.include and not source.include.matches(host):
+            continue
+        ch = parse_extinf(extinf, url, line_num)
+        mapping = rules.mapping_for(ch) if source.apply_mappings else None
+        if not mapping and source.mapped_only.matches(host):
+            continue
+        category = rules.categorize(ch, mapping)
+        if mapping:
+            info = format_extinf(mapping['tvg_id'], mapping['logo'], category, mapping['name'])
+        else:
+            info = ch.extinf.strip()
+        entries[url] = (category, info)
+    return [[url, category, info] for url, (category, info) in entries.items()], seen
+
+
+def merge(rules, extra_sources=(), cache=None):
+    """
+    Merge every source into {category: [(url, info)]}.
+
+    Entries are deduplicated by URL. With on_conflict='first' the source
+    listed earlier keeps the URL; with 'last' later sources override.
+    Within a category entries are ordered by source precedence, then URL.
+
+    `cache` maps source path -> {'digest', 'seen', 'entries'} from a previous
+    run with the same rules; sources whose content hash is unchanged are not
+    re-read. Returns (categories, stats, new_cache).
+    """
+    sources = rules.sources + [Source(path) for path in extra_sources]
+    cache = cache or {}
+    new_cache = {}
+    counts = []     # (seen, reused) per source
+    chosen = {}     # url -> (source rank, category, info)
+    for rank, source in enumerate(sources):
+        digest = file_digest(source.path)
+        previous = cache.get(source.path)
+        reused = bool(previous) and previous['digest'] == digest
+        if reused:
+            entries, seen = previous['entries'], previous['seen']
+        else:
+            entries, seen = collect(rules, source)
+        new_cache[source.path] = {'digest': digest, 'seen': seen, 'entries': entries}
+        counts.append((seen, reused))
+        for url, category, info in entries:
+            if url in chosen and rules.on_conflict == 'first':
+                continue
+            chosen[url] = (rank, category, info)
+
+    kept = [0] * len(sources)
+    categories = {name: [] for name in rules.categories}
+    for url, (rank, category, info) in sorted(chosen.items(), key=lambda item: (item[1][0], item[0])):
+        categories[category].append((url, info))
+        kept[rank] += 1
+
+    stats = [(source.path, seen, kept[rank], reused)
+             for rank, (source, (seen, reused)) in enumerate(zip(sources, counts))]
+    return categories, stats, new_cache
+
+
+def render_fragments(categories):
+    """Render each non-empty category block separately, in category order"""
+    fragments = {}
+    for category, channels in categories.items():
+        if channels:
+            lines = [f'# === {category} ===']
+            for url, info in channels:
+                lines.append(info)
+                lines.append(url)
+            fragments[category] = '\n'.join(lines) + '\n'
+    return fragments
+
+
+def render(rules, categories):
+    """Serialize merged categories to playlist text"""
+    fragments = render_fragments(categories)
+    if not fragments:
+        return rules.header + '\n'
+    return rules.header + '\n\n' + '\n'.join(fragments.values())
+
+
+def build(rules, output, state, extra_sources=(), force=False, failover=None):
+    """
+    Incrementally rebuild `output` from the rules' sources.
+
+    `failover(categories) -> (categories, sets)`, if given, collapses
+    mirrors after the merge (failover.group_failover); the sets are returned
+    as result['failover_sets'].
+
+    `state` (a build_cache.BuildState) remembers the rules hash, each source's
+    content hash and filtered entries, each category fragment's hash and the
+    output's hash. Returns a dict describing what happened:
+    'status' is 'up-to-date' (nothing read or written), 'unchanged' (rebuilt
+    but byte-identical, so not written) or 'written'.
+    """
+    paths = [s.path for s in rules.sources] + list(extra_sources)
+    inputs = {path: file_digest(path) for path in paths}
+    if (not force and state.get('rules') == rules.digest and state.get('inputs') == inputs
+            and state.get('output') and state.get('output') == file_digest(output)):
+        return {'status': 'up-to-date', 'stats': [], 'changed_categories': [], 'total': state.get('total', 0)}
+
+    cache = state.get('sources', {}) if state.get('rules') == rules.digest and not force else {}
+    with timed('merge_collect'):
+        categories, stats, new_cache = merge(rules, extra_sources, cache)
+    sets = None
+    if failover is not None:
+        with timed('merge_failover'):
+            categories, sets = failover(categories)
+
+    with timed('merge_render'):
+        fragments = render_fragments(categories)
+        fragment_digests = {category: digest_bytes(text) for category, text in fragments.items()}
+        previous = state.get('fragments', {})
+        changed = [c for c in set(fragment_digests) | set(previous)
+                   if fragment_digests.get(c) != previous.get(c)]
+        changed.sort(key=lambda c: rules.categories.index(c) if c in rules.categories else len(rules.categories))
+        text = render(rules, categories)
+
+    with timed('merge_write'):
+        written = write_if_changed(output, text)
+    total = sum(len(ch) for ch in categories.values())
+
+    state['rules'] = rules.digest
+    state['inputs'] = inputs
+    state['sources'] = new_cache
+    state['fragments'] = fragment_digests
+    state['output'] = digest_bytes(text)
+    state['total'] = total
+    state.save()
+
+    return {
+        'status': 'written' if written else 'unchanged',
+        'stats': stats,
+        'changed_categories': changed,
+        'total': total,
+        'failover_sets': sets,
+    }
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Prometheus/OpenMetrics instrumentation for checkers and builders
+
+A small stdlib-only registry of labelled counters, gauges and histograms
+rendered in the Prometheus text exposition format. Long-running tools serve
+it on a local /metrics endpoint (serve()); batch tools write it for the
+node_exporter textfile collector (write_textfile()) when they finish.
+
+Probe results are fed in with observe_probe()/recorder(), the same callback
+shape as HealthStore.recorder, and build stages are timed with timed().
+"""
+import re
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from build_cache import atomic_write
+from host_guard import HOST_DOWN
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PROBE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+NAMED_STATUSES = ('Timeout', 'Connection Error', HOST_DOWN)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            for key in sorted(self._values):
+                lines.extend(self._samples(key, self._values[key]))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels))
+
+    def _samples(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=PROBE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts, sum, count]
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _samples(self, key, state):
+        counts, total, n = state
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {n}')
+        return lines
+
+
+class Registry:
+    """A named set of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            # Re-registering the same metric (e.g. a module reloaded) returns the original
+            if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                raise ValueError(f'metric {metric.name} already registered differently')
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=PROBE_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """The registry in the Prometheus text format"""
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+PROBES = REGISTRY.counter(
+    'iptv_probes_total', 'Stream and logo probes by outcome', ('kind', 'host', 'status', 'ok'))
+PROBE_SECONDS = REGISTRY.histogram(
+    'iptv_probe_duration_seconds', 'Probe latency', ('kind', 'host'))
+STAGE_SECONDS = REGISTRY.histogram(
+    'iptv_stage_duration_seconds', 'Duration of EPG and merge stages', ('stage',), STAGE_BUCKETS)
+STAGE_LAST_SUCCESS = REGISTRY.gauge(
+    'iptv_stage_last_success_timestamp_seconds', 'When each stage last completed', ('stage',))
+STAGE_FAILURES = REGISTRY.counter(
+    'iptv_stage_failures_total', 'Stages that raised', ('stage',))
+MONITOR_CHANNELS = REGISTRY.gauge(
+    'iptv_monitor_channels', 'Monitored channels by condition', ('condition',))
+
+_HTTP_STATUS_RE = re.compile(r'^\d{3}$')
+
+
+def status_label(status):
+    """Collapse a probe status to a bounded label: HTTP code, a named failure or 'error'"""
+    status = str(status)
+    if _HTTP_STATUS_RE.match(status) or status in NAMED_STATUSES:
+        return status
+    return 'error'
+
+
+def observe_probe(result, kind='stream'):
+    """Count one CheckResult and record its latency"""
+    host = result.host or 'unknown'
+    PROBES.inc(kind=kind, host=host, status=status_label(result.status), ok=str(bool(result.ok)).lower())
+    if result.latency is not None:
+        PROBE_SECONDS.observe(result.latency, kind=kind, host=host)
+
+
+def recorder(kind='stream', on_result=None):
+    """Return an on_result callback that records metrics, then forwards to `on_result`"""
+    def callback(result):
+        observe_probe(result, kind)
+        if on_result:
+            on_result(result)
+    return callback
+
+
+@contextmanager
+def timed(stage):
+    """Time a block as `stage`; failures are counted instead of timed"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+    STAGE_LAST_SUCCESS.set(time.time(), stage=stage)
+
+
+def write_textfile(path, registry=REGISTRY):
+    """
+    Write the registry for the node_exporter textfile collector.
+
+    The file is replaced atomically (the temp file starts with '.', which the
+    collector ignores), so a scrape never sees a half-written file.
+    """
+    atomic_write(path, registry.render())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1', registry=REGISTRY):
+    """Serve /metrics from a daemon thread; returns the server (call shutdown() to stop)"""
+    handler = type('MetricsHandler', (_Handler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
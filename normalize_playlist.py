@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Normalize and validate raw provider playlists of any size
+
+The input is memory-mapped and read as bytes in blocks cut at #EXTINF
+boundaries; nothing is decoded except the lines that get reported. Blocks
+that are already clean (the bulk of a provider list) are verified with
+whole-block byte operations and copied through, the rest is fixed line by
+line. In one pass it:
+
+  - quotes bare attribute values (group-title=News -> group-title="News")
+  - drops #EXTINF lines without a stream URL, URLs without an #EXTINF and
+    entries whose URL is not http(s)
+  - drops repeated stream URLs (remembered as 64-bit hashes, not strings)
+  - reports every problem with its line number
+
+Output is streamed to a temp file and swapped in, so memory stays flat no
+matter how big the playlist is.
+
+    python normalize_playlist.py provider.m3u --output provider_clean.m3u
+    python normalize_playlist.py provider.m3u --check     # report only
+"""
+import re
+import mmap
+import time
+import argparse
+
+from build_cache import atomic_open
+
+# m3u_parser.EXTINF_RE over bytes: a bare value runs on to the next key= or
+# the title comma, so group-title=Kids & Family is kept whole
+EXTINF_RE = re.compile(rb'([\w-]+)=(?:"([^"]*)"|((?:(?![ \t]+[\w-]+=)[^,"])*))|,(.*)')
+HEADER = b'#EXTM3U'
+EXTINF = b'#EXTINF'
+HTTP = (b'http://', b'https://')
+NOT_QUOTE_OR_NEWLINE = bytes(c for c in range(256) if c not in b'"\n')
+NOT_COMMA_OR_NEWLINE = bytes(c for c in range(256) if c not in b',\n')
+BOM = b'\xef\xbb\xbf'
+MAX_PROBLEMS = 1000
+BLOCK_SIZE = 4 << 20        # input is handled in blocks ending just before an #EXTINF
+RELEASE_EVERY = 64 << 20    # drop already-processed pages of the mapping this often
+
+BARE_ATTRIBUTE = 'bare attribute'
+UNBALANCED_QUOTE = 'unbalanced quote'
+MISSING_TITLE = 'missing title'
+ORPHAN_EXTINF = 'orphan #EXTINF'
+NON_HTTP_URL = 'non-http URL'
+STRAY_URL = 'URL without #EXTINF'
+DUPLICATE_URL = 'duplicate URL'
+MISSING_HEADER = 'missing #EXTM3U'
+# Fixed in place / kept but worth a look; everything else removes the line or entry
+REPAIRS = (BARE_ATTRIBUTE, MISSING_HEADER)
+WARNINGS = (UNBALANCED_QUOTE, MISSING_TITLE)
+
+
+class Problem:
+    __slots__ = ('line_num', 'kind', 'text')
+
+    def __init__(self, line_num, kind, text):
+        self.line_num = line_num
+        self.kind = kind
+        self.text = text
+
+    def __str__(self):
+        return f'{self.line_num + 1}: {self.kind}: {self.text}'
+
+
+def quote_attributes(line):
+    """
+    Return (line with every attribute value quoted, number of values that
+    were bare, has title). Lines that need no change come back as they are.
+    """
+    if line.count(b'=') == line.count(b'="'):
+        return line, 0, b',' in line     # everything quoted: the common case, no regex
+    attrs = []
+    title = None
+    bare = 0
+    first = None
+    for m in EXTINF_RE.finditer(line, 8):
+        key, quoted, value, text = m.groups()
+        if key is None:
+            title = text
+            break
+        if first is None:
+            first = m.start()
+        if quoted is None:
+            bare += 1
+            attrs.append(b'%s="%s"' % (key, value.strip()))
+        else:
+            attrs.append(m.group(0))
+    if not bare:
+        return line, 0, title is not None
+    prefix = line[:first].rstrip()
+    return b'%s %s,%s' % (prefix, b' '.join(attrs), title or b''), bare, title is not None
+
+
+class Normalizer:
+    """
+    One pass over a playlist. `on_problem(Problem)` sees every problem;
+    `problems` keeps the first `max_problems` of them and `counts` tallies
+    all of them by kind.
+    """
+
+    def __init__(self, on_problem=None, max_problems=MAX_PROBLEMS):
+        self.on_problem = on_problem
+        self.max_problems = max_problems
+        self.problems = []
+        self.counts = {}
+        self.lines = 0
+        self.entries = 0
+        self.bytes = 0
+        self.fast_blocks = 0
+        self._seen = set()      # hash() of every URL written so far
+        self._started = False
+
+    def problem(self, line_num, kind, raw):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if self.on_problem is None and len(self.problems) >= self.max_problems:
+            return
+        problem = Problem(line_num, kind, raw[:120].decode('utf-8', 'replace'))
+        if len(self.problems) < self.max_problems:
+            self.problems.append(problem)
+        if self.on_problem:
+            self.on_problem(problem)
+
+    def _clean_block(self, block, rows):
+        """
+        True (and the URLs remembered) if `block` is nothing but #EXTINF/URL
+        pairs the per-line pass would copy unchanged: quoted attributes, a
+        title, balanced quotes, a bare http(s) URL not seen before. Each test
+        is a count/translate over a whole column of lines, not a Python loop.
+        """
+        if len(rows) % 2 == 0 or rows[-1] or b'\r' in block:
+            return False
+        urls = rows[1::2]
+        n = len(urls)
+        text = b'\n'.join(rows[0:-1:2])
+        links = b'\n'.join(urls)
+        if not (text.startswith(EXTINF) and text.count(b'\n#EXTINF') == n - 1
+                and links.startswith(HTTP)
+                and links.count(b'\nhttp://') + links.count(b'\nhttps://') == n - 1
+                and not any(c in links for c in (b' ', b'\t', b'\x0b', b'\x0c'))
+                and text.count(b'=') == text.count(b'="')):
+            return False
+        # Per-line quote parity and title comma: keep just those characters
+        # and the newlines, then look for a line left with an odd quote / none
+        quotes = text.translate(None, NOT_QUOTE_OR_NEWLINE).replace(b'""', b'')
+        commas = b'\n' + text.translate(None, NOT_COMMA_OR_NEWLINE) + b'\n'
+        if b'"' in quotes or b'\n\n' in commas:
+            return False
+        hashes = set(map(hash, urls))
+        if len(hashes) != n or not self._seen.isdisjoint(hashes):
+            return False
+        self._seen |= hashes
+        self.entries += n
+        return True
+
+    def _block(self, rows, first_line, write):
+        """Line-by-line pass over one block's lines, writing the kept ones"""
+        seen = self._seen
+        pending = None          # [extinf line, directives...] of the current entry
+        pending_num = 0
+        for line_num, line in enumerate(rows, first_line):
+            line = line.rstrip(b'\r')
+            if not self._started:
+                if line.startswith(BOM):
+                    line = line[len(BOM):]
+                if not line.strip():
+                    continue
+                self._started = True
+                if line.startswith(HEADER):
+                    write(line + b'\n')
+                    continue
+                self.problem(line_num, MISSING_HEADER, line)
+                write(HEADER + b'\n')
+
+            if line.startswith(EXTINF):
+                if pending is not None:
+                    self.problem(pending_num, ORPHAN_EXTINF, pending[0])
+                if line.count(b'"') % 2:
+                    # Cannot tell where the value was meant to end: leave it alone
+                    self.problem(line_num, UNBALANCED_QUOTE, line)
+                    fixed = line
+                else:
+                    fixed, bare, titled = quote_attributes(line)
+                    if bare:
+                        self.problem(line_num, BARE_ATTRIBUTE, line)
+                    if not titled:
+                        self.problem(line_num, MISSING_TITLE, line)
+                pending = [fixed]
+                pending_num = line_num
+                continue
+            if line.startswith(b'#'):
+                if pending is not None:
+                    pending.append(line)    # #EXTVLCOPT, #EXTGRP, ... belong to the entry
+                elif not line.startswith(HEADER):
+                    write(line + b'\n')
+                continue
+            url = line.strip()
+            if not url:
+                continue
+            if pending is None:
+                self.problem(line_num, STRAY_URL if url.startswith(b'http') else NON_HTTP_URL, line)
+                continue
+            if not url.startswith(HTTP):
+                self.problem(line_num, NON_HTTP_URL, line)
+            else:
+                key = hash(url)
+                if key in seen:
+                    self.problem(line_num, DUPLICATE_URL, line)
+                else:
+                    seen.add(key)
+                    pending.append(url)
+                    write(b'\n'.join(pending) + b'\n')
+                    self.entries += 1
+            pending = None
+
+        # Blocks end just before an #EXTINF, so an open entry has no URL
+        if pending is not None:
+            self.problem(pending_num, ORPHAN_EXTINF, pending[0])
+
+    def run(self, data, write):
+        """
+        Normalize the mmap (or bytes) `data`, passing output bytes to `write`.
+        Returns the number of entries kept.
+        """
+        release = hasattr(data, 'madvise') and hasattr(mmap, 'MADV_DONTNEED')
+        released = 0
+        size = len(data)
+        pos = 0
+        while pos < size:
+            end = data.find(b'\n#EXTINF', pos + BLOCK_SIZE)
+            end = size if end < 0 else end + 1
+            block = data[pos:end]
+            rows = block.split(b'\n')
+            if self._started and self._clean_block(block, rows):
+                write(block)
+                self.fast_blocks += 1
+            else:
+                self._block(rows, self.lines, write)
+            self.lines += len(rows) - (not rows[-1])
+            pos = end
+            # Hand pages already read back to the OS so the resident size stays flat
+            if release and pos - released >= RELEASE_EVERY:
+                upto = pos // mmap.PAGESIZE * mmap.PAGESIZE
+                data.madvise(mmap.MADV_DONTNEED, released, upto - released)
+                released = upto
+        if not self._started:
+            write(HEADER + b'\n')
+        return self.entries
+
+    def normalize(self, path, output=None):
+        """
+        Normalize the file at `path` into `output` (validate only if None).
+        Returns the number of entries kept.
+        """
+        with open(path, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:      # empty file
+                data = b''
+            try:
+                self.bytes = len(data)
+                if hasattr(data, 'madvise'):
+                    data.madvise(mmap.MADV_SEQUENTIAL)
+                if output is None:
+                    return self.run(data, lambda chunk: None)
+                with atomic_open(output) as out:
+                    return self.run(data, out.write)
+            finally:
+                if isinstance(data, mmap.mmap):
+                    data.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fix quoting, drop broken and duplicate entries in an M3U playlist')
+    parser.add_argument('input',
+                       help='Playlist to normalize')
+    parser.add_argument('--output',
+                       help='Normalized playlist (required unless --check)')
+    parser.add_argument('--check', action='store_true',
+                       help='Only validate; exit 1 if anything would be removed')
+    parser.add_argument('--report',
+                       help='Write every problem ("line: kind: text") to this file')
+    parser.add_argument('--show', type=int, default=20,
+                       help='Problems printed per kind')
+    args = parser.parse_args()
+    if not args.check and not args.output:
+        parser.error('--output is required unless --check is given')
+
+    def removed(kind):
+        return kind not in REPAIRS and kind not in WARNINGS
+
+    report = open(args.report, 'w', encoding='utf-8') if args.report else None
+    shown = {}
+
+    def on_problem(problem):
+        if report:
+            report.write(f'{problem}\n')
+        if shown.get(problem.kind, 0) < args.show:
+            shown[problem.kind] = shown.get(problem.kind, 0) + 1
+            print(f"{'✗' if removed(problem.kind) else '~'} line {problem}")
+
+    normalizer = Normalizer(on_problem)
+    start = time.perf_counter()
+    try:
+        kept = normalizer.normalize(args.input, None if args.check else args.output)
+    finally:
+        if report:
+            report.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"\n{normalizer.lines} lines, {kept} entries kept "
+          f"({normalizer.bytes / 1e6:.1f}MB in {elapsed:.2f}s)")
+    for kind, count in sorted(normalizer.counts.items(), key=lambda item: -item[1]):
+        label = 'removed' if removed(kind) else 'fixed' if kind in REPAIRS else 'kept'
+        print(f"  {label:7} {count:7} {kind}")
+    if args.output and not args.check:
+        print(f"✓ Wrote {args.output}")
+    if args.check and any(removed(kind) for kind in normalizer.counts):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
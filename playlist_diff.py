@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Diff two playlists into a changelog and a machine-readable patch
+
+Entries are matched in one hashed pass: first by stream URL, then, for
+entries whose URL disappeared, by tvg-id. Each entry ends up as one of
+
+    added            new URL, no removed entry with the same tvg-id
+    removed          URL gone, nothing took its tvg-id
+    url_changed      same tvg-id, different URL
+    metadata         same URL, name/tvg-id/logo/group changed
+
+The JSON patch lists the changes plus both files' hashes. The checkers
+accept it with --patch and only recheck the streams and logos it touches:
+
+    python playlist_diff.py playlist.m3u playlist1.m3u --output changes.json
+    python test_channels.py --patch changes.json
+"""
+import json
+import argparse
+from collections import deque
+
+from build_cache import file_digest, write_if_changed
+from m3u_parser import iter_channels
+
+PATCH_VERSION = 1
+FIELDS = ('name', 'tvg_id', 'tvg_name', 'logo', 'group')
+OPS = ('added', 'removed', 'url_changed', 'metadata')
+
+
+def _describe(ch):
+    return {'name': ch.name, 'tvg_id': ch.tvg_id, 'url': ch.url, 'logo': ch.logo,
+            'group': ch.group, 'line': ch.line_num}
+
+
+def _field_changes(old, new):
+    return {f: [getattr(old, f), getattr(new, f)] for f in FIELDS if getattr(old, f) != getattr(new, f)}
+
+
+def diff_channels(old, new):
+    """
+    Compare two Channel sequences. Returns a list of change dicts (see the
+    module docstring) in new-playlist order, removals last.
+    """
+    old_by_url = {}
+    for ch in old:
+        old_by_url.setdefault(ch.url, ch)
+    new_urls = {ch.url for ch in new}
+
+    # Old entries whose URL is gone, queued per tvg-id for URL-change pairing
+    orphans = {}
+    for ch in old_by_url.values():
+        if ch.url not in new_urls and ch.tvg_id:
+            orphans.setdefault(ch.tvg_id, deque()).append(ch)
+
+    changes = []
+    paired = set()      # old URLs consumed by url_changed
+    seen = set()
+    for ch in new:
+        if ch.url in seen:
+            continue    # duplicate entry in the new playlist
+        seen.add(ch.url)
+        previous = old_by_url.get(ch.url)
+        if previous is not None:
+            fields = _field_changes(previous, ch)
+            if fields:
+                change = _describe(ch)
+                change.update(op='metadata', fields=fields)
+                changes.append(change)
+            continue
+        queue = orphans.get(ch.tvg_id) if ch.tvg_id else None
+        if queue:
+            previous = queue.popleft()
+            paired.add(previous.url)
+            change = _describe(ch)
+            change.update(op='url_changed', old_url=previous.url)
+            fields = _field_changes(previous, ch)
+            if fields:
+                change['fields'] = fields
+            changes.append(change)
+        else:
+            change = _describe(ch)
+            change['op'] = 'added'
+            changes.append(change)
+
+    for ch in old_by_url.values():
+        if ch.url not in new_urls and ch.url not in paired:
+            change = _describe(ch)
+            change['op'] = 'removed'
+            changes.append(change)
+    return changes
+
+
+def make_patch(old_path, new_path):
+    """Diff two playlist files into a patch dict"""
+    changes = diff_channels(list(iter_channels(old_path)), list(iter_channels(new_path)))
+    return {
+        'version': PATCH_VERSION,
+        'old': {'path': old_path, 'sha256': file_digest(old_path)},
+        'new': {'path': new_path, 'sha256': file_digest(new_path)},
+        'summary': {op: sum(1 for c in changes if c['op'] == op) for op in OPS},
+        'changes': changes,
+    }
+
+
+def load_patch(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        patch = json.load(f)
+    if patch.get('version') != PATCH_VERSION:
+        raise ValueError(f'{path}: unsupported patch version {patch.get("version")!r}')
+    return patch
+
+
+def affected_streams(patch):
+    """Stream URLs (in the new playlist) that need a recheck"""
+    return {c['url'] for c in patch['changes'] if c['op'] in ('added', 'url_changed')}
+
+
+def affected_logos(patch):
+    """Logo URLs (in the new playlist) that need a recheck"""
+    logos = set()
+    for c in patch['changes']:
+        if c['op'] in ('added', 'url_changed') or 'logo' in c.get('fields', {}):
+            if c['logo']:
+                logos.add(c['logo'])
+    return logos
+
+
+def check_patch_target(patch, playlist_path):
+    """Warn-worthy message if the patch was not made against this playlist's current bytes"""
+    if patch['new']['sha256'] != file_digest(playlist_path):
+        return (f"patch was made for {patch['new']['path']} at a different revision "
+                f"than {playlist_path}; some changes may be missing")
+    return None
+
+
+def changelog(patch):
+    """Human-readable lines for a patch"""
+    symbols = {'added': '+', 'removed': '-', 'url_changed': '~', 'metadata': '*'}
+    lines = []
+    for c in patch['changes']:
+        line = f"{symbols[c['op']]} {c['name'][:40]:40} "
+        if c['op'] == 'url_changed':
+            line += f"{c['old_url']} -> {c['url']}"
+        elif c['op'] == 'metadata':
+            line += ', '.join(f"{field}: {old!r} -> {new!r}" for field, (old, new) in c['fields'].items())
+        else:
+            line += c['url']
+        lines.append(line)
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Diff two playlists into a changelog and JSON patch')
+    parser.add_argument('old', help='Previous playlist')
+    parser.add_argument('new', help='Current playlist')
+    parser.add_argument('--output',
+                       help='Write the JSON patch here (for test_channels.py/check_and_fix_logos.py --patch)')
+    parser.add_argument('--quiet', action='store_true',
+                       help='Only print the summary')
+    args = parser.parse_args()
+
+    patch = make_patch(args.old, args.new)
+    if not args.quiet:
+        for line in changelog(patch):
+            print(line)
+    summary = patch['summary']
+    print(f"\n{summary['added']} added, {summary['removed']} removed, "
+          f"{summary['url_changed']} URL changed, {summary['metadata']} metadata changed")
+    print(f"Recheck: {len(affected_streams(patch))} streams, {len(affected_logos(patch))} logos")
+    if args.output:
+        write_if_changed(args.output, json.dumps(patch, indent=1) + '\n')
+        print(f"Patch written to {args.output}")
+
+if __name__ == "__main__":
+    main()
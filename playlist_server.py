@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+asyncio playlist + Xtream API server (Python port of server/server.js)
+
+The playlist is parsed once into template segments: the text between stream
+URLs, each followed by its pre-encoded URL. Serving a request is then one
+splice of "<host>/stream/<token>" between precomputed byte strings, written
+out in chunks, instead of a regex rewrite of the whole file. Sessions expire
+off a heap ordered by expiry time, and the playlist is reloaded when the
+file changes on disk. With --relay, /stream proxies HLS through hls_relay
+instead of redirecting viewers to the origin.
+
+Requires aiohttp (pip install aiohttp).
+
+    python playlist_server.py --playlist playlist1.m3u --port 8080
+"""
+import os
+import re
+import json
+import time
+import heapq
+import asyncio
+import secrets
+import argparse
+import binascii
+from urllib.parse import urlparse
+
+import aiohttp
+from aiohttp import web
+
+from epg_service import DEFAULT_LIMIT, EPGStore
+from hls_relay import HLSRelay, decode_url, relay_ref
+from m3u_parser import iter_channels, read_header
+
+STREAM_URL_RE = re.compile(rb'https?://[^\s]+\.m3u8')
+SESSION_TTL = 24 * 3600
+CHUNK_PARTS = 512               # template parts joined per write
+RELOAD_INTERVAL = 1.0           # seconds between playlist mtime checks
+EPG_REFRESH = 3600              # seconds between guide revalidations
+
+# Same demo accounts as server.js; pass --users users.json in production
+DEMO_USERS = {
+    'user1': {'password': 'pass1', 'expires': '2025-12-31', 'max_connections': 1},
+    'user2': {'password': 'pass2', 'expires': '2025-12-31', 'max_connections': 2},
+}
+
+
+class PlaylistTemplate:
+    """
+    A playlist pre-split around its stream URLs.
+
+    parts[0] is the text before the first URL; every later part is
+    b'/<encoded url>.m3u8' followed by the text up to the next URL. Joining the
+    parts with b'<base>/stream/<token>' yields the rewritten playlist.
+    """
+
+    def __init__(self, data, mtime=None):
+        self.mtime = mtime
+        self.parts = []
+        position = 0
+        head = b''
+        for match in STREAM_URL_RE.finditer(data):
+            self.parts.append(head + data[position:match.start()])
+            head = b'/' + relay_ref(match.group().decode('utf-8', 'replace')).encode('ascii')
+            position = match.end()
+        self.parts.append(head + data[position:])
+        self.urls = len(self.parts) - 1
+        self.literal_size = sum(len(p) for p in self.parts)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        return cls(data, os.stat(path).st_mtime_ns)
+
+    def content_length(self, marker):
+        return self.literal_size + self.urls * len(marker)
+
+    def chunks(self, marker):
+        """Yield the rewritten playlist in pieces of CHUNK_PARTS segments"""
+        parts = self.parts
+        for start in range(0, len(parts), CHUNK_PARTS):
+            chunk = marker.join(parts[start:start + CHUNK_PARTS])
+            if start + CHUNK_PARTS < len(parts):
+                chunk += marker
+            yield chunk
+
+
+class Catalog:
+    """Channel list and Xtream JSON derived from the playlist, built on load"""
+
+    def __init__(self, path):
+        self.channels = list(iter_channels(path))
+        self.epg_url = read_header(path).get('url-tvg')
+        self.tvg_ids = {ch.tvg_id for ch in self.channels if ch.tvg_id}
+        self.categories = {}
+        for ch in self.channels:
+            group = ch.group or 'Uncategorized'
+            if group not in self.categories:
+                self.categories[group] = str(len(self.categories) + 1)
+        self.categories_json = json.dumps([
+            {'category_id': cid, 'category_name': name, 'parent_id': 0}
+            for name, cid in self.categories.items()]).encode()
+        self.streams = []
+        self.by_stream_id = {}
+        for num, ch in enumerate(self.channels, 1):
+            self.by_stream_id[num] = ch
+            self.streams.append({
+                'num': num,
+                'name': ch.name,
+                'stream_type': 'live',
+                'stream_id': num,
+                'stream_icon': ch.logo or '',
+                'epg_channel_id': ch.tvg_id or '',
+                'added': '0',
+                'category_id': self.categories[ch.group or 'Uncategorized'],
+                'custom_sid': '',
+                'tv_archive': 0,
+                'direct_source': '',
+                'tv_archive_duration': 0,
+            })
+        self.streams_json = json.dumps(self.streams).encode()
+
+
+class SessionStore:
+    """
+    Session tokens with expiry driven by a min-heap of (expires_at, token).
+
+    expire() only pops the tokens that are actually due, so each request
+    pays O(log n) for cleanup instead of scanning every session.
+    """
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self.sessions = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def create(self, username, ip, now=None):
+        now = time.time() if now is None else now
+        token = secrets.token_hex(16)
+        self.sessions[token] = {'username': username, 'created': now, 'ip': ip}
+        heapq.heappush(self._heap, (now + self.ttl, token))
+        return token
+
+    def get(self, token, now=None):
+        session = self.sessions.get(token)
+        if session and session['created'] + self.ttl <= (time.time() if now is None else now):
+            return None
+        return session
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, token = heapq.heappop(heap)
+            self.sessions.pop(token, None)
+
+
+class Users:
+    """Account lookup from a JSON file ({username: {password, expires, ...}})"""
+
+    def __init__(self, accounts):
+        self.accounts = {}
+        for username, account in accounts.items():
+            account = dict(account)
+            account['expires_at'] = time.mktime(time.strptime(account['expires'], '%Y-%m-%d'))
+            self.accounts[username] = account
+
+    @classmethod
+    def load(cls, path=None):
+        if not path:
+            return cls(DEMO_USERS)
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def authenticate(self, username, password):
+        account = self.accounts.get(username or '')
+        if account and password and secrets.compare_digest(account['password'].encode(), password.encode()):
+            return account
+        return None
+
+
+class PlaylistServer:
+    def __init__(self, playlist_path, users, session_ttl=SESSION_TTL, port=8080,
+                 epg_url=None, epg_refresh=EPG_REFRESH, relay=None):
+        self.relay = relay      # HLSRelay, or None to redirect to the origin
+        self.playlist_path = playlist_path
+        self.users = users
+        self.sessions = SessionStore(session_ttl)
+        self.port = port
+        self.started = time.time()
+        self.template = None
+        self.catalog = None
+        self.reload()
+        # EPG defaults to the playlist's url-tvg; pass epg_url='' to disable
+        epg_url = self.catalog.epg_url if epg_url is None else epg_url
+        self.epg_store = EPGStore(epg_url, max_age=epg_refresh) if epg_url else None
+        self.epg_refresh = epg_refresh
+        self._epg_wanted = None
+
+    def reload(self):
+        """(Re)build the template and catalog from the playlist file"""
+        template = PlaylistTemplate.load(self.playlist_path)
+        catalog = Catalog(self.playlist_path)
+        # Swap both at once so a request never mixes two versions
+        self.template, self.catalog = template, catalog
+        if self.relay:
+            self.relay.allow_hosts(urlparse(ch.url).hostname for ch in catalog.channels)
+        print(f"Loaded {self.playlist_path}: {len(catalog.channels)} channels, "
+              f"{template.urls} stream URLs")
+
+    async def watch(self, interval=RELOAD_INTERVAL):
+        """Reload in a worker thread whenever the playlist's mtime changes"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtime = os.stat(self.playlist_path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if mtime != self.template.mtime:
+                try:
+                    await loop.run_in_executor(None, self.reload)
+                except Exception as e:
+                    print(f"✗ Reload failed, keeping previous playlist: {e}")
+                    self.template.mtime = mtime
+                else:
+                    if self._epg_wanted:
+                        self._epg_wanted.set()
+
+    async def watch_epg(self):
+        """Load the guide off the event loop, then revalidate it periodically"""
+        loop = asyncio.get_running_loop()
+        self._epg_wanted = asyncio.Event()
+        while True:
+            self._epg_wanted.clear()
+            try:
+                if await loop.run_in_executor(None, self.epg_store.load, self.catalog.tvg_ids):
+                    print(f"Loaded EPG {self.epg_store.url}: {len(self.epg_store.epg.index)} programmes")
+            except Exception as e:
+                print(f"✗ EPG load failed: {e}")
+            try:
+                await asyncio.wait_for(self._epg_wanted.wait(), self.epg_refresh)
+            except asyncio.TimeoutError:
+                pass
+
+    def _account(self, request):
+        query = request.query
+        return query.get('username'), self.users.authenticate(query.get('username'), query.get('password'))
+
+    async def get_php(self, request):
+        username, account = self._account(request)
+        if not account:
+            return web.Response(status=401, text='Invalid credentials')
+        now = time.time()
+        if account['expires_at'] < now:
+            return web.Response(status=403, text='Subscription expired')
+
+        self.sessions.expire(now)
+        ip = request.headers.get('X-Forwarded-For') or request.remote
+        token = self.sessions.create(username, ip, now)
+
+        template = self.template
+        marker = f'{request.scheme}://{request.host}/stream/{token}'.encode()
+        response = web.StreamResponse(headers={
+            'Content-Type': 'application/x-mpegurl',
+            'Content-Disposition': 'attachment; filename="playlist.m3u8"',
+        })
+        response.content_length = template.content_length(marker)
+        await response.prepare(request)
+        for chunk in template.chunks(marker):
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    async def stream(self, request):
+        session = self.sessions.get(request.match_info['token'])
+        if not session:
+            return web.Response(status=401, text='Invalid session')
+        try:
+            url = decode_url(request.match_info['encoded'])
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            return web.Response(status=400, text='Invalid stream')
+        if not self.relay:
+            raise web.HTTPFound(url)
+
+        if not self.relay.allowed(url):
+            return web.Response(status=403, text='Stream not allowed')
+        try:
+            item = await self.relay.get(url)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return web.Response(status=502, text=f'Upstream error: {type(e).__name__}')
+        headers = {'Cache-Control': 'no-cache' if item.expires else 'max-age=3600'}
+        return web.Response(status=item.status, body=item.body, content_type=item.content_type,
+                            headers=headers)
+
+    async def player_api(self, request):
+        username, account = self._account(request)
+        if not account:
+            return web.json_response({'user_info': {'auth': 0}}, status=401)
+
+        action = request.query.get('action')
+        if action is None or action == 'get_account_info':
+            now = time.time()
+            return web.json_response({
+                'user_info': {
+                    'username': username,
+                    'password': request.query.get('password'),
+                    'auth': 1,
+                    'status': 'Active' if account['expires_at'] >= now else 'Expired',
+                    'exp_date': int(account['expires_at']),
+                    'is_trial': '0',
+                    'active_cons': '0',
+                    'created_at': int(time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1))),
+                    'max_connections': str(account.get('max_connections', 1)),
+                },
+                'server_info': {
+                    'url': request.host.split(':')[0],
+                    'port': str(self.port),
+                    'https_port': '443',
+                    'server_protocol': request.scheme,
+                    'rtmp_port': '1935',
+                    'timezone': time.strftime('%Z'),
+                    'timestamp_now': int(now),
+                    'time_now': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now)),
+                },
+            })
+        if action in ('get_short_epg', 'get_simple_data_table'):
+            return self._epg(request, action)
+        if action == 'get_live_categories':
+            return web.Response(body=self.catalog.categories_json, content_type='application/json')
+        if action == 'get_live_streams':
+            category_id = request.query.get('category_id')
+            if not category_id:
+                return web.Response(body=self.catalog.streams_json, content_type='application/json')
+            return web.json_response([s for s in self.catalog.streams if s['category_id'] == category_id])
+        return web.json_response({'status': 'error', 'message': 'Unknown action'})
+
+    def _epg(self, request, action):
+        epg = self.epg_store.epg if self.epg_store else None
+        try:
+            channel = self.catalog.by_stream_id.get(int(request.query.get('stream_id', '')))
+        except ValueError:
+            channel = None
+        if epg is None or channel is None or not channel.tvg_id:
+            return web.Response(body=b'{"epg_listings":[]}', content_type='application/json')
+        if action == 'get_short_epg':
+            try:
+                limit = int(request.query.get('limit') or DEFAULT_LIMIT)
+            except ValueError:
+                limit = DEFAULT_LIMIT
+            body = epg.short_epg(channel.tvg_id, limit)
+        else:
+            body = epg.simple_data_table(channel.tvg_id)
+        return web.Response(body=body, content_type='application/json')
+
+    async def health(self, request):
+        return web.json_response({
+            'status': 'ok',
+            'uptime': time.time() - self.started,
+            'sessions': len(self.sessions),
+            'channels': len(self.catalog.channels),
+            'relay': self.relay.stats.as_dict() if self.relay else None,
+            'epg_programmes': len(self.epg_store.epg.index) if self.epg_store and self.epg_store.epg else 0,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        })
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get('/get.php', self.get_php)
+        app.router.add_get('/stream/{token}/{encoded:.+}', self.stream)
+        app.router.add_get('/player_api.php', self.player_api)
+        app.router.add_get('/health', self.health)
+
+        async def start_watcher(app):
+            app['watchers'] = [asyncio.ensure_future(self.watch())]
+            if self.epg_store:
+                app['watchers'].append(asyncio.ensure_future(self.watch_epg()))
+
+        async def stop_watcher(app):
+            for task in app['watchers']:
+                task.cancel()
+            if self.relay:
+                await self.relay.close()
+
+        app.on_startup.append(start_watcher)
+        app.on_cleanup.append(stop_watcher)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the playlist and Xtream API')
+    parser.add_argument('--playlist', default='playlist1.m3u',
+                       help='Playlist to serve (reloaded when it changes)')
+    parser.add_argument('--users',
+                       help='JSON file of accounts (default: the demo users from server.js)')
+    parser.add_argument('--host', default='0.0.0.0',
+                       help='Address to bind')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8080)),
+                       help='Port to listen on (default: $PORT or 8080)')
+    parser.add_argument('--session-ttl', type=int, default=SESSION_TTL,
+                       help='Seconds a /get.php session token stays valid')
+    parser.add_argument('--epg',
+                       help='XMLTV guide for get_short_epg/get_simple_data_table '
+                            '(default: the playlist url-tvg, "" to disable)')
+    parser.add_argument('--epg-refresh', type=int, default=EPG_REFRESH,
+                       help='Seconds between guide revalidations')
+    parser.add_argument('--relay', action='store_true',
+                       help='Proxy HLS through this server (coalesced, cached) instead of redirecting')
+    parser.add_argument('--relay-cache-mb', type=int, default=256,
+                       help='Segment cache size for --relay')
+    parser.add_argument('--access-log', action='store_true',
+                       help='Log every request')
+    args = parser.parse_args()
+
+    server = PlaylistServer(args.playlist, Users.load(args.users), args.session_ttl, args.port,
+                            args.epg, args.epg_refresh,
+                            HLSRelay(args.relay_cache_mb * 1024 * 1024) if args.relay else None)
+    print(f"IPTV Server running on port {args.port}")
+    print(f"Access URL: http://localhost:{args.port}/get.php?username=USER&password=PASS&type=m3u_plus&output=ts")
+    web.run_app(server.make_app(), host=args.host, port=args.port, print=None,
+                access_log=web.access_logger if args.access_log else None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,37 @@
 import requests
-import re
-from urllib.parse import urlparse
+from itertools import count, islice
 
-# Parse playlist
-channels = []
-with open('playlist1.m3u', 'r') as f:
-    lines = f.readlines()
-    for i in range(len(lines)):
-        if lines[i].startswith('#EXTINF'):
-            if i+1 < len(lines) and lines[i+1].startswith('http'):
-                name = re.search(r',(.+)$', lines[i]).group(1) if re.search(r',(.+)$', lines[i]) else "Unknown"
-                channels.append({'name': name, 'url': lines[i+1].strip()})
+from epg_cache import open_guide
+from health_store import HealthStore
+from m3u_parser import iter_channels
+from stream_checker import check_streams
 
-print(f"Testing {len(channels[:10])} channels...\n")
+# Parse playlist (only the first 10 channels are needed)
+channels = list(islice(iter_channels('playlist1.m3u'), 10))
 
-# Test first 10 channels
-for i, ch in enumerate(channels[:10], 1):
-    try:
-        domain = urlparse(ch['url']).netloc
-        resp = requests.head(ch['url'], timeout=3, allow_redirects=True)
-        status = "✓" if resp.status_code in [200, 302, 301, 403] else "✗"
-        print(f"{i}. {status} {ch['name'][:35]:35} [{domain}]")
-    except:
-        print(f"{i}. ✗ {ch['name'][:35]:35} [{domain}]")
+print(f"Testing {len(channels)} channels...\n")
+
+# Test first 10 channels (printed as results come in)
+counter = count(1)
+
+def report(result):
+    status = "✓" if result.ok else "✗"
+    print(f"{next(counter)}. {status} {result.item.name[:35]:35} [{result.host}]")
+
+with HealthStore() as store:
+    check_streams(channels, store.recorder('stream', report), timeout=3, ok_statuses=(200, 302, 301, 403))
 
 # Test EPG
 print("\n" + "="*50)
 print("Testing EPG...")
 try:
-    epg_resp = requests.get("https://raw.githubusercontent.com/acidjesuz/EPGTalk/master/guide.xml", timeout=5)
-    if epg_resp.status_code == 200:
-        print(f"✓ EPG is accessible (Size: {len(epg_resp.content)//1024}KB)")
+    with open_guide("https://raw.githubusercontent.com/acidjesuz/EPGTalk/master/guide.xml") as guide:
+        print(f"✓ EPG is accessible (Size: {guide.size//1024}KB)")
         # Check for common channel IDs
-        epg_text = epg_resp.text[:50000]  # Check first 50KB
         common_ids = ['ABC.us', 'CBS.us', 'NBC.us', 'FOX.us', 'HBO.us']
-        found = [id for id in common_ids if f'id="{id}"' in epg_text]
-        print(f"✓ Found EPG data for: {', '.join(found)}")
-    else:
-        print(f"✗ EPG not accessible: {epg_resp.status_code}")
+        found = [id for id in common_ids if id in guide]
+    print(f"✓ Found EPG data for: {', '.join(found)}")
+except requests.exceptions.HTTPError as e:
+    print(f"✗ EPG not accessible: {e.response.status_code}")
 except Exception as e:
     print(f"✗ EPG error: {e}")
\ No newline at end of file
@@ -1,15 +1,143 @@
 #!/usr/bin/env python3
+import os
 import re
+import sys
+import json
 import requests
-import concurrent.futures
 import argparse
 from urllib.parse import urlparse
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import metrics
+from build_cache import write_if_changed
+from health_store import DEFAULT_DB, HealthStore
+from host_guard import HostGuard
+from m3u_parser import iter_channels
+from playlist_diff import affected_logos, check_patch_target, load_patch
+from stream_checker import StreamChecker
+
+LOGO_ATTR_RE = re.compile(r'tvg-logo=(?:"[^"]*"|[^\s,"]*)')
+
+# A ranged GET for the first few bytes is enough to tell an image from an
+# HTML error page, without downloading the whole file.
+SNIFF_BYTES = 64
+IMAGE_MAGIC = (
+    b'\x89PNG\r\n\x1a\n',   # PNG
+    b'\xff\xd8\xff',         # JPEG
+    b'GIF87a', b'GIF89a',     # GIF
+    b'\x00\x00\x01\x00',     # ICO
+    b'BM',                    # BMP
+)
+
+
+def looks_like_image(head):
+    """True if the first bytes of a response are a known image format"""
+    if head.startswith(IMAGE_MAGIC):
+        return True
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return True
+    text = head.lstrip().lower()
+    return text.startswith(b'<svg') or (text.startswith(b'<?xml') and b'<svg' in text)
+
+
+class LogoCache:
+    """
+    Persistent per-URL logo results with a TTL.
+
+    Entries younger than `ttl` are trusted outright. Older entries keep their
+    ETag/Last-Modified so the next probe can be a conditional request.
+    """
+    
+    def __init__(self, path, ttl=24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        self.dirty = False
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+    
+    def fresh(self, url):
+        """Return the cached entry for url if it is within the TTL"""
+        entry = self.entries.get(url)
+        if entry and time.time() - entry['checked_at'] < self.ttl:
+            return entry
+        return None
+    
+    def validators(self, url):
+        """Conditional request headers for a stale entry"""
+        entry = self.entries.get(url) or {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+    
+    def store(self, url, ok, status, etag=None, last_modified=None):
+        if status == 304 and url in self.entries:
+            entry = self.entries[url]
+            entry['checked_at'] = time.time()
+        else:
+            self.entries[url] = {
+                'ok': ok,
+                'status': status,
+                'etag': etag,
+                'last_modified': last_modified,
+                'checked_at': time.time(),
+            }
+        self.dirty = True
+        return self.entries[url]
+    
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+def _sniff_headers(cache, url):
+    headers = {'Range': f'bytes=0-{SNIFF_BYTES - 1}'}
+    headers.update(cache.validators(url))
+    return headers
+
+
+class LogoProbe(StreamChecker):
+    """Async counterpart of LogoChecker.check_logo_url: one ranged GET, sniffed"""
+    
+    def __init__(self, cache, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+    
+    async def probe(self, session, url):
+        async with session.get(url, headers=_sniff_headers(self.cache, url),
+                               allow_redirects=True) as response:
+            if response.status == 304 and url in self.cache.entries:
+                entry = self.cache.store(url, None, 304)
+                return entry['ok'], entry['status']
+            ok = False
+            if response.status in (200, 206):
+                ok = looks_like_image(await response.content.read(SNIFF_BYTES))
+            self.cache.store(url, ok, response.status,
+                             response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            return ok, response.status
+
+
 class LogoChecker:
-    def __init__(self, m3u_file, max_workers=20):
+    def __init__(self, m3u_file, max_workers=20, cache_file='.logo_cache.json', cache_ttl=24 * 3600,
+                 health=None, guard=None):
         self.m3u_file = m3u_file
         self.max_workers = max_workers
+        self.cache = LogoCache(cache_file, cache_ttl)
+        self.health = health    # optional HealthStore recording every probe
+        self.guard = guard or HostGuard()   # per-host circuit breaker / pacing
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
@@ -42,29 +170,42 @@ class LogoChecker:
         self.broken_logos = []
         self.working_logos = []
         self.fixed_logos = {}
+        self.alternatives = {}  # channel key -> working known logo URL (None if there is none)
     
     def check_logo_url(self, url):
-        """Check if a logo URL is accessible"""
+        """Check if a logo URL serves an image (cached, single ranged GET)"""
+        entry = self.cache.fresh(url)
+        if entry:
+            return entry['ok']
         try:
-            response = self.session.head(url, timeout=5, allow_redirects=True)
-            if response.status_code == 200:
-                # Double-check with GET for content-type
-                response = self.session.get(url, timeout=5, stream=True)
-                content_type = response.headers.get('Content-Type', '').lower()
-                if 'image' in content_type or response.status_code == 200:
-                    return True
+            with self.session.get(url, timeout=5, allow_redirects=True, stream=True,
+                                  headers=_sniff_headers(self.cache, url)) as response:
+                if response.status_code == 304 and url in self.cache.entries:
+                    return self.cache.store(url, None, 304)['ok']
+                ok = False
+                if response.status_code in (200, 206):
+                    ok = looks_like_image(response.raw.read(SNIFF_BYTES))
+                self.cache.store(url, ok, response.status_code,
+                                 response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                return ok
         except Exception as e:
             pass
         return False
     
     def find_alternative_logo(self, original_url, channel_name):
         """Find an alternative logo for a broken URL"""
-        # First, check known working logos
         channel_key = channel_name.lower().split()[0] if channel_name else ''
-        for key, working_url in self.known_working_logos.items():
-            if key in channel_key:
-                if self.check_logo_url(working_url):
-                    return working_url
+        # First, check known working logos (once per key; the placeholder
+        # below is per channel, so only this lookup is shared)
+        if channel_key not in self.alternatives:
+            self.alternatives[channel_key] = None
+            for key, working_url in self.known_working_logos.items():
+                if key in channel_key:
+                    if self.check_logo_url(working_url):
+                        self.alternatives[channel_key] = working_url
+                        break
+        if self.alternatives[channel_key]:
+            return self.alternatives[channel_key]
         
         # Try to extract channel name and create placeholder
         clean_name = re.sub(r'[^\w\s]', '', channel_name).replace(' ', '+')
@@ -73,79 +214,73 @@ class LogoChecker:
         return placeholder_url
     
     def parse_m3u(self):
-        """Parse M3U file and extract logo URLs"""
-        with open(self.m3u_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        lines = content.split('\n')
-        entries = []
-        
-        for i, line in enumerate(lines):
-            if line.startswith('#EXTINF'):
-                # Extract logo URL
-                logo_match = re.search(r'tvg-logo="([^"]+)"', line)
-                if logo_match:
-                    logo_url = logo_match.group(1)
-                    
-                    # Extract channel name
-                    name_match = re.search(r',(.+)$', line)
-                    channel_name = name_match.group(1) if name_match else 'Unknown'
-                    
-                    entries.append({
-                        'line_num': i,
-                        'line': line,
-                        'logo_url': logo_url,
-                        'channel_name': channel_name
-                    })
-        
-        return lines, entries
+        """Parse M3U file and extract channels that have a logo URL"""
+        return [ch for ch in iter_channels(self.m3u_file) if ch.logo]
     
     def check_all_logos(self, entries):
-        """Check all logos in parallel"""
-        print(f"Checking {len(entries)} logo URLs...")
+        """Check all logos in parallel, probing each distinct URL once"""
+        by_url = {}
+        for entry in entries:
+            by_url.setdefault(entry.logo, []).append(entry)
         
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            future_to_entry = {
-                executor.submit(self.check_logo_url, entry['logo_url']): entry 
-                for entry in entries
-            }
-            
-            for future in concurrent.futures.as_completed(future_to_entry):
-                entry = future_to_entry[future]
-                is_working = future.result()
-                
-                if is_working:
+        def report(url, ok):
+            for entry in by_url[url]:
+                if ok:
                     self.working_logos.append(entry)
-                    print(f"✓ {entry['channel_name']}")
+                    print(f"✓ {entry.name}")
                 else:
                     self.broken_logos.append(entry)
-                    print(f"✗ {entry['channel_name']} - {entry['logo_url']}")
+                    print(f"✗ {entry.name} - {entry.logo}")
+        
+        # Results still within the cache TTL need no request at all
+        pending = []
+        for url in by_url:
+            cached = self.cache.fresh(url)
+            if cached:
+                report(url, cached['ok'])
+            else:
+                pending.append(url)
+        
+        print(f"Checking {len(pending)} logo URLs "
+              f"({len(by_url) - len(pending)} cached, {len(entries)} entries)...")
+        
+        if pending:
+            checker = LogoProbe(self.cache, concurrency=self.max_workers, per_host=8,
+                                headers=self.session.headers, guard=self.guard)
+            on_result = metrics.recorder('logo', lambda result: report(result.url, result.ok))
+            if self.health:
+                on_result = self.health.recorder('logo', on_result)
+            checker.run(pending, on_result)
+            if self.health:
+                self.health.flush()
+        self.cache.save()
     
     def fix_broken_logos(self):
         """Find alternatives for broken logos"""
         print(f"\nFinding alternatives for {len(self.broken_logos)} broken logos...")
         
         for entry in self.broken_logos:
-            alternative = self.find_alternative_logo(entry['logo_url'], entry['channel_name'])
-            self.fixed_logos[entry['line_num']] = alternative
-            print(f"  {entry['channel_name']} -> {alternative}")
+            alternative = self.find_alternative_logo(entry.logo, entry.name)
+            self.fixed_logos[entry.line_num] = alternative
+            print(f"  {entry.name} -> {alternative}")
+        self.cache.save()
     
     def save_fixed_playlist(self, output_file):
         """Save the playlist with fixed logos"""
-        lines, entries = self.parse_m3u()
-        
-        # Update lines with fixed logos
-        for line_num, new_logo_url in self.fixed_logos.items():
-            line = lines[line_num]
-            # Replace the logo URL
-            line = re.sub(r'tvg-logo="[^"]+"', f'tvg-logo="{new_logo_url}"', line)
-            lines[line_num] = line
-        
-        # Write the fixed playlist
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))
-        
-        print(f"\n✓ Saved fixed playlist to {output_file}")
+        # Stream the input once, swapping the logo on the recorded #EXTINF lines
+        lines = []
+        with open(self.m3u_file, 'r', encoding='utf-8') as src:
+            for line_num, line in enumerate(src):
+                new_logo_url = self.fixed_logos.get(line_num)
+                if new_logo_url:
+                    line = LOGO_ATTR_RE.sub(lambda m: f'tvg-logo="{new_logo_url}"', line, count=1)
+                lines.append(line)
+
+        # Leave the file (and its mtime) alone when nothing changed
+        if write_if_changed(output_file, ''.join(lines)):
+            print(f"\n✓ Saved fixed playlist to {output_file}")
+        else:
+            print(f"\n✓ {output_file} already up to date")
     
     def generate_report(self):
         """Generate a report of logo status"""
@@ -157,13 +292,16 @@ class LogoChecker:
         report.append(f"Working logos: {len(self.working_logos)}")
         report.append(f"Broken logos: {len(self.broken_logos)}")
         report.append(f"Fixed logos: {len(self.fixed_logos)}")
+        if self.guard.short_circuited:
+            report.append(f"Skipped (host down): {self.guard.short_circuited} "
+                          f"[{', '.join(self.guard.down_hosts())}]")
         
         if self.broken_logos:
             report.append("\nBROKEN LOGOS:")
             report.append("-" * 40)
             for entry in self.broken_logos[:20]:  # Show first 20
-                report.append(f"  - {entry['channel_name']}")
-                report.append(f"    {entry['logo_url']}")
+                report.append(f"  - {entry.name}")
+                report.append(f"    {entry.logo}")
         
         return '\n'.join(report)
 
@@ -177,16 +315,38 @@ def main():
                        help='Number of concurrent workers')
     parser.add_argument('--check-only', action='store_true',
                        help='Only check logos, do not fix')
+    parser.add_argument('--cache', default='.logo_cache.json',
+                       help='Per-URL result cache file ("" to disable)')
+    parser.add_argument('--cache-ttl', type=int, default=24 * 3600,
+                       help='Seconds a cached logo result is trusted without revalidation')
+    parser.add_argument('--history', default=DEFAULT_DB,
+                       help='SQLite file probe results are recorded in ("" to disable)')
+    parser.add_argument('--host-rate', type=float, default=10,
+                       help='Maximum logo requests per second to any one host (0 = unlimited)')
+    parser.add_argument('--metrics-file',
+                       help='Write probe metrics here for the node_exporter textfile collector (.prom)')
+    parser.add_argument('--patch',
+                       help='Only check logos that are new or changed in this playlist_diff.py patch')
     
     args = parser.parse_args()
     
-    checker = LogoChecker(args.input, args.workers)
+    health = HealthStore(args.history) if args.history else None
+    checker = LogoChecker(args.input, args.workers, args.cache, args.cache_ttl, health,
+                          HostGuard(rate=args.host_rate))
     
     print("Logo Checker & Fixer")
     print("=" * 60)
     
     # Parse and check logos
-    lines, entries = checker.parse_m3u()
+    entries = checker.parse_m3u()
+    if args.patch:
+        patch = load_patch(args.patch)
+        warning = check_patch_target(patch, args.input)
+        if warning:
+            print(f"Warning: {warning}")
+        logos = affected_logos(patch)
+        entries = [entry for entry in entries if entry.logo in logos]
+        print(f"Patch {args.patch}: {len(entries)} entries with new or changed logos")
     checker.check_all_logos(entries)
     
     # Generate report
@@ -207,6 +367,10 @@ def main():
         f.write(f"\n\nGenerated at: {time.strftime('%Y-%m-%d %H:%M:%S')}")
     
     print("\n✓ Report saved to logo_check_report.txt")
+    if args.metrics_file:
+        metrics.write_textfile(args.metrics_file)
+    if health:
+        health.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Local logo mirror: download each tvg-logo once, serve small thumbnails
+
+Every distinct logo URL is fetched once (conditional GET on re-runs, nothing
+at all while the manifest entry is younger than --ttl) and stored by content
+hash, so the same image behind several URLs is kept once. Raster logos are
+normalized to PNG thumbnails that fit --size; SVGs are kept as they are.
+Channels whose logo is missing or broken get a locally rendered SVG
+placeholder instead of a remote placeholder service. The playlist's tvg-logo
+attributes are then rewritten to --base-url + file name; the manifest
+remembers each channel's original logo URL, so running again on the
+rewritten playlist revalidates the originals instead of losing them.
+
+Thumbnails need Pillow (pip install Pillow); without it the original images
+are mirrored unchanged.
+
+    python scripts/logo_mirror.py --input playlist1.m3u --base-url https://example.com/logos/
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from build_cache import atomic_write, write_if_changed
+from host_guard import HostGuard
+from m3u_parser import iter_channels
+from stream_checker import StreamChecker
+from check_and_fix_logos import LOGO_ATTR_RE, looks_like_image
+
+MANIFEST = 'manifest.json'
+MAX_LOGO_BYTES = 5 * 1024 * 1024
+THUMB_SIZE = (256, 144)
+PLACEHOLDER_COLORS = ('#0088cc', '#6a4c93', '#1982c4', '#8ac926', '#ff595e', '#ff924c', '#2a9d8f', '#264653')
+MIRROR_FILE_RE = re.compile(r'^(?:[0-9a-f]{16}\.(?:png|svg|jpg|gif|ico|bmp|webp)|placeholder-[0-9a-f]{12}\.svg)$')
+
+
+def sniff_extension(data):
+    """File extension for image bytes (by magic number)"""
+    if data.startswith(b'\x89PNG'):
+        return '.png'
+    if data.startswith(b'\xff\xd8\xff'):
+        return '.jpg'
+    if data.startswith((b'GIF87a', b'GIF89a')):
+        return '.gif'
+    if data.startswith(b'\x00\x00\x01\x00'):
+        return '.ico'
+    if data.startswith(b'BM'):
+        return '.bmp'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return '.webp'
+    return '.svg'
+
+
+def thumbnail(data, size=THUMB_SIZE):
+    """
+    Normalize an image to a PNG fitting `size`, keeping its aspect ratio.
+    Returns (bytes, extension); SVGs and anything Pillow cannot read (or no
+    Pillow at all) come back unchanged.
+    """
+    extension = sniff_extension(data)
+    if Image is None or extension == '.svg':
+        return data, extension
+    try:
+        with Image.open(BytesIO(data)) as image:
+            image = image.convert('RGBA')
+            image.thumbnail(size, Image.LANCZOS)
+            out = BytesIO()
+            image.save(out, 'PNG', optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return data, extension
+    return out.getvalue(), '.png'
+
+
+def render_placeholder(name, size=THUMB_SIZE):
+    """SVG placeholder showing the channel name on a colour picked from it"""
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    color = PLACEHOLDER_COLORS[int(digest[:8], 16) % len(PLACEHOLDER_COLORS)]
+    width, height = size
+    label = name if len(name) <= 18 else name[:17] + '…'
+    font = max(12, min(height // 3, int(width * 1.6 / max(len(label), 1))))
+    svg = (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+           f'viewBox="0 0 {width} {height}">'
+           f'<rect width="100%" height="100%" rx="12" fill="{color}"/>'
+           f'<text x="50%" y="50%" dominant-baseline="central" text-anchor="middle" '
+           f'font-family="Helvetica,Arial,sans-serif" font-weight="bold" font-size="{font}" '
+           f'fill="#ffffff">{escape(label)}</text></svg>\n')
+    return f'placeholder-{digest[:12]}.svg', svg.encode('utf-8')
+
+
+class LogoFetcher(StreamChecker):
+    """Conditional GET of whole logos; details carry (body, ETag, Last-Modified)"""
+
+    def __init__(self, manifest, **kwargs):
+        super().__init__(**kwargs)
+        self.manifest = manifest
+
+    async def probe(self, session, url):
+        entry = self.manifest.get(url) or {}
+        headers = {}
+        if entry.get('file'):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        async with session.get(url, headers=headers, allow_redirects=True) as response:
+            if response.status == 304:
+                return True, 304, None
+            if response.status != 200:
+                return False, response.status
+            if (response.content_length or 0) > MAX_LOGO_BYTES:
+                return False, 'Too large'
+            # content.read(n) returns whatever has arrived, so gather chunks
+            chunks = []
+            size = 0
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                size += len(chunk)
+                if size > MAX_LOGO_BYTES:
+                    return False, 'Too large'
+                chunks.append(chunk)
+            body = b''.join(chunks)
+            if not looks_like_image(body[:64]):
+                return False, 'Not an image'
+            return True, 200, (body, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+
+class LogoMirror:
+    """
+    Mirror directory plus its manifest.json:
+
+        urls:     logo URL -> {file, sha256, etag, last_modified, status, checked_at}
+        channels: channel name -> original logo URL (None if it had none)
+        files:    file name -> size in bytes
+    """
+
+    def __init__(self, directory, base_url, size=THUMB_SIZE, ttl=7 * 24 * 3600):
+        self.directory = directory
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.size = size
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_path = os.path.join(directory, MANIFEST)
+        self.urls = {}
+        self.channels = {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # Thumbnails made at another size are regenerated
+            if data.get('size') == list(size):
+                self.urls = data.get('urls', {})
+            self.channels = data.get('channels', {})
+        except (OSError, ValueError):
+            pass
+        self.downloaded = 0
+        self.revalidated = 0
+        self.skipped = 0        # still within the TTL, no request made
+        self.written = 0
+
+    def public_url(self, file_name):
+        return self.base_url + file_name
+
+    def mirrored_file(self, logo):
+        """File name if `logo` already points into the mirror, else None"""
+        if logo and logo.startswith(self.base_url):
+            file_name = logo[len(self.base_url):]
+            if MIRROR_FILE_RE.match(file_name):
+                return file_name
+        return None
+
+    def source_url(self, name, logo):
+        """
+        The original logo URL for a channel. A tvg-logo that a previous run
+        rewrote to the mirror is mapped back through the manifest: by channel
+        name first, then by the URL that produced the file.
+        """
+        file_name = self.mirrored_file(logo)
+        if file_name is None:
+            return logo
+        if name in self.channels:
+            return self.channels[name]
+        return next((url for url, entry in self.urls.items() if entry.get('file') == file_name), None)
+
+    def _store(self, data):
+        """Write the thumbnail for `data` unless that content is already mirrored"""
+        sha = hashlib.sha256(data).hexdigest()
+        thumb, extension = thumbnail(data, self.size)
+        file_name = sha[:16] + extension
+        path = os.path.join(self.directory, file_name)
+        if not os.path.exists(path):
+            atomic_write(path, thumb)
+            self.written += 1
+        return sha, file_name
+
+    def placeholder(self, name):
+        file_name, svg = render_placeholder(name, self.size)
+        if write_if_changed(os.path.join(self.directory, file_name), svg):
+            self.written += 1
+        return file_name
+
+    def refresh(self, urls, concurrency=20, guard=None):
+        """Bring every URL up to date; returns {url: file name or None if broken}"""
+        now = time.time()
+        pending = []
+        for url in urls:
+            entry = self.urls.get(url)
+            fresh = entry and now - entry['checked_at'] < self.ttl
+            if not fresh or (entry.get('file') and not os.path.exists(os.path.join(self.directory, entry['file']))):
+                pending.append(url)
+        self.skipped = len(urls) - len(pending)
+
+        if pending:
+            fetcher = LogoFetcher(self.urls, concurrency=concurrency, per_host=8, timeout=15, guard=guard)
+            for result in fetcher.run(pending):
+                entry = self.urls.get(result.url) or {}
+                if result.status == 304 and entry.get('file'):
+                    self.revalidated += 1
+                elif result.ok:
+                    body, etag, last_modified = result.details
+                    sha, file_name = self._store(body)
+                    entry = {'file': file_name, 'sha256': sha, 'etag': etag, 'last_modified': last_modified}
+                    self.downloaded += 1
+                elif entry.get('file') and not isinstance(result.status, int):
+                    # Unreachable right now: keep serving the mirrored copy
+                    pass
+                else:
+                    entry = {'file': None}
+                entry['status'] = result.status
+                entry['checked_at'] = now
+                self.urls[result.url] = entry
+        return {url: self.urls.get(url, {}).get('file') for url in urls}
+
+    def prune(self, keep):
+        """Delete mirrored files neither `keep` nor the manifest refers to"""
+        keep = set(keep)
+        keep.update(entry['file'] for entry in self.urls.values() if entry.get('file'))
+        removed = 0
+        for file_name in os.listdir(self.directory):
+            if MIRROR_FILE_RE.match(file_name) and file_name not in keep:
+                os.unlink(os.path.join(self.directory, file_name))
+                removed += 1
+        return removed
+
+    def save(self, files):
+        sizes = {f: os.path.getsize(os.path.join(self.directory, f)) for f in sorted(files)}
+        manifest = {'size': list(self.size), 'urls': self.urls, 'channels': self.channels, 'files': sizes}
+        write_if_changed(self.manifest_path, json.dumps(manifest, indent=1, sort_keys=True))
+
+
+def rewrite_logos(path, output, logos):
+    """Point tvg-logo at the mirror; `logos` maps #EXTINF line number -> URL"""
+    lines = []
+    with open(path, 'r', encoding='utf-8') as src:
+        for line_num, line in enumerate(src):
+            logo = logos.get(line_num)
+            if logo:
+                if LOGO_ATTR_RE.search(line):
+                    line = LOGO_ATTR_RE.sub(lambda m: f'tvg-logo="{logo}"', line, count=1)
+                else:
+                    line = re.sub(r'^(#EXTINF:\s*[-\d.]*)', lambda m: f'{m.group(1)} tvg-logo="{logo}"', line, count=1)
+            lines.append(line)
+    return write_if_changed(output, ''.join(lines))
+
+
+def parse_size(text):
+    width, _, height = text.lower().partition('x')
+    return int(width), int(height or width)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mirror playlist logos locally as deduplicated thumbnails')
+    parser.add_argument('--input', default='playlist1.m3u',
+                       help='Input M3U file')
+    parser.add_argument('--output',
+                       help='Output M3U file with mirrored logos (default: rewrite --input)')
+    parser.add_argument('--dir', default='logos',
+                       help='Mirror directory (default: logos)')
+    parser.add_argument('--base-url', default='logos/',
+                       help='URL prefix the mirror directory is served under')
+    parser.add_argument('--size', type=parse_size, default=THUMB_SIZE,
+                       help='Thumbnail bounding box, e.g. 256x144')
+    parser.add_argument('--ttl', type=float, default=7 * 24,
+                       help='Hours before a mirrored logo is revalidated')
+    parser.add_argument('--workers', type=int, default=20,
+                       help='Concurrent downloads')
+    args = parser.parse_args()
+
+    mirror = LogoMirror(args.dir, args.base_url, args.size, args.ttl * 3600)
+    channels = list(iter_channels(args.input))
+    sources = {}        # line number -> original logo URL
+    for ch in channels:
+        source = sources[ch.line_num] = mirror.source_url(ch.name, ch.logo)
+        if source is not None or mirror.mirrored_file(ch.logo) is None:
+            mirror.channels[ch.name] = source
+    urls = list(dict.fromkeys(url for url in sources.values() if url and url.startswith('http')))
+    print(f"Mirroring {len(urls)} logo URLs for {len(channels)} channels into {args.dir}/")
+
+    files = mirror.refresh(urls, args.workers, HostGuard())
+    logos = {}
+    used = set()
+    placeholders = 0
+    for ch in channels:
+        source = sources[ch.line_num]
+        file_name = files.get(source)
+        if not file_name and source is None:
+            # Rewritten by a run the manifest knows nothing about: keep its file
+            kept = mirror.mirrored_file(ch.logo)
+            if kept and not kept.startswith('placeholder-') and os.path.exists(os.path.join(args.dir, kept)):
+                file_name = kept
+        if not file_name:
+            file_name = mirror.placeholder(ch.name)
+            placeholders += 1
+        used.add(file_name)
+        logos[ch.line_num] = mirror.public_url(file_name)
+
+    mirror.save(used)
+    removed = mirror.prune(used)
+    output = args.output or args.input
+    changed = rewrite_logos(args.input, output, logos)
+
+    broken = sum(1 for url in urls if not files.get(url))
+    total = sum(os.path.getsize(os.path.join(args.dir, f)) for f in used)
+    print(f"✓ {mirror.downloaded} downloaded, {mirror.revalidated} revalidated (304), "
+          f"{mirror.skipped} within TTL")
+    print(f"✓ {len(used)} distinct files ({total / 1024:.0f}KB), {mirror.written} written, {removed} removed")
+    print(f"✗ {broken} broken logo URLs; {placeholders} channels use a local placeholder")
+    print(f"{'✓ Updated' if changed else '✓ Already up to date:'} {output}")
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,10 @@ const USERS = {
 
 // Your M3U playlist URL (can be GitHub raw URL)
 const PLAYLIST_URL = 'https://raw.githubusercontent.com/Kevsosmooth/ip-live/main/playlist1.m3u';
+// Per-group playlists written by artifacts.py next to the playlist
+const GROUPS_URL = 'https://raw.githubusercontent.com/Kevsosmooth/ip-live/main/playlist1.groups/';
+// How long the edge may reuse the fetched playlist before asking GitHub again
+const EDGE_CACHE_SECONDS = 300;
 
 addEventListener('fetch', event => {
   event.respondWith(handleRequest(event.request));
@@ -31,9 +35,20 @@ async function handleRequest(request) {
     });
   }
   
-  // Fetch the playlist
-  const playlistResponse = await fetch(PLAYLIST_URL);
-  let playlist = await playlistResponse.text();
+  // Fetch the playlist (or one pre-split group), cached at the edge instead
+  // of going back to GitHub on every request
+  const group = params.get('group');
+  if (group && !/^[a-z0-9-]+$/.test(group)) {
+    return new Response('Invalid group', { status: 400 });
+  }
+  const sourceUrl = group ? `${GROUPS_URL}${group}.m3u` : PLAYLIST_URL;
+  const playlistResponse = await fetch(sourceUrl, {
+    cf: { cacheTtl: EDGE_CACHE_SECONDS, cacheEverything: true }
+  });
+  if (!playlistResponse.ok) {
+    return new Response('Playlist unavailable', { status: playlistResponse.status });
+  }
+  const etag = playlistResponse.headers.get('ETag');
   
   // Optional: Add IP restriction by modifying URLs
   const clientIP = request.headers.get('CF-Connecting-IP');
@@ -41,12 +56,18 @@ async function handleRequest(request) {
   // Log access (you can send this to a logging service)
   console.log(`Access granted: ${username} from ${clientIP} at ${new Date().toISOString()}`);
   
-  // Return the playlist
-  return new Response(playlist, {
-    headers: {
-      'Content-Type': 'application/x-mpegurl',
-      'Content-Disposition': 'attachment; filename="playlist.m3u8"',
-      'Cache-Control': 'no-cache',
+  const headers = {
+    'Content-Type': 'application/x-mpegurl',
+    'Content-Disposition': 'attachment; filename="playlist.m3u8"',
+    'Cache-Control': `private, max-age=${EDGE_CACHE_SECONDS}`,
+  };
+  if (etag) {
+    headers['ETag'] = etag;
+    if (request.headers.get('If-None-Match') === etag) {
+      return new Response(null, { status: 304, headers });
     }
-  });
+  }
+  
+  // Return the playlist body as-is (streamed, not re-read into a string)
+  return new Response(playlistResponse.body, { headers });
 }
\ No newline at end of file
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+asyncio stream checker with pooled keep-alive connections and per-host limits
+
+Requires aiohttp (pip install aiohttp).
+"""
+import time
+import asyncio
+from urllib.parse import urlparse
+
+import aiohttp
+
+from host_guard import HOST_DOWN
+
+OK_STATUSES = (200, 301, 302)
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+
+class CheckResult:
+    """Outcome of probing one URL"""
+    __slots__ = ('item', 'url', 'host', 'ok', 'status', 'latency', 'details')
+
+    def __init__(self, item, url, host, ok, status, latency, details=None):
+        self.item = item
+        self.url = url
+        self.host = host
+        self.ok = ok
+        self.status = status
+        self.latency = latency
+        self.details = details
+
+    def __repr__(self):
+        return f'CheckResult({self.url!r}, ok={self.ok}, status={self.status!r})'
+
+
+def _url_of(item):
+    return item if isinstance(item, str) else item.url
+
+
+class StreamChecker:
+    """
+    Probe many URLs concurrently over one shared aiohttp session.
+
+    Connections are kept alive and pooled per host, so a sweep over thousands
+    of channels on a handful of origins pays the TCP/TLS handshake once per
+    pooled connection instead of once per URL. `concurrency` caps requests in
+    flight overall and `per_host` caps them per origin.
+
+    Subclasses can override probe() to change what "working" means (e.g. a
+    ranged GET instead of a HEAD).
+
+    With a host_guard.HostGuard, probes are paced per host and hosts whose
+    circuit is open are reported as 'host down' without a request.
+    """
+
+    def __init__(self, concurrency=50, per_host=6, timeout=5,
+                 ok_statuses=OK_STATUSES, headers=None, url_of=_url_of, guard=None):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.ok_statuses = ok_statuses
+        self.url_of = url_of
+        self.guard = guard
+        self.headers = {'User-Agent': USER_AGENT}
+        if headers:
+            self.headers.update(headers)
+        self._global = None
+        self._hosts = {}
+
+    def open_session(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.per_host,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def probe(self, session, url):
+        """Return (ok, status) or (ok, status, details) for one URL"""
+        async with session.head(url, allow_redirects=True) as response:
+            return response.status in self.ok_statuses, response.status
+
+    def _host_limit(self, host):
+        sem = self._hosts.get(host)
+        if sem is None:
+            sem = self._hosts[host] = asyncio.Semaphore(self.per_host)
+        return sem
+
+    async def check(self, session, item):
+        """Probe one item (a URL string or anything with a .url by default)"""
+        url = self.url_of(item)
+        host = urlparse(url).netloc
+        guard = self.guard
+        # Wait for a slot first so queueing time is not counted as latency.
+        # The circuit is checked once the host slot is ours, so probes queued
+        # behind the failures that opened it return at once.
+        async with self._host_limit(host):
+            if guard and not guard.allow(host):
+                return CheckResult(item, url, host, False, HOST_DOWN, 0.0)
+            try:
+                if guard:
+                    await guard.throttle_async(host)
+                async with self._global:
+                    start = time.perf_counter()
+                    details = None
+                    try:
+                        outcome = await self.probe(session, url)
+                        ok, status = outcome[0], outcome[1]
+                        if len(outcome) > 2:
+                            details = outcome[2]
+                    except asyncio.TimeoutError:
+                        ok, status = False, 'Timeout'
+                    except aiohttp.ClientConnectionError:
+                        ok, status = False, 'Connection Error'
+                    except Exception as e:
+                        ok, status = False, str(e) or type(e).__name__
+                    latency = time.perf_counter() - start
+            except asyncio.CancelledError:
+                # Cancelled while throttled, queued or probing: free a
+                # half-open trial slot that allow() may have granted
+                if guard:
+                    guard.record(host, None)
+                raise
+            if guard:
+                guard.record(host, status)
+        return CheckResult(item, url, host, ok, status, latency, details)
+
+    async def stream(self, items):
+        """Async-iterate CheckResults in completion order"""
+        self._global = asyncio.Semaphore(self.concurrency)
+        self._hosts = {}
+        async with self.open_session() as session:
+            tasks = [asyncio.ensure_future(self.check(session, item)) for item in items]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    yield await next_done
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    async def _run(self, items, on_result):
+        results = []
+        async for result in self.stream(items):
+            if on_result:
+                on_result(result)
+            results.append(result)
+        return results
+
+    def run(self, items, on_result=None):
+        """
+        Check every item and return the list of CheckResults.
+
+        `on_result` is called with each result as soon as it arrives.
+        """
+        return asyncio.run(self._run(items, on_result))
+
+
+def check_streams(items, on_result=None, **kwargs):
+    """Convenience wrapper: StreamChecker(**kwargs).run(items, on_result)"""
+    return StreamChecker(**kwargs).run(items, on_result)
@@ -2,12 +2,20 @@
 """
 Test IPTV channels and EPG data
 """
+import argparse
 import requests
-import re
-import concurrent.futures
 from urllib.parse import urlparse
 import time
-import xml.etree.ElementTree as ET
+
+import metrics
+from channel_monitor import AdaptivePolicy, ChannelMonitor
+from epg_cache import open_guide
+from health_store import DEFAULT_DB, HealthStore
+from host_guard import HostGuard
+from hls_probe import probe_streams
+from m3u_parser import iter_channels, read_header
+from playlist_diff import affected_streams, check_patch_target, load_patch
+from stream_checker import check_streams
 
 def test_channel_stream(url, timeout=5):
     """Test if a stream URL is accessible"""
@@ -27,20 +35,8 @@ def test_epg_data(epg_url, tvg_ids):
     """Test if EPG data is available for given tvg-ids"""
     print(f"\nTesting EPG from: {epg_url}")
     try:
-        response = requests.get(epg_url, timeout=10)
-        if response.status_code != 200:
-            return {}, f"EPG fetch failed: {response.status_code}"
-        
-        # Parse XML
-        root = ET.fromstring(response.content)
-        
-        # Find all channels in EPG
-        epg_channels = {}
-        for channel in root.findall('.//channel'):
-            channel_id = channel.get('id')
-            if channel_id:
-                display_name = channel.find('display-name')
-                epg_channels[channel_id] = display_name.text if display_name is not None else channel_id
+        with open_guide(epg_url) as guide:
+            epg_channels = guide.channels
         
         # Check which of our channels have EPG
         matched = {}
@@ -53,62 +49,114 @@ def test_epg_data(epg_url, tvg_ids):
         
         return matched, unmatched
         
+    except requests.exceptions.HTTPError as e:
+        return {}, f"EPG fetch failed: {e.response.status_code}"
     except Exception as e:
         return {}, f"EPG parse error: {str(e)}"
 
 def parse_m3u(filename):
     """Parse M3U file and extract channel info"""
-    channels = []
-    tvg_ids = []
-    epg_url = None
-    
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-    
-    # Get EPG URL
-    if lines[0].startswith('#EXTM3U'):
-        match = re.search(r'url-tvg="([^"]+)"', lines[0])
-        if match:
-            epg_url = match.group(1)
-    
-    # Parse channels
-    for i in range(len(lines)):
-        if lines[i].startswith('#EXTINF'):
-            if i+1 < len(lines) and lines[i+1].startswith('http'):
-                # Extract channel info
-                info_line = lines[i]
-                url = lines[i+1].strip()
-                
-                # Get channel name
-                name_match = re.search(r',(.+)$', info_line)
-                name = name_match.group(1) if name_match else "Unknown"
-                
-                # Get tvg-id
-                tvg_match = re.search(r'tvg-id="([^"]+)"', info_line)
-                tvg_id = tvg_match.group(1) if tvg_match else None
-                
-                channels.append({
-                    'name': name,
-                    'url': url,
-                    'tvg_id': tvg_id
-                })
-                
-                if tvg_id:
-                    tvg_ids.append(tvg_id)
+    channels = list(iter_channels(filename))
+    tvg_ids = [ch.tvg_id for ch in channels if ch.tvg_id]
+    epg_url = read_header(filename).get('url-tvg')
     
     return channels, tvg_ids, epg_url
 
+def monitor(args):
+    """Check channels continuously instead of once (no menu)"""
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        print(f"Metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+    store = HealthStore(args.history)
+    policy = AdaptivePolicy(min_interval=args.min_interval, healthy_max=args.max_interval)
+    guard = HostGuard(args.trip_after, rate=args.host_rate)
+    mon = ChannelMonitor(lambda: parse_m3u(args.playlist)[0], guard.guarded(test_channel_stream),
+                         playlist_path=args.playlist, policy=policy, per_minute=args.budget,
+                         workers=args.workers, store=store)
+
+    def report(result, state, changed):
+        metrics.observe_probe(result)
+        if changed:
+            counts = mon.summary()
+            for condition in ('new', 'healthy', 'failing', 'flapping', 'dead'):
+                metrics.MONITOR_CHANNELS.set(counts.get(condition, 0), condition=condition)
+        if changed or args.verbose:
+            status_symbol = "✓" if result.ok else "✗"
+            interval = f"{state.interval:.0f}s" if state.interval < 120 else f"{state.interval / 60:.0f}m"
+            print(f"{time.strftime('%H:%M:%S')} {status_symbol} {result.item.name[:40]:40} "
+                  f"- {result.status} [{state.condition}, next in {interval}]")
+        if mon.probes % 100 == 0:
+            counts = ', '.join(f"{n} {c}" for c, n in sorted(mon.summary().items()))
+            print(f"{time.strftime('%H:%M:%S')} {mon.probes} probes: {counts}")
+
+    mon.listeners.append(report)
+    print(f"Monitoring {args.playlist} ({args.budget} probes/minute max, Ctrl+C to stop)")
+    try:
+        mon.run()
+    except KeyboardInterrupt:
+        print("\nStopping...")
+    finally:
+        store.close()
+
 def main():
+    parser = argparse.ArgumentParser(description='Test IPTV channels and EPG data')
+    parser.add_argument('--deep', action='store_true',
+                       help='Deep HLS probe: fetch variant playlist and first segment, '
+                            'report TTFB and throughput')
+    parser.add_argument('--history', default=DEFAULT_DB,
+                       help='SQLite file every probe result is recorded in (default: .health.sqlite)')
+    parser.add_argument('--fresh', type=float, default=0,
+                       help='Skip channels verified working within the last N minutes')
+    parser.add_argument('--monitor', action='store_true',
+                       help='Run continuously, rechecking each channel on an adaptive interval')
+    parser.add_argument('--playlist', default='playlist1.m3u',
+                       help='Playlist to test (default: playlist1.m3u)')
+    parser.add_argument('--budget', type=int, default=120,
+                       help='Monitor: maximum probes per minute across all channels')
+    parser.add_argument('--workers', type=int, default=8,
+                       help='Monitor: concurrent probes')
+    parser.add_argument('--min-interval', type=float, default=60,
+                       help='Monitor: seconds before a failing channel is rechecked')
+    parser.add_argument('--max-interval', type=float, default=3600,
+                       help='Monitor: seconds between checks of a stable healthy channel')
+    parser.add_argument('--verbose', action='store_true',
+                       help='Monitor: print every probe, not just state changes')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                       help='Monitor: serve Prometheus metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--trip-after', type=int, default=3,
+                       help='Consecutive timeouts/connection errors before a host is marked down')
+    parser.add_argument('--host-rate', type=float, default=10,
+                       help='Maximum probes per second to any one host (0 = unlimited)')
+    parser.add_argument('--metrics-file',
+                       help='Write probe and EPG metrics here for the node_exporter textfile collector (.prom)')
+    parser.add_argument('--patch',
+                       help='Only recheck channels added or moved in this playlist_diff.py patch (no menu)')
+    args = parser.parse_args()
+    
+    if args.monitor:
+        monitor(args)
+        return
+    
     print("IPTV Channel and EPG Tester")
     print("=" * 50)
     
     # Parse playlist
-    channels, tvg_ids, epg_url = parse_m3u('playlist1.m3u')
+    channels, tvg_ids, epg_url = parse_m3u(args.playlist)
     print(f"Found {len(channels)} channels")
     print(f"Found {len(tvg_ids)} channels with EPG IDs")
     
+    patch = None
+    if args.patch:
+        patch = load_patch(args.patch)
+        warning = check_patch_target(patch, args.playlist)
+        if warning:
+            print(f"Warning: {warning}")
+        # Only tvg-ids the patch introduced need an EPG lookup
+        tvg_ids = [c['tvg_id'] for c in patch['changes']
+                   if c['tvg_id'] and (c['op'] in ('added', 'url_changed') or 'tvg_id' in c.get('fields', {}))]
+    
     # Test EPG first
-    if epg_url:
+    if epg_url and tvg_ids:
         print(f"\nTesting EPG: {epg_url}")
         matched, unmatched = test_epg_data(epg_url, list(set(tvg_ids)))
         if isinstance(unmatched, str):
@@ -119,29 +167,46 @@ def main():
             if unmatched and len(unmatched) < 20:
                 print(f"  Missing: {', '.join(unmatched[:20])}")
     
-    # Ask user what to test
-    print("\nChannel Testing Options:")
-    print("1. Test first 10 channels")
-    print("2. Test specific domain channels")
-    print("3. Test all channels (may take a while)")
-    print("4. Skip channel testing")
-    
-    choice = input("\nEnter choice (1-4): ").strip()
+    if patch:
+        choice = 'patch'
+    else:
+        # Ask user what to test
+        print("\nChannel Testing Options:")
+        print("1. Test first 10 channels")
+        print("2. Test specific domain channels")
+        print("3. Test all channels (may take a while)")
+        print("4. Skip channel testing")
+        
+        choice = input("\nEnter choice (1-4): ").strip()
     
     if choice == '4':
         return
     
     # Select channels to test
-    if choice == '1':
+    if choice == 'patch':
+        urls = affected_streams(patch)
+        test_channels = [ch for ch in channels if ch.url in urls]
+        summary = patch['summary']
+        print(f"\nPatch {args.patch}: {summary['added']} added, {summary['url_changed']} URL changed, "
+              f"{summary['metadata']} metadata-only, {summary['removed']} removed")
+    elif choice == '1':
         test_channels = channels[:10]
     elif choice == '2':
         domain = input("Enter domain to test (e.g., moveonjoy.com): ").strip()
-        test_channels = [ch for ch in channels if domain in ch['url']]
+        test_channels = [ch for ch in channels if domain in ch.url]
     else:
         test_channels = channels
     
+    kind = 'deep' if args.deep else 'stream'
+    store = HealthStore(args.history)
+    if args.fresh:
+        selected = len(test_channels)
+        test_channels = store.stale(test_channels, args.fresh * 60, kind)
+        print(f"\nSkipping {selected - len(test_channels)} channels verified in the last {args.fresh:g} minutes")
+    
     if not test_channels:
         print("No channels to test")
+        store.close()
         return
     
     print(f"\nTesting {len(test_channels)} channels...")
@@ -151,23 +216,32 @@ def main():
     working = []
     failed = []
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_channel = {
-            executor.submit(test_channel_stream, ch['url']): ch 
-            for ch in test_channels
-        }
+    def report(result):
+        channel = result.item
+        status_symbol = "✓" if result.ok else "✗"
+        line = f"{len(working) + len(failed) + 1:3}. {status_symbol} {channel.name[:40]:40} - {result.status}"
+        if result.details:
+            line += f" ({result.details.summary()})"
+        print(line)
         
-        for i, future in enumerate(concurrent.futures.as_completed(future_to_channel), 1):
-            channel = future_to_channel[future]
-            success, status = future.result()
-            
-            status_symbol = "✓" if success else "✗"
-            print(f"{i:3}. {status_symbol} {channel['name'][:40]:40} - {status}")
-            
-            if success:
-                working.append(channel)
-            else:
-                failed.append(channel)
+        if result.ok:
+            working.append(channel)
+        else:
+            failed.append(channel)
+    
+    # Pooled keep-alive connections, capped and paced per host so no origin
+    # gets hammered; hosts that stop answering are marked down after a few
+    # failures instead of every channel waiting out its own timeout
+    guard = HostGuard(args.trip_after, rate=args.host_rate)
+    with store:
+        if args.deep:
+            probe_streams(test_channels, store.recorder(kind, metrics.recorder(kind, report)),
+                          concurrency=20, per_host=4, guard=guard)
+        else:
+            check_streams(test_channels, store.recorder(kind, metrics.recorder(kind, report)),
+                          concurrency=50, per_host=6, guard=guard)
+    if args.metrics_file:
+        metrics.write_textfile(args.metrics_file)
     
     # Summary
     print("\n" + "=" * 50)
@@ -183,12 +257,17 @@ def main():
     if failed:
         failed_domains = {}
         for ch in failed:
-            domain = urlparse(ch['url']).netloc
+            domain = urlparse(ch.url).netloc
             failed_domains[domain] = failed_domains.get(domain, 0) + 1
         
         print("\nFailed channels by domain:")
         for domain, count in sorted(failed_domains.items(), key=lambda x: x[1], reverse=True):
             print(f"  {domain}: {count} channels")
+    
+    if guard.short_circuited:
+        print(f"\n{guard.short_circuited} channels skipped on hosts marked down: {', '.join(guard.down_hosts())}")
+    
+    print(f"\nResults recorded in {args.history} (python health_store.py for history)")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
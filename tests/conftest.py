@@ -0,0 +1,94 @@
+"""Shared fixtures: the repo on sys.path and a local stand-in HTTP server"""
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+
+
+class Route:
+    """What the stub serves for one path; tests change it between requests"""
+
+    def __init__(self, body=b'', status=200, headers=None, chunked=False, truncate=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+        self.chunked = chunked
+        self.truncate = truncate    # send only this many body bytes, then drop the connection
+
+
+class StubServer:
+    """
+    ThreadingHTTPServer on 127.0.0.1 serving `routes` {path: Route or
+    callable(handler) -> Route}. Every request is logged as (method, path,
+    headers) in `requests`.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _serve(self, send_body):
+                stub.requests.append((self.command, self.path, dict(self.headers)))
+                route = stub.routes.get(self.path)
+                if callable(route):
+                    route = route(self)
+                if route is None:
+                    route = Route(b'not found', 404)
+                self.send_response(route.status)
+                for name, value in route.headers.items():
+                    self.send_header(name, value)
+                if route.chunked:
+                    self.send_header('Transfer-Encoding', 'chunked')
+                else:
+                    self.send_header('Content-Length', str(len(route.body)))
+                self.end_headers()
+                if not send_body or route.status == 304:
+                    return
+                if route.truncate is not None:
+                    self.wfile.write(route.body[:route.truncate])
+                    self.close_connection = True
+                elif route.chunked:
+                    for i in range(0, len(route.body), 16384):
+                        chunk = route.body[i:i + 16384]
+                        self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                    self.wfile.write(b'0\r\n\r\n')
+                else:
+                    self.wfile.write(route.body)
+
+            def do_GET(self):
+                self._serve(True)
+
+            def do_HEAD(self):
+                self._serve(False)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}{path}'
+
+    def hits(self, path):
+        return sum(1 for _, p, _ in self.requests if p == path)
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    server.thread.start()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
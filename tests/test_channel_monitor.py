@@ -0,0 +1,44 @@
+from channel_monitor import DEAD_AFTER, AdaptivePolicy, ChannelState
+
+
+def state_after(outcomes):
+    state = ChannelState(None)
+    for ok in outcomes:
+        state.history.append(ok)
+        state.failures = 0 if ok else state.failures + 1
+        state.last_ok = ok
+    return state
+
+
+def test_long_failure_after_one_success_backs_off():
+    policy = AdaptivePolicy(jitter=0)
+    intervals = []
+    for failures in range(DEAD_AFTER, DEAD_AFTER + 4):
+        state = state_after([False, True] + [False] * failures)
+        assert state.condition == 'dead'
+        intervals.append(policy.next_interval(state))
+    assert intervals == [policy.dead_base * 2 ** n for n in range(4)]
+
+
+def test_up_down_channel_is_flapping():
+    policy = AdaptivePolicy(jitter=0)
+    state = state_after([True, False, True, False])
+    assert state.condition == 'flapping'
+    assert policy.next_interval(state) == policy.flapping_interval
+
+
+def test_recovered_dead_channel_restarts_the_healthy_ramp():
+    policy = AdaptivePolicy(jitter=0)
+    state = state_after([True] + [False] * 8)
+    assert state.condition == 'dead'
+    policy.next_interval(state)
+    assert state.interval > policy.healthy_max
+
+    intervals = []
+    for _ in range(3):
+        state.history.append(True)
+        state.failures = 0
+        state.last_ok = True
+        intervals.append(policy.next_interval(state))
+    assert state.condition == 'healthy'
+    assert intervals == [policy.min_interval, 2 * policy.min_interval, 4 * policy.min_interval]
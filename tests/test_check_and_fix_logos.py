@@ -0,0 +1,17 @@
+from check_and_fix_logos import LogoChecker
+
+
+def test_alternatives_are_per_channel(tmp_path, monkeypatch):
+    checker = LogoChecker(str(tmp_path / 'playlist.m3u'), cache_file=str(tmp_path / 'cache.json'))
+    checked = []
+    monkeypatch.setattr(checker, 'check_logo_url', lambda url: checked.append(url) or True)
+
+    hbo = checker.find_alternative_logo('http://x/hbo.png', 'USA HBO')
+    starz = checker.find_alternative_logo('http://x/starz.png', 'USA Starz')
+    assert hbo != starz
+    assert 'USA+HBO' in hbo and 'USA+Starz' in starz
+
+    # A known-logo hit is looked up once and shared by the key
+    assert checker.find_alternative_logo('http://x/a.png', 'FOX News') == checker.known_working_logos['fox']
+    assert checker.find_alternative_logo('http://x/b.png', 'FOX Sports') == checker.known_working_logos['fox']
+    assert checked == [checker.known_working_logos['fox']]
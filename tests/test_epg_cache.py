@@ -0,0 +1,97 @@
+import os
+import sqlite3
+
+import pytest
+
+from conftest import Route
+from epg_cache import EPGCache, open_guide
+from metrics import STAGE_FAILURES, STAGE_SECONDS
+
+GUIDE = '''<?xml version="1.0" encoding="UTF-8"?>
+<tv>
+  <channel id="one.us"><display-name>One</display-name></channel>
+  <programme channel="one.us" start="20260101000000 +0000" stop="20260101010000 +0000"><title>{title}</title></programme>
+  <programme channel="one.us" start="20260101010000 +0000" stop="20260101020000 +0000"><title>Late</title></programme>
+</tv>
+'''
+
+
+def conditional(body, etag):
+    """Route answering 304 when the client already has `etag`"""
+    def serve(handler):
+        if handler.headers.get('If-None-Match') == etag:
+            return Route(status=304, headers={'ETag': etag})
+        return Route(body, headers={'ETag': etag, 'Content-Type': 'application/xml'})
+    return serve
+
+
+def titles(cache, url):
+    return [p.title for p in cache.open(url).programmes('one.us')]
+
+
+def test_refresh_revalidates_and_rebuilds_only_on_new_content(stub, tmp_path):
+    url = stub.url('/guide.xml')
+    cache = EPGCache(str(tmp_path), max_age=3600)
+    try:
+        stub.routes['/guide.xml'] = conditional(GUIDE.format(title='Early').encode(), '"v1"')
+        assert cache.refresh(url) == 'rebuilt'
+        assert titles(cache, url) == ['Early', 'Late']
+
+        # Within max_age nothing is requested
+        requests_made = len(stub.requests)
+        assert cache.refresh(url) == 'fresh'
+        assert len(stub.requests) == requests_made
+
+        assert cache.refresh(url, force=True) == 'not-modified'
+        assert stub.requests[-1][2].get('If-None-Match') == '"v1"'
+
+        # Same bytes under a new validator: no rebuild
+        stub.routes['/guide.xml'] = conditional(GUIDE.format(title='Early').encode(), '"v2"')
+        assert cache.refresh(url, force=True) == 'unchanged'
+
+        stub.routes['/guide.xml'] = conditional(GUIDE.format(title='Changed').encode(), '"v3"')
+        assert cache.refresh(url, force=True) == 'rebuilt'
+        assert titles(cache, url) == ['Changed', 'Late']
+    finally:
+        cache.close()
+
+
+def test_request_error_serves_the_stale_copy(stub, tmp_path):
+    url = stub.url('/guide.xml')
+    stub.routes['/guide.xml'] = Route(GUIDE.format(title='Early').encode())
+    cache = EPGCache(str(tmp_path), max_age=0, timeout=2)
+    try:
+        assert cache.refresh(url) == 'rebuilt'
+        stub.httpd.shutdown()
+        stub.httpd.server_close()
+        failures = STAGE_FAILURES.value(stage='epg_fetch')
+        fetches = STAGE_SECONDS.count(stage='epg_fetch')
+        assert cache.refresh(url) == 'stale'
+        # Serving the old copy still shows up as a failed fetch
+        assert STAGE_FAILURES.value(stage='epg_fetch') == failures + 1
+        assert STAGE_SECONDS.count(stage='epg_fetch') == fetches
+        assert titles(cache, url) == ['Early', 'Late']
+    finally:
+        cache.close()
+
+
+def test_server_error_serves_the_stale_copy(stub, tmp_path):
+    url = stub.url('/guide.xml')
+    stub.routes['/guide.xml'] = Route(GUIDE.format(title='Early').encode())
+    cache = EPGCache(str(tmp_path), max_age=0)
+    try:
+        assert cache.refresh(url) == 'rebuilt'
+        stub.routes['/guide.xml'] = Route(b'down', 503)
+        assert cache.refresh(url) == 'stale'
+        assert [name for name in os.listdir(tmp_path) if name.endswith('.part')] == []
+    finally:
+        cache.close()
+
+
+def test_open_guide_closes_the_cache(stub, tmp_path):
+    url = stub.url('/guide.xml')
+    stub.routes['/guide.xml'] = Route(GUIDE.format(title='Early').encode())
+    with open_guide(url, cache_dir=str(tmp_path)) as guide:
+        assert [p.title for p in guide.programmes('one.us')] == ['Early', 'Late']
+    with pytest.raises(sqlite3.ProgrammingError):
+        guide.db.execute('SELECT 1')
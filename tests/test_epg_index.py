@@ -0,0 +1,55 @@
+import gc
+
+import epg_index
+from epg_index import ingest, parallel_ingest, parse_xmltv_time
+
+
+def write_interleaved_guide(path, channels=20, slots=50):
+    """Programmes in time order across channels, so every shard holds every channel"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE tv SYSTEM "xmltv.dtd">\n<tv>\n')
+        for c in range(channels):
+            f.write(f'  <channel id="c{c}.us"><display-name>Channel {c}</display-name></channel>\n')
+        for s in range(slots):
+            for c in range(channels):
+                f.write(f'  <programme channel="c{c}.us" start="202601{1 + s // 24:02d}{s % 24:02d}0000 +0000" '
+                        f'stop="202601{1 + (s + 1) // 24:02d}{(s + 1) % 24:02d}0000 +0000">'
+                        f'<title>Show {s}</title><desc>About {c}/{s}</desc></programme>\n')
+        f.write('</tv>\n')
+
+
+def snapshot(index):
+    return index.channels, {c: [(p.start, p.stop, p.title, p.desc) for p in index.programmes(c)]
+                            for c in index.channel_ids()}
+
+
+def test_parallel_ingest_matches_ingest(tmp_path, monkeypatch):
+    path = str(tmp_path / 'guide.xml')
+    write_interleaved_guide(path)
+    monkeypatch.setattr(epg_index, 'PARALLEL_MIN_BYTES', 0)
+
+    assert snapshot(parallel_ingest(path, workers=2)) == snapshot(ingest(path))
+    wanted = {'c3.us', 'c11.us'}
+    assert (snapshot(parallel_ingest(path, channel_filter=wanted, workers=2))
+            == snapshot(ingest(path, channel_filter=wanted)))
+    # Garbage collection is only ever paused inside the worker processes
+    assert gc.isenabled()
+
+
+def test_parse_xmltv_time_offsets():
+    assert parse_xmltv_time('20260101120000 +0000') == 1767268800
+    assert parse_xmltv_time('20260101120000 +0130') == 1767268800 - 5400
+    assert parse_xmltv_time('20260101120000 -0500') == 1767268800 + 18000
+    assert parse_xmltv_time('20260101120000') == 1767268800
+    for bad in ('20260101120000 +01', '20260101120000 +0X00', '2026010112XX00 +0000'):
+        assert parse_xmltv_time(bad) is None
+
+
+def test_bad_offset_skips_the_programme_not_the_guide(tmp_path):
+    path = tmp_path / 'guide.xml'
+    path.write_text(
+        '<tv><channel id="a.us"><display-name>A</display-name></channel>'
+        '<programme channel="a.us" start="20260101120000 +0X00"><title>Bad</title></programme>'
+        '<programme channel="a.us" start="20260101130000 +0000"><title>Good</title></programme></tv>')
+    index = ingest(str(path))
+    assert [p.title for p in index.programmes('a.us')] == ['Good']
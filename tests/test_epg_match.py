@@ -0,0 +1,44 @@
+import random
+
+from epg_match import ChannelIndex
+
+NETWORKS = ('ABC', 'NBC', 'CBS', 'FOX', 'Syfy', 'ESPN', 'CNN', 'HBO', 'Starz', 'TNT',
+            'TBS', 'AMC', 'Bravo', 'Disney', 'Nick', 'MTV', 'VH1', 'TLC', 'HGTV', 'Food')
+CITIES = ('Boston', 'Chicago', 'Denver', 'Austin', 'Miami', 'Seattle', 'Phoenix', 'Dallas', 'Atlanta', 'Portland')
+
+
+def call_sign(n):
+    letters = ''
+    for _ in range(3):
+        n, r = divmod(n, 26)
+        letters += chr(ord('A') + r)
+    return f'K{letters}.us'
+
+
+def shared_token_guide():
+    """
+    Call-sign ids (nothing to match on) and names that share each of their
+    tokens with hundreds of others: {id: name} plus {name: id}
+    """
+    channels = {}
+    for network in NETWORKS:
+        for city in CITIES:
+            for number in range(2, 61):
+                channels[call_sign(len(channels))] = f'{network} {number} {city}'
+    return channels, {name: channel_id for channel_id, name in channels.items()}
+
+
+def test_common_tokens_do_not_hide_the_exact_name():
+    channels, ids = shared_token_guide()
+    index = ChannelIndex(channels)
+    assert index.search('ABC 28 Boston')[0].channel_id == ids['ABC 28 Boston']
+    assert index.search('Syfy 28 Boston')[0].channel_id == ids['Syfy 28 Boston']
+
+
+def test_exact_display_names_find_themselves():
+    channels, _ = shared_token_guide()
+    index = ChannelIndex(channels)
+    sample = random.Random(7).sample(sorted(channels), 500)
+    missed = [channel_id for channel_id in sample
+              if index.search(channels[channel_id])[0].channel_id != channel_id]
+    assert missed == []
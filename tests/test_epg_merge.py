@@ -0,0 +1,35 @@
+import gzip
+
+from conftest import Route
+from epg_merge import build
+from m3u_parser import parse_extinf
+
+NOW = 1767225600    # 2026-01-01 00:00 UTC
+
+GUIDE = '''<?xml version="1.0" encoding="UTF-8"?>
+<tv>
+  <channel id="{id}"><display-name>{id}</display-name></channel>
+''' + ''.join(
+    f'  <programme channel="{{id}}" start="202601010{h}0000 +0000" stop="202601010{h + 1}0000 +0000">'
+    f'<title>Show {h}</title></programme>\n' for h in range(8)) + '</tv>\n'
+
+
+def channel(tvg_id):
+    return parse_extinf(f'#EXTINF:-1 tvg-id="{tvg_id}",{tvg_id}', f'http://example.com/{tvg_id}.m3u8')
+
+
+def test_source_dying_mid_body_does_not_abort_the_merge(stub, tmp_path):
+    good = GUIDE.format(id='one.us').encode()
+    broken = GUIDE.format(id='two.us').encode()
+    stub.routes['/good.xml'] = Route(good)
+    stub.routes['/dropped.xml'] = Route(broken, truncate=len(broken) // 2)
+    stub.routes['/corrupt.xml.gz'] = Route(gzip.compress(broken)[:10] + b'\xff' * 64)
+    sources = [stub.url('/dropped.xml'), stub.url('/corrupt.xml.gz'), stub.url('/good.xml')]
+    output = str(tmp_path / 'guide.xml')
+
+    guides, channels, programmes = build(sources, [channel('one.us'), channel('two.us')],
+                                         output, now=NOW, timeout=5)
+    assert [g.error is None for g in guides] == [False, False, True]
+    assert (channels, programmes) == (1, 8)
+    with open(output, 'rb') as f:
+        assert b'two.us' not in f.read()
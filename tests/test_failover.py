@@ -0,0 +1,43 @@
+from failover import current_urls, group_failover, rerank, sidecar_path, write_sidecar
+from health_store import HealthStats
+
+INFO = '#EXTINF:-1 tvg-id="CNN.us" group-title="News",CNN'
+
+
+def live(url, p50):
+    entry = HealthStats(url)
+    entry.probes = entry.ok = 10
+    entry.p50 = p50
+    entry.last_checked = entry.last_verified = 1000.0
+    return entry
+
+
+def test_merge_keeps_the_mirror_rerank_switched_to(tmp_path):
+    playlist = str(tmp_path / 'playlist1.m3u')
+    sidecar = sidecar_path(playlist)
+    categories = {'News': [('http://a/cnn.m3u8', INFO), ('http://b/cnn.m3u8', INFO)]}
+
+    # b is faster, so the first merge picks it
+    stats = {'http://a/cnn.m3u8': live('http://a/cnn.m3u8', 1.0),
+             'http://b/cnn.m3u8': live('http://b/cnn.m3u8', 0.5)}
+    merged, sets = group_failover(categories, stats)
+    assert merged['News'] == [('http://b/cnn.m3u8', INFO)]
+    write_sidecar(sidecar, playlist, sets)
+    with open(playlist, 'w') as f:
+        f.write('#EXTM3U\n' + INFO + '\nhttp://b/cnn.m3u8\n')
+
+    # b dies: failover.py switches the playlist to a
+    stats['http://b/cnn.m3u8'].last_verified = 0.0
+    assert [(old, new) for _, old, new in rerank(playlist, stats, sidecar)] == \
+        [('http://b/cnn.m3u8', 'http://a/cnn.m3u8')]
+    assert current_urls(sidecar) == {'cnn.us': 'http://a/cnn.m3u8'}
+
+    # b recovers, only slightly faster: within SWITCH_MARGIN neither tool flips back
+    stats['http://b/cnn.m3u8'] = live('http://b/cnn.m3u8', 0.9)
+    merged, _ = group_failover(categories, stats, current_urls(sidecar))
+    assert merged['News'] == [('http://a/cnn.m3u8', INFO)]
+    assert rerank(playlist, stats, sidecar) == []
+
+
+def test_current_urls_without_a_sidecar(tmp_path):
+    assert current_urls(str(tmp_path / 'missing.failover.json')) == {}
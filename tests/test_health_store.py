@@ -0,0 +1,15 @@
+from health_store import HealthStore
+from host_guard import HOST_DOWN
+from stream_checker import CheckResult
+
+URL = 'http://a.example/live.m3u8'
+
+
+def test_host_down_results_are_not_recorded_as_probes(tmp_path):
+    with HealthStore(str(tmp_path / 'health.sqlite')) as store:
+        record = store.recorder('stream')
+        record(CheckResult(URL, URL, 'a.example', True, 200, 0.2))
+        record(CheckResult(URL, URL, 'a.example', False, HOST_DOWN, 0.0))
+        stats = store.channel_stats('stream')[URL]
+        assert (stats.probes, stats.ok, stats.uptime) == (1, 1, 100.0)
+        assert store.last_checked(URL)[1:] == (True, '200')
@@ -0,0 +1,54 @@
+import time
+
+from conftest import Route
+from hls_probe import HLSProbe
+
+MASTER = ('#EXTM3U\n'
+          '#EXT-X-STREAM-INF:BANDWIDTH=2000000,RESOLUTION=1280x720\nhi/index.m3u8\n'
+          '#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360\nlo/index.m3u8\n')
+MEDIA = '#EXTM3U\n#EXT-X-TARGETDURATION:4\n#EXTINF:4.0,\nseg0.ts\n#EXTINF:4.0,\nseg1.ts\n'
+SEGMENT = b'\x47' * 188 * 2000
+
+
+def hls_origin(stub, segment_delay=0.0):
+    stub.routes['/live/master.m3u8'] = Route(MASTER.encode())
+    stub.routes['/live/lo/index.m3u8'] = Route(MEDIA.encode())
+    stub.routes['/live/hi/index.m3u8'] = Route(MEDIA.encode())
+
+    def segment(handler):
+        time.sleep(segment_delay)
+        return Route(SEGMENT, headers={'Content-Type': 'video/mp2t'})
+    stub.routes['/live/lo/seg0.ts'] = segment
+    stub.routes['/live/hi/seg0.ts'] = segment
+
+
+def test_master_variant_segment_metrics(stub):
+    hls_origin(stub, segment_delay=0.05)
+    result, = HLSProbe().run([stub.url('/live/master.m3u8')])
+
+    assert result.ok, result.status
+    metrics = result.details
+    assert metrics.variant_url == stub.url('/live/lo/index.m3u8')
+    assert metrics.bandwidth == 800000
+    assert metrics.segment_url == stub.url('/live/lo/seg0.ts')
+    assert metrics.target_duration == 4.0 and metrics.segment_count == 2
+    assert metrics.segment_bytes == len(SEGMENT)
+    assert metrics.manifest_latency > 0 and metrics.playlist_latency > 0
+    assert 0.05 <= metrics.segment_ttfb <= metrics.segment_time
+    assert metrics.throughput == len(SEGMENT) * 8 / metrics.segment_time
+    assert metrics.bandwidth_ratio == metrics.throughput / 800000
+
+
+def test_highest_variant_and_failures(stub):
+    hls_origin(stub)
+    result, = HLSProbe(variant='highest').run([stub.url('/live/master.m3u8')])
+    assert result.ok and result.details.bandwidth == 2000000
+
+    stub.routes['/live/lo/index.m3u8'] = Route(b'#EXTM3U\n#EXT-X-TARGETDURATION:4\n')
+    result, = HLSProbe().run([stub.url('/live/master.m3u8')])
+    assert not result.ok and result.status == 'Empty playlist'
+
+    stub.routes['/live/lo/index.m3u8'] = Route(MEDIA.encode())
+    stub.routes['/live/lo/seg0.ts'] = Route(b'gone', 404)
+    result, = HLSProbe().run([stub.url('/live/master.m3u8')])
+    assert not result.ok and result.status == 'Segment 404'
@@ -0,0 +1,62 @@
+import time
+import asyncio
+
+from conftest import Route
+from hls_relay import HLSRelay, decode_url
+
+MEDIA = ('#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXT-X-MEDIA-SEQUENCE:1\n'
+         '#EXTINF:6.0,\nseg1.ts\n#EXTINF:6.0,\nseg2.ts\n')
+
+
+def relay_get(relay, urls):
+    async def fetch():
+        try:
+            return await asyncio.gather(*(relay.get(url) for url in urls))
+        finally:
+            await relay.close()
+    return asyncio.run(fetch())
+
+
+def slow(route, delay=0.2):
+    def serve(handler):
+        time.sleep(delay)
+        return route
+    return serve
+
+
+def test_concurrent_viewers_share_one_upstream_fetch(stub):
+    stub.routes['/live/seg1.ts'] = slow(Route(b'\x47' * 188 * 100, headers={'Content-Type': 'video/mp2t'}))
+    relay = HLSRelay()
+    relay.allow_hosts(['127.0.0.1'])
+
+    items = relay_get(relay, [stub.url('/live/seg1.ts')] * 20)
+    assert stub.hits('/live/seg1.ts') == 1
+    assert all(item.status == 200 and len(item.body) == 18800 for item in items)
+    assert relay.stats.coalesced == 19
+
+    # Later viewers are served from the segment cache
+    relay_get(relay, [stub.url('/live/seg1.ts')])
+    assert stub.hits('/live/seg1.ts') == 1
+    assert relay.stats.hits == 1
+
+
+def test_media_playlist_is_rewritten_and_cached_for_half_the_target_duration(stub):
+    stub.routes['/live/index.m3u8'] = Route(MEDIA.encode(), headers={'Content-Type': 'application/vnd.apple.mpegurl'})
+    relay = HLSRelay()
+    relay.allow_hosts(['127.0.0.1'])
+
+    item, = relay_get(relay, [stub.url('/live/index.m3u8')])
+    uris = [line for line in item.body.decode().splitlines() if line and not line.startswith('#')]
+    assert [decode_url(uri) for uri in uris] == [stub.url('/live/seg1.ts'), stub.url('/live/seg2.ts')]
+    assert all(uri.endswith('.ts') for uri in uris)
+    assert 2.9 < item.expires - time.monotonic() <= 3.0
+
+
+def test_unsized_body_over_the_limit_is_refused(stub):
+    stub.routes['/raw.ts'] = Route(b'\x47' * 200000, chunked=True)
+    relay = HLSRelay(max_object_bytes=64 * 1024)
+    relay.allow_hosts(['127.0.0.1'])
+
+    item, = relay_get(relay, [stub.url('/raw.ts')])
+    assert item.status == 502
+    assert len(relay.cache) == 0
@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+
+from conftest import Route
+import logo_mirror
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+
+
+def run(monkeypatch, *argv):
+    monkeypatch.setattr(sys, 'argv', ['logo_mirror.py', *argv])
+    logo_mirror.main()
+
+
+def test_second_run_keeps_mirrored_logos(stub, tmp_path, monkeypatch):
+    stub.routes['/a.png'] = Route(PNG, headers={'Content-Type': 'image/png', 'ETag': '"a1"'})
+    playlist = tmp_path / 'playlist.m3u'
+    playlist.write_text(
+        '#EXTM3U\n'
+        f'#EXTINF:-1 tvg-logo="{stub.url("/a.png")}",Channel A\nhttp://example.com/a.m3u8\n'
+        f'#EXTINF:-1 tvg-logo="{stub.url("/missing.png")}",Channel B\nhttp://example.com/b.m3u8\n',
+        encoding='utf-8')
+    mirror_dir = tmp_path / 'logos'
+    args = ['--input', str(playlist), '--dir', str(mirror_dir), '--base-url', 'logos/', '--ttl', '0']
+
+    run(monkeypatch, *args)
+    first = playlist.read_text(encoding='utf-8')
+    mirrored = sorted(f for f in os.listdir(mirror_dir) if f.endswith('.png'))
+    assert len(mirrored) == 1
+    assert f'tvg-logo="logos/{mirrored[0]}"' in first
+    assert 'tvg-logo="logos/placeholder-' in first
+
+    # The input now points at the mirror; the originals come back from the manifest
+    run(monkeypatch, *args)
+    assert playlist.read_text(encoding='utf-8') == first
+    assert sorted(f for f in os.listdir(mirror_dir) if f.endswith('.png')) == mirrored
+    assert stub.hits('/a.png') == 2
+    revalidation = [headers for _, path, headers in stub.requests if path == '/a.png'][-1]
+    assert revalidation.get('If-None-Match') == '"a1"'
+
+    with open(mirror_dir / 'manifest.json', encoding='utf-8') as f:
+        manifest = json.load(f)
+    assert manifest['channels'] == {'Channel A': stub.url('/a.png'), 'Channel B': stub.url('/missing.png')}
+
+
+def test_large_chunked_logo_is_stored_whole(stub, tmp_path):
+    body = PNG + bytes(range(256)) * 2048
+    stub.routes['/big.png'] = Route(body, headers={'Content-Type': 'image/png'}, chunked=True)
+    mirror = logo_mirror.LogoMirror(str(tmp_path / 'logos'), 'logos/')
+
+    file_name = mirror.refresh([stub.url('/big.png')])[stub.url('/big.png')]
+    assert (tmp_path / 'logos' / file_name).read_bytes() == body
+
+
+def test_mirrored_logo_unknown_to_manifest_is_kept(tmp_path, monkeypatch):
+    mirror_dir = tmp_path / 'logos'
+    mirror_dir.mkdir()
+    (mirror_dir / '0123456789abcdef.png').write_bytes(PNG)
+    playlist = tmp_path / 'playlist.m3u'
+    playlist.write_text('#EXTM3U\n#EXTINF:-1 tvg-logo="logos/0123456789abcdef.png",Channel A\n'
+                        'http://example.com/a.m3u8\n', encoding='utf-8')
+
+    run(monkeypatch, '--input', str(playlist), '--dir', str(mirror_dir), '--base-url', 'logos/')
+    assert 'tvg-logo="logos/0123456789abcdef.png"' in playlist.read_text(encoding='utf-8')
+    assert (mirror_dir / '0123456789abcdef.png').exists()
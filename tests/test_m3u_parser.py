@@ -0,0 +1,22 @@
+from m3u_parser import parse_attrs, parse_extinf
+from normalize_playlist import quote_attributes
+
+LINE = '#EXTINF:-1 tvg-id=disney.us group-title=Kids & Family,Disney Channel'
+
+
+def test_bare_value_runs_to_the_next_attribute_or_title():
+    ch = parse_extinf(LINE, 'http://example.com/disney.m3u8')
+    assert (ch.tvg_id, ch.group, ch.name) == ('disney.us', 'Kids & Family', 'Disney Channel')
+
+
+def test_parser_agrees_with_the_normalizer():
+    quoted, bare, has_title = quote_attributes(LINE.encode())
+    assert (bare, has_title) == (2, True)
+    normalized = parse_extinf(quoted.decode())
+    ch = parse_extinf(LINE)
+    assert (ch.tvg_id, ch.group, ch.name) == (normalized.tvg_id, normalized.group, normalized.name)
+
+
+def test_header_attributes():
+    assert parse_attrs('#EXTM3U url-tvg=http://example.com/guide.xml x-tvg-url="b"\n') == \
+        {'url-tvg': 'http://example.com/guide.xml', 'x-tvg-url': 'b'}
@@ -0,0 +1,29 @@
+import asyncio
+
+from host_guard import HALF_OPEN, HostGuard
+from stream_checker import StreamChecker
+
+URL = 'http://a.example/live.m3u8'
+
+
+def test_cancel_while_throttled_frees_the_half_open_trial():
+    guard = HostGuard(failure_threshold=1, reset_timeout=0, rate=1, burst=1)
+    breaker = guard.breaker('a.example')
+    breaker.record(False)
+    guard.delay('a.example')    # spend the only token so the next probe waits ~1s
+
+    async def run():
+        checker = StreamChecker(guard=guard)
+        checker._global = asyncio.Semaphore(1)
+        task = asyncio.ensure_future(checker.check(None, URL))
+        await asyncio.sleep(0.05)
+        assert breaker.state == HALF_OPEN and breaker.trial
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run())
+    assert not breaker.trial
+    assert guard.allow('a.example')